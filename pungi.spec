@@ -13,7 +13,7 @@ Requires:       createrepo >= 0.4.11
 Requires:       yum => 3.4.3-28
 Requires:       lorax >= 22.1
 Requires:       repoview
-Requires:       python-lockfile
+Requires:       xz
 
 BuildArch:      noarch
 
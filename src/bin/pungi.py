@@ -12,18 +12,197 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+import json
 import os
 import pypungi
+import pypungi.checkpoint
 import pypungi.config
 import pypungi.ks
+import pypungi.stages
+import pypungi.tracing
 import subprocess
 
+def print_package_list(prefix, package_list, list_format="text", tree_arch=None):
+    """
+    Print package records as they come, one write per line, so stages
+    running in parallel don't interleave lines. The json format prints
+    JSON lines with the list name and the tree arch added.
+    """
+    for record in package_list:
+        if list_format == "json":
+            record["list"] = prefix
+            record["tree_arch"] = tree_arch
+            line = json.dumps(record, sort_keys=True)
+        else:
+            flags_str = ",".join(record["flags"])
+            if flags_str:
+                flags_str = "(%s)" % flags_str
+            line = "%s%s: %s" % (prefix, flags_str, record["path"])
+        sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def compose_hash(config, opts):
+    """Return hash of compose inputs: config, kickstart and manifest."""
+    parts = []
+    for section in sorted(config.sections()):
+        for key, value in sorted(config.items(section, raw=True)):
+            # --resume implies --force, it doesn't change the result
+            if (section, key) == ("pungi", "force"):
+                continue
+            parts.append("%s.%s=%s" % (section, key, value))
+    for path in (opts.config, opts.from_manifest):
+        if path:
+            parts.append(open(path, "rb").read())
+    return pypungi.checkpoint.input_hash(*parts)
+
+
+def pin_default_version(config, resume):
+    """
+    The default version is today's date. Record it in the work dir and on
+    --resume reuse the one of the compose being resumed, so resuming on a
+    later day keeps its checkpoints, $releasever and output paths.
+    """
+    # same work dir as PungiBase
+    workdir = os.path.join(config.get('pungi', 'workdirbase'), config.get('pungi', 'flavor'),
+                           config.get('pungi', 'arch'))
+    path = os.path.join(workdir, "checkpoints", "default-version")
+    if resume and os.path.isfile(path):
+        config.set('pungi', 'version', open(path).read().strip())
+        return
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fo = open(path, "w")
+    fo.write(config.get('pungi', 'version') + "\n")
+    fo.close()
+
+
+def build_stages(mypungi, config, opts):
+    """Return graph of compose stages enabled by command line options."""
+    checkpoints = pypungi.checkpoint.CheckpointStore(os.path.join(mypungi.workdir, "checkpoints"),
+                                                     compose_hash(config, opts), mypungi.logger)
+    graph = pypungi.stages.StageGraph(checkpoints)
+    # stages using the yum object run one at a time, holding the cache lock shared;
+    # they take it exclusive while writing to the cache
+    graph.add_resource("yum", 1, mypungi.cachelock.shared())
+    graph.add_resource("createrepo", 1)
+
+    def deps(*names):
+        return [ i for i in names if i in graph ]
+
+    def print_list(prefix, list_func):
+        return lambda: print_package_list(prefix, list_func(), opts.list_format, mypungi.tree_arch)
+
+    # Do things slightly different for src.
+    if opts.sourceisos:
+        def createrepo_source():
+            # we already have all the content gathered
+            mypungi.topdir = os.path.join(config.get('pungi', 'destdir'),
+                                          config.get('pungi', 'version'),
+                                          config.get('pungi', 'flavor'),
+                                          'source', 'SRPMS')
+            mypungi.doCreaterepo(comps=False)
+        graph.add("createrepo", createrepo_source, resources=["createrepo"],
+                  outputs=[os.path.join(config.get('pungi', 'destdir'), config.get('pungi', 'version'),
+                                        config.get('pungi', 'flavor'), 'source', 'SRPMS', 'repodata')])
+        if opts.do_all or opts.do_createiso:
+            graph.add("createiso", mypungi.doCreateIsos, deps=["createrepo"], outputs=[mypungi.isodir])
+        return graph
+
+    if opts.from_manifest:
+        graph.add("init", lambda: mypungi.loadManifest(opts.from_manifest))
+    elif opts.do_all or opts.do_gather or opts.do_buildinstall:
+        # initialize the yum object for things that need it
+        graph.add("init", mypungi._inityum, resources=["yum"])
+
+    if opts.do_all or opts.do_gather:
+        if not opts.from_manifest:
+            graph.add("gather", mypungi.gather, deps=["init"], resources=["yum"], state_deps=["init"])
+        if opts.nodownload:
+            graph.add("list_packages", print_list("RPM", mypungi.list_packages),
+                      deps=deps("init", "gather"), state_deps=deps("init", "gather"), checkpoint=False)
+        else:
+            graph.add("download_packages", mypungi.downloadPackages, deps=deps("init", "gather"), resources=["yum"],
+                      outputs=[os.path.join(mypungi.topdir, config.get('pungi', 'product_path'))],
+                      state_deps=deps("init", "gather"))
+        if not opts.from_manifest:
+            graph.add("comps", mypungi.makeCompsFile, deps=["gather"], resources=["yum"],
+                      outputs=[mypungi._compsPath()], state_deps=["gather"])
+        if not opts.nodebuginfo:
+            if not opts.from_manifest:
+                graph.add("debuginfo", mypungi.getDebuginfoList, deps=["gather"], resources=["yum"], state_deps=["gather"])
+            if opts.nodownload:
+                graph.add("list_debuginfo", print_list("DEBUGINFO", mypungi.list_debuginfo),
+                          deps=deps("init", "debuginfo"), state_deps=deps("init", "debuginfo"), checkpoint=False)
+            else:
+                graph.add("download_debuginfo", mypungi.downloadDebuginfo, deps=deps("init", "debuginfo"), resources=["yum"],
+                          outputs=[os.path.join(mypungi.archdir, 'debug')], state_deps=deps("init", "debuginfo"))
+        if not opts.nosource:
+            if opts.nodownload:
+                graph.add("list_srpms", print_list("SRPM", mypungi.list_srpms),
+                          deps=deps("init", "gather"), state_deps=deps("init", "gather"), checkpoint=False)
+            else:
+                # no outputs: the SRPMS dir is shared with other arches
+                graph.add("download_srpms", mypungi.downloadSRPMs, deps=deps("init", "gather"), resources=["yum"],
+                          state_deps=deps("init", "gather"))
+
+        def report():
+            print "RPM size:       %s MiB" % (mypungi.size_packages() / 1024 ** 2)
+            if not opts.nodebuginfo:
+                print "DEBUGINFO size: %s MiB" % (mypungi.size_debuginfo() / 1024 ** 2)
+            if not opts.nosource:
+                print "SRPM size:      %s MiB" % (mypungi.size_srpms() / 1024 ** 2)
+            if not opts.from_manifest:
+                mypungi.writeManifest()
+                mypungi.writeProvenance()
+        graph.add("report", report, deps=[ i.name for i in graph.stages ],
+                  outputs=(not opts.from_manifest and [mypungi.manifest_path, mypungi.provenance_path] or []),
+                  state_deps=deps("init", "gather", "debuginfo"))
+
+    if opts.do_all or opts.do_createrepo:
+        graph.add("createrepo", mypungi.doCreaterepoTree,
+                  deps=deps("download_packages", "comps"), resources=["createrepo"],
+                  outputs=[os.path.join(mypungi.topdir, 'repodata')])
+        graph.add("createrepo_debuginfo", mypungi.doCreaterepoDebuginfo,
+                  deps=deps("download_debuginfo"), resources=["createrepo"],
+                  outputs=[os.path.join(mypungi.archdir, 'debug', 'repodata')])
+
+    if opts.do_all or opts.do_buildinstall:
+        if not opts.norelnotes:
+            # reads the yum package objects and writes the relnotes cache
+            graph.add("relnotes", mypungi.doGetRelnotes, deps=deps("download_packages"), resources=["yum"])
+        # lorax reinitializes the yum object, wait for everything using the old one
+        graph.add("buildinstall", mypungi.doBuildinstall,
+                  deps=deps("init", "report", "createrepo", "relnotes"), resources=["yum"],
+                  outputs=[ os.path.join(mypungi.topdir, i) for i in pypungi.BUILDINSTALL_CACHE_OUTPUTS ])
+
+    if opts.do_all or opts.do_createiso:
+        graph.add("createiso", mypungi.doCreateIsos,
+                  deps=deps("report", "createrepo", "createrepo_debuginfo", "relnotes", "buildinstall"),
+                  outputs=[mypungi.isodir])
+
+    return graph
+
+
+def write_profile(mypungi):
+    trace_path = os.path.join(mypungi.workdir, "profile-trace.json")
+    summary_path = os.path.join(mypungi.workdir, "profile-summary.txt")
+    pypungi.tracing.write_chrome_trace(trace_path)
+    fo = open(summary_path, "w")
+    fo.write("\n".join(pypungi.tracing.summary()) + "\n")
+    fo.close()
+    print "Profile written to %s and %s" % (trace_path, summary_path)
+
+
 def main():
 
     config = pypungi.config.Config()
 
     (opts, args) = get_arguments(config)
 
+    if opts.profile:
+        pypungi.tracing.enable()
+
     # You must be this high to ride if you're going to do root tasks
     if os.geteuid () != 0 and (opts.do_all or opts.do_buildinstall):
         print >> sys.stderr, "You must run pungi as root"
@@ -50,7 +229,7 @@ def main():
         if part.mountpoint == 'iso':
             config.set('pungi', 'cdsize', str(part.size))
             
-    config.set('pungi', 'force', str(opts.force))
+    config.set('pungi', 'force', str(opts.force or opts.resume))
 
     if config.get('pungi', 'workdirbase') == '/work':
         config.set('pungi', 'workdirbase', "%s/work" % config.get('pungi', 'destdir'))
@@ -106,10 +285,14 @@ def main():
         config.set('pungi', 'multilib', " ".join(opts.multilib))
     if opts.lookaside_repos:
         config.set('pungi', 'lookaside_repos', " ".join(opts.lookaside_repos))
+    if opts.lookaside_mode:
+        config.set('pungi', 'lookaside_mode', opts.lookaside_mode)
     if opts.no_dvd:
         config.set('pungi', 'no_dvd', "True")
     if opts.nomacboot:
         config.set('pungi', 'nomacboot', "True")
+    if opts.no_buildinstall_cache:
+        config.set('pungi', 'buildinstall_cache', "False")
     config.set("pungi", "fulltree", str(bool(opts.fulltree)))
     config.set("pungi", "selfhosting", str(bool(opts.selfhosting)))
     config.set("pungi", "nosource", str(bool(opts.nosource)))
@@ -120,76 +303,23 @@ def main():
     if opts.installpkgs:
         config.set("lorax", "installpkgs", " ".join(opts.installpkgs))
 
+    if not opts.version:
+        pin_default_version(config, opts.resume)
+
     # Actually do work.
     mypungi = pypungi.Pungi(config, ksparser)
 
-    with mypungi.yumlock:
-        if not opts.sourceisos:
-            if opts.do_all or opts.do_gather or opts.do_buildinstall:
-                mypungi._inityum() # initialize the yum object for things that need it
-            if opts.do_all or opts.do_gather:
-                mypungi.gather()
-                if opts.nodownload:
-                    for line in mypungi.list_packages():
-                        flags_str = ",".join(line["flags"])
-                        if flags_str:
-                            flags_str = "(%s)" % flags_str
-                        sys.stdout.write("RPM%s: %s\n" % (flags_str, line["path"]))
-                    sys.stdout.flush()
-                else:
-                    mypungi.downloadPackages()
-                mypungi.makeCompsFile()
-                if not opts.nodebuginfo:
-                    mypungi.getDebuginfoList()
-                    if opts.nodownload:
-                        for line in mypungi.list_debuginfo():
-                            flags_str = ",".join(line["flags"])
-                            if flags_str:
-                                flags_str = "(%s)" % flags_str
-                            sys.stdout.write("DEBUGINFO%s: %s\n" % (flags_str, line["path"]))
-                        sys.stdout.flush()
-                    else:
-                        mypungi.downloadDebuginfo()
-                if not opts.nosource:
-                    if opts.nodownload:
-                        for line in mypungi.list_srpms():
-                            flags_str = ",".join(line["flags"])
-                            if flags_str:
-                                flags_str = "(%s)" % flags_str
-                            sys.stdout.write("SRPM%s: %s\n" % (flags_str, line["path"]))
-                        sys.stdout.flush()
-                    else:
-                        mypungi.downloadSRPMs()
-
-                print "RPM size:       %s MiB" % (mypungi.size_packages() / 1024 ** 2)
-                if not opts.nodebuginfo:
-                    print "DEBUGINFO size: %s MiB" % (mypungi.size_debuginfo() / 1024 ** 2)
-                if not opts.nosource:
-                    print "SRPM size:      %s MiB" % (mypungi.size_srpms() / 1024 ** 2)
-
-    # Furthermore (but without the yumlock...)
-    if not opts.sourceisos:
-        if opts.do_all or opts.do_createrepo:
-            mypungi.doCreaterepo()
-
-        if opts.do_all or opts.do_buildinstall:
-            if not opts.norelnotes:
-                mypungi.doGetRelnotes()
-            mypungi.doBuildinstall()
-
-        if opts.do_all or opts.do_createiso:
-            mypungi.doCreateIsos()
-
-    # Do things slightly different for src.
-    if opts.sourceisos:
-        # we already have all the content gathered
-        mypungi.topdir = os.path.join(config.get('pungi', 'destdir'),
-                                      config.get('pungi', 'version'),
-                                      config.get('pungi', 'flavor'),
-                                      'source', 'SRPMS')
-        mypungi.doCreaterepo(comps=False)
-        if opts.do_all or opts.do_createiso:
-            mypungi.doCreateIsos()
+    graph = build_stages(mypungi, config, opts)
+    try:
+        graph.run(jobs=opts.jobs, resume=opts.resume)
+    finally:
+        print "Stage timing (* = critical path):"
+        for line in graph.summary():
+            print "  %s" % line
+        print "Cache lock wait: shared %.1fs, exclusive %.1fs" % (mypungi.cachelock.wait_time["shared"],
+                                                               mypungi.cachelock.wait_time["exclusive"])
+        if opts.profile:
+            write_profile(mypungi)
 
     print "All done!"
 
@@ -205,6 +335,8 @@ if __name__ == '__main__':
 
         def set_config(option, opt_str, value, parser, config):
             config.set('pungi', option.dest, value)
+            # also store the value, opts tells given options from config defaults
+            setattr(parser.values, option.dest, value)
             # When setting name, also set the iso_basename.
             if option.dest == 'name':
                 config.set('pungi', 'iso_basename', value)
@@ -238,6 +370,8 @@ if __name__ == '__main__':
           help='disable gathering of debuginfo packages (optional)')
         parser.add_option("--nodownload", action="store_true", dest="nodownload",
           help='disable downloading of packages. instead, print the package URLs (optional)')
+        parser.add_option("--list-format", dest="list_format", type="choice", choices=["text", "json"], default="text",
+          help='format of package lists printed with --nodownload: text or json (JSON lines, one package per line)')
         parser.add_option("--norelnotes", action="store_true", dest="norelnotes",
           help='disable gathering of release notes (optional); DEPRECATED')
         parser.add_option("--nogreedy", action="store_true", dest="nogreedy",
@@ -262,6 +396,8 @@ if __name__ == '__main__':
           help='Multilib method; can be specified multiple times; recommended: devel, runtime')
         parser.add_option("--lookaside-repo", action="append", dest="lookaside_repos", metavar="NAME",
           help='Specify lookaside repo name(s) (packages will used for depsolving but not be included in the output)')
+        parser.add_option("--lookaside-mode", dest="lookaside_mode", type="choice", choices=["full", "nvra"],
+          help='How lookaside repos are loaded: full (into the yum sack, default) or nvra (only NVRAs and provides are read)')
         parser.add_option("--workdirbase", dest="workdirbase", type="string",
           action="callback", callback=set_config, callback_args=(config, ),
           help='base working directory (defaults to destdir + /work)')
@@ -292,6 +428,16 @@ if __name__ == '__main__':
           action="callback", callback=set_config, callback_args=(config, ),
           help='Which files are the release notes -- GPL EULA')
         parser.add_option("--nomacboot", action="store_true", dest="nomacboot",           help='disable setting up macboot as no hfs support ')
+        parser.add_option("--no-buildinstall-cache", action="store_true", dest="no_buildinstall_cache",
+          help='always run lorax instead of reusing cached installer images')
+        parser.add_option("--from-manifest", dest="from_manifest", metavar="PATH",
+          help='use packages from a gather manifest written by an earlier run instead of gathering')
+        parser.add_option("--jobs", type="int", default=1, metavar="N",
+          help='number of independent stages to run in parallel (defaults to 1)')
+        parser.add_option("--profile", default=False, action="store_true",
+          help='record stage timing, CPU time, peak RSS and hot call counts; writes a Chrome trace into the work dir')
+        parser.add_option("--resume", default=False, action="store_true",
+          help='skip stages finished by a previous run with the same inputs (implies --force)')
 
 
         (opts, args) = parser.parse_args()
@@ -305,6 +451,9 @@ if __name__ == '__main__':
         if opts.do_gather or opts.do_createrepo or opts.do_buildinstall or opts.do_createiso:
             opts.do_all = False
 
+        if opts.from_manifest and not os.path.isfile(opts.from_manifest):
+            parser.error("Manifest not found: %s" % opts.from_manifest)
+
         if opts.arch and (opts.do_all or opts.do_buildinstall):
             parser.error("Cannot override arch while the BuildInstall stage is enabled")
 
@@ -15,59 +15,51 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
 
-import yum
+import errno
 import os
 import re
 import shutil
 import sys
+import tempfile
 import gzip
+import hashlib
+import heapq
+import json
 import pypungi.util
-import pprint
-import lockfile
 import logging
-import urlgrabber.progress
 import subprocess
-import createrepo
 import ConfigParser
-import pylorax
 from fnmatch import fnmatch
 
 import arch as arch_module
+import cachelock
+import manifest
 import multilib
+import pkgtable
+import provenance
+import repodata
+import rpmextract
+import sack
+import tracing
 
 
-class ReentrantYumLock(object):
-    """ A lock that can be acquired multiple times by the same process. """
+# count fnmatch calls when profiling
+fnmatch = tracing.counted("fnmatch", timed=False)(fnmatch)
 
-    def __init__(self, lock, log):
-        self.lock = lock
-        self.log = log
-        self.count = 0
 
-    def __enter__(self):
-        if not self.count:
-            self.log.info("Waiting on %r" % self.lock.lock_file)
-            self.lock.acquire()
-            self.log.info("Got %r" % self.lock.lock_file)
-        self.count = self.count + 1
-        self.log.info("Lock count upped to %i" % self.count)
+# lorax outputs which can be restored from the buildinstall cache
+BUILDINSTALL_CACHE_OUTPUTS = ("images", "isolinux", "EFI", "ppc", ".treeinfo", ".discinfo")
 
-    def __exit__(self, type, value, tb):
-        self.count = self.count - 1
-        self.log.info("Lock count downed to %i" % self.count)
-        self.log.info("%r %r %r" % (type, value, tb))
-        if not self.count:
-            self.lock.release()
-            self.log.info("Released %r" % self.lock.lock_file)
 
-
-def yumlocked(method):
-    """ A locking decorator. """
-    def wrapper(self, *args, **kwargs):
-        with self.yumlock:
-            return method(self, *args, **kwargs)
-    # TODO - replace argspec, signature, etc..
-    return wrapper
+def cachelocked(mode):
+    """ A locking decorator: hold the cache lock in mode (cachelock.SHARED or cachelock.EXCLUSIVE). """
+    def decorator(method):
+        def wrapper(self, *args, **kwargs):
+            with cachelock.CacheLockSection(self.cachelock, mode):
+                return method(self, *args, **kwargs)
+        # TODO - replace argspec, signature, etc..
+        return wrapper
+    return decorator
 
 
 def is_debug(po):
@@ -115,13 +107,12 @@ class PungiBase(object):
         full_archlist = self.config.getboolean('pungi', 'full_archlist')
         self.valid_arches = arch_module.get_valid_arches(self.tree_arch, multilib=full_archlist)
         self.valid_arches.append("src") # throw source in there, filter it later
-        self.valid_native_arches = arch_module.get_valid_arches(self.tree_arch, multilib=False)
-        self.valid_multilib_arches = arch_module.get_valid_multilib_arches(self.tree_arch)
+        self.arch_table = arch_module.get_arch_table(self.tree_arch)
+        self.valid_native_arches = self.arch_table.native_arches
+        self.valid_multilib_arches = self.arch_table.multilib_arches
 
         # arch: compatible arches
-        self.compatible_arches = {}
-        for i in self.valid_arches:
-            self.compatible_arches[i] = arch_module.get_compatible_arches(i)
+        self.compatible_arches = self.arch_table.compatible
 
         self.doLoggerSetup()
         self.workdir = os.path.join(self.config.get('pungi', 'workdirbase'),
@@ -149,62 +140,30 @@ class PungiBase(object):
                             filename=logfile)
 
 
-class CallBack(urlgrabber.progress.TextMeter):
-    """A call back function used with yum."""
-
-    def progressbar(self, current, total, name=None):
-        return
-
-
-class PungiYum(yum.YumBase):
-    """Subclass of Yum"""
-
-    def __init__(self, config):
-        self.pungiconfig = config
-        yum.YumBase.__init__(self)
-
-    def doLoggingSetup(self, debuglevel, errorlevel, syslog_ident=None, syslog_facility=None):
-        """Setup the logging facility."""
-
-        logdir = os.path.join(self.pungiconfig.get('pungi', 'destdir'), 'logs')
-        if not os.path.exists(logdir):
-            os.makedirs(logdir)
-        if self.pungiconfig.get('pungi', 'flavor'):
-            logfile = os.path.join(logdir, '%s.%s.log' % (self.pungiconfig.get('pungi', 'flavor'),
-                                                          self.pungiconfig.get('pungi', 'arch')))
-        else:
-            logfile = os.path.join(logdir, '%s.log' % (self.pungiconfig.get('pungi', 'arch')))
-
-        yum.logging.basicConfig(level=yum.logging.DEBUG, filename=logfile)
-
-    def doFileLogSetup(self, uid, logfile):
-        # This function overrides a yum function, allowing pungi to control
-        # the logging.
-        pass
-
-    def _compare_providers(self, *args, **kwargs):
-        # HACK: always prefer 64bit over 32bit packages
-        result = yum.YumBase._compare_providers(self, *args, **kwargs)
-        if len(result) >= 2:
-            pkg1 = result[0][0]
-            pkg2 = result[1][0]
-            if pkg1.name == pkg2.name:
-                best_arch = self.arch.get_best_arch_from_list([pkg1.arch, pkg2.arch], self.arch.canonarch)
-                if best_arch != "noarch" and best_arch != pkg1.arch:
-                    result[0:1] = result[0:1:-1]
-        return result
-
 class Pungi(pypungi.PungiBase):
+    # package flags: (flag name, attribute holding the set of flagged packages)
+    PACKAGE_FLAGS = (
+        ("input", "input_packages"),
+        ("comps", "comps_packages"),
+        ("prepopulate", "prepopulate_packages"),
+        ("langpack", "langpack_packages"),
+        ("multilib", "multilib_packages"),
+        ("fulltree", "fulltree_packages"),
+    )
+
     def __init__(self, config, ksparser):
         pypungi.PungiBase.__init__(self, config)
 
         # Set our own logging name space
         self.logger = logging.getLogger('Pungi')
 
-        # Create a lock object for later use.
-        filename = self.config.get('pungi', 'cachedir') + "/yumlock"
-        lock = lockfile.LockFile(filename)
-        self.yumlock = ReentrantYumLock(lock, self.logger)
+        # Per-package messages go to a child logger at DEBUG;
+        # the reasons are recorded in self.provenance instead
+        self.package_logger = logging.getLogger('Pungi.packages')
+
+        # Shared/exclusive lock of the cache dir, see cachelock
+        filename = os.path.join(self.config.get('pungi', 'cachedir'), cachelock.LOCK_FILE)
+        self.cachelock = cachelock.CacheLock(filename, self.logger)
 
         # Create the stdout/err streams and only send INFO+ stuff there
         formatter = logging.Formatter('%(name)s:%(levelname)s: %(message)s')
@@ -233,9 +192,15 @@ class Pungi(pypungi.PungiBase):
         self.ksparser = ksparser
 
         self.resolved_deps = {} # list the deps we've already resolved, short circuit.
+        self.file_provides = None       # repodata.FileProvidesIndex, created by gather()
+        self.pending_file_deps = {}     # {file requirement: [po]} waiting for resolve_file_deps()
+        self.provides_index = None      # sack.ProvidesIndex of BuildRequires, created by gather() when selfhosting
         self.excluded_pkgs = {} # list the packages we've already excluded.
         self.seen_pkgs = {}     # list the packages we've already seen so we can check all deps only once
         self.multilib_methods = self.config.get('pungi', 'multilib').split(" ")
+        self.multilib_method_map = multilib.MethodMap(multilib.METHOD_CLASSES, cachedir=self.config.get('pungi', 'cachedir'),
+                                                      cachelock=self.cachelock)
+        self.multilib_verdicts = None   # multilib.VerdictCache, created on first use
 
         # greedy methods:
         #  * none: only best match package
@@ -244,33 +209,53 @@ class Pungi(pypungi.PungiBase):
         self.greedy_method = self.config.get('pungi', 'greedy')
 
         self.lookaside_repos = self.config.get('pungi', 'lookaside_repos').split(" ")
-        self.sourcerpm_arch_map = {}    # {sourcerpm: set[arches]} - used for gathering debuginfo
+        # lookaside modes:
+        #  * full: lookaside repos are loaded into the yum sack
+        #  * nvra: only NVRAs and provides of lookaside repos are read into self.lookaside
+        self.lookaside_mode = self.config.get('pungi', 'lookaside_mode')
+        if self.lookaside_mode not in ("full", "nvra"):
+            raise ValueError("Invalid lookaside_mode: %s" % self.lookaside_mode)
+        self.lookaside = None           # repodata.LookasideIndex in the nvra mode
+        self.lookaside_yumrepos = []    # yum repo objects of lookaside repos in the nvra mode, not in the sack
+        self.sourcerpm_arch_map = {}    # {sourcerpm: arch bitmask} - used for gathering debuginfo
+
+        # ids of all packages gather has seen; sets below are bitsets over them
+        self.package_table = pkgtable.PackageTable()
 
         # package object lists
-        self.po_list = set()
-        self.srpm_po_list = set()
-        self.debuginfo_po_list = set()
+        self.po_list = self._package_set()
+        self.srpm_po_list = self._package_set()
+        self.debuginfo_po_list = self._package_set()
 
         # get_srpm_po() cache
         self.sourcerpm_srpmpo_map = {}
+        self._srpm_names = {}           # {sourcerpm: srpm name}
+
+        # why packages were added; written to provenance_path
+        self.provenance = provenance.Provenance()
+        self.provenance_path = os.path.join(self.workdir, "provenance.jsonl")
+
+        # package lists were loaded from a gather manifest, not from yum
+        self.from_manifest = False
+        self.manifest_path = os.path.join(self.workdir, "gather-manifest.json")
 
         # flags
-        self.input_packages = set()         # packages specified in %packages kickstart section including those defined via comps groups
-        self.comps_packages = set()         # packages specified in %packages kickstart section *indirectly* via comps groups
-        self.prepopulate_packages = set()   # packages specified in %prepopulate kickstart section
-        self.fulltree_packages = set()
-        self.langpack_packages = set()
-        self.multilib_packages = set()
+        self.input_packages = self._package_set()         # packages specified in %packages kickstart section including those defined via comps groups
+        self.comps_packages = self._package_set()         # packages specified in %packages kickstart section *indirectly* via comps groups
+        self.prepopulate_packages = self._package_set()   # packages specified in %prepopulate kickstart section
+        self.fulltree_packages = self._package_set()
+        self.langpack_packages = self._package_set()
+        self.multilib_packages = self._package_set()
 
         # already processed packages
-        self.completed_add_srpms = set()        # srpms
-        self.completed_debuginfo = set()        # rpms
-        self.completed_depsolve = set()         # rpms
-        self.completed_langpacks = set()        # rpms
-        self.completed_multilib = set()         # rpms
-        self.completed_fulltree = set()         # srpms
-        self.completed_selfhosting = set()      # srpms
-        self.completed_greedy_build = set()     # po.sourcerpm
+        self.completed_add_srpms = self._package_set()    # srpms
+        self.completed_debuginfo = self._package_set()    # rpms
+        self.completed_depsolve = self._package_set()     # rpms
+        self.completed_langpacks = self._package_set()    # rpms
+        self.completed_multilib = self._package_set()     # rpms
+        self.completed_fulltree = self._package_set()     # srpms
+        self.completed_selfhosting = self._package_set()  # srpms
+        self.completed_greedy_build = set()               # po.sourcerpm
 
         self.is_fulltree = self.config.getboolean("pungi", "fulltree")
         self.is_selfhosting = self.config.getboolean("pungi", "selfhosting")
@@ -279,11 +264,38 @@ class Pungi(pypungi.PungiBase):
         self.is_resolve_deps = self.config.getboolean("pungi", "resolve_deps")
 
         self.fulltree_excludes = set(self.ksparser.handler.fulltree_excludes)
+        self.multilib_blacklist = multilib.NameSet(self.ksparser.handler.multilib_blacklist)
+        self.multilib_whitelist = multilib.NameSet(self.ksparser.handler.multilib_whitelist)
 
     def _add_yum_repo(self, name, url, mirrorlist=False, groups=True,
                       cost=1000, includepkgs=None, excludepkgs=None,
                       proxy=None):
         """This function adds a repo to the yum object.
+        Arguments are those of _make_yum_repo()."""
+        import yumbase
+
+        thisrepo = self._make_yum_repo(name, url, mirrorlist=mirrorlist, groups=groups,
+                                       cost=cost, includepkgs=includepkgs,
+                                       excludepkgs=excludepkgs, proxy=proxy)
+        if mirrorlist:
+            self.mirrorlists.append(thisrepo.mirrorlist)
+        else:
+            self.repos.extend(thisrepo.baseurl)
+        self.ayum.repos.add(thisrepo)
+        self.ayum.repos.enableRepo(thisrepo.id)
+        self.ayum._getRepos(thisrepo=thisrepo.id, doSetup=True)
+        # Set the repo callback.
+        self.ayum.repos.setProgressBar(yumbase.CallBack())
+        self.ayum.repos.callback = yumbase.CallBack()
+        thisrepo.metadata_expire = 0
+        thisrepo.mirrorlist_expire = 0
+        if os.path.exists(os.path.join(thisrepo.cachedir, 'repomd.xml')):
+            os.remove(os.path.join(thisrepo.cachedir, 'repomd.xml'))
+
+    def _make_yum_repo(self, name, url, mirrorlist=False, groups=True,
+                       cost=1000, includepkgs=None, excludepkgs=None,
+                       proxy=None):
+        """Return a yum repo object, not added to the yum object.
         name: Name of the repo
         url: Full url to the repo
         mirrorlist: Bool for whether or not url is a mirrorlist
@@ -293,6 +305,8 @@ class Pungi(pypungi.PungiBase):
         excludepkgs: An optional list of excludes to use
         proxy: An optional proxy to use
         """
+        import yum
+
         includepkgs = includepkgs or []
         excludepkgs = excludepkgs or []
 
@@ -303,13 +317,11 @@ class Pungi(pypungi.PungiBase):
         if mirrorlist:
             thisrepo.mirrorlist = yum.parser.varReplace(url,
                                                         self.ayum.conf.yumvar)
-            self.mirrorlists.append(thisrepo.mirrorlist)
             self.logger.info('Mirrorlist for repo %s is %s' %
                              (thisrepo.name, thisrepo.mirrorlist))
         else:
             thisrepo.baseurl = yum.parser.varReplace(url,
                                                      self.ayum.conf.yumvar)
-            self.repos.extend(thisrepo.baseurl)
             self.logger.info('URL for repo %s is %s' %
                              (thisrepo.name, thisrepo.baseurl))
         thisrepo.basecachedir = self.ayum.conf.cachedir
@@ -322,25 +334,18 @@ class Pungi(pypungi.PungiBase):
         # Yum doesn't like proxy being None
         if proxy:
             thisrepo.proxy = proxy
-        self.ayum.repos.add(thisrepo)
-        self.ayum.repos.enableRepo(thisrepo.id)
-        self.ayum._getRepos(thisrepo=thisrepo.id, doSetup=True)
-        # Set the repo callback.
-        self.ayum.repos.setProgressBar(CallBack())
-        self.ayum.repos.callback = CallBack()
-        thisrepo.metadata_expire = 0
-        thisrepo.mirrorlist_expire = 0
-        if os.path.exists(os.path.join(thisrepo.cachedir, 'repomd.xml')):
-            os.remove(os.path.join(thisrepo.cachedir, 'repomd.xml'))
+        return thisrepo
 
-    @yumlocked
+    @cachelocked(cachelock.EXCLUSIVE)
     def _inityum(self):
         """Initialize the yum object.  Only needed for certain actions."""
+        import yum
+        import yumbase
 
         # Create a yum object to use
         self.repos = []
         self.mirrorlists = []
-        self.ayum = PungiYum(self.config)
+        self.ayum = yumbase.PungiYum(self.config)
         self.ayum.doLoggingSetup(6, 6)
         yumconf = yum.config.YumConf()
         yumconf.debuglevel = 6
@@ -369,30 +374,68 @@ class Pungi(pypungi.PungiBase):
         except:
             pass
 
+        if self.lookaside_mode == "nvra":
+            self.lookaside = repodata.LookasideIndex()
+
         for repo in self.ksparser.handler.repo.repoList:
+            if self.lookaside is not None and repo.name in self.lookaside_repos:
+                add_repo = self._add_lookaside_repo
+            else:
+                add_repo = self._add_yum_repo
             if repo.mirrorlist:
                 # The not bool() thing is because pykickstart is yes/no on
                 # whether to ignore groups, but yum is a yes/no on whether to
                 # include groups.  Awkward.
-                self._add_yum_repo(repo.name, repo.mirrorlist,
-                                   mirrorlist=True,
-                                   groups=not bool(repo.ignoregroups),
-                                   cost=repo.cost,
-                                   includepkgs=repo.includepkgs,
-                                   excludepkgs=repo.excludepkgs,
-                                   proxy=repo.proxy)
+                add_repo(repo.name, repo.mirrorlist,
+                         mirrorlist=True,
+                         groups=not bool(repo.ignoregroups),
+                         cost=repo.cost,
+                         includepkgs=repo.includepkgs,
+                         excludepkgs=repo.excludepkgs,
+                         proxy=repo.proxy)
             else:
-                self._add_yum_repo(repo.name, repo.baseurl,
-                                   mirrorlist=False,
-                                   groups=not bool(repo.ignoregroups),
-                                   cost=repo.cost,
-                                   includepkgs=repo.includepkgs,
-                                   excludepkgs=repo.excludepkgs,
-                                   proxy=repo.proxy)
-
+                add_repo(repo.name, repo.baseurl,
+                         mirrorlist=False,
+                         groups=not bool(repo.ignoregroups),
+                         cost=repo.cost,
+                         includepkgs=repo.includepkgs,
+                         excludepkgs=repo.excludepkgs,
+                         proxy=repo.proxy)
+
+        # yum sets up the sack of all valid arches at once (it only opens the
+        # repo metadata); package objects are created per partition by
+        # sack.PartitionedSack in getPackageObjects()
         self.logger.info('Getting sacks for arches %s' % self.valid_arches)
         self.ayum._getSacks(archlist=self.valid_arches)
 
+    def _add_lookaside_repo(self, name, url, **kwargs):
+        """Read NVRAs and provides of a lookaside repo without adding it to
+           the yum sack. Metadata is downloaded by a yum repo object, so
+           mirrorlists, proxies and SSL settings apply as for other repos."""
+
+        thisrepo = self._make_yum_repo(name, url, **kwargs)
+        thisrepo.setup(self.ayum.conf.cache)
+        thisrepo.metadata_expire = 0
+        thisrepo.mirrorlist_expire = 0
+        if os.path.exists(os.path.join(thisrepo.cachedir, 'repomd.xml')):
+            os.remove(os.path.join(thisrepo.cachedir, 'repomd.xml'))
+        self.logger.info('Indexing lookaside repo %s' % name)
+        self.lookaside.add_repo(thisrepo.retrieveMD("primary"), self.valid_arches)
+        self.lookaside_yumrepos.append(thisrepo)
+
+    def _provided_by_lookaside(self, req):
+        """Return True if a requirement is provided by a lookaside repo read in the nvra mode."""
+        if self.lookaside is None:
+            return False
+        r, f, v = req
+        if self.lookaside.provides_req(r, f, v):
+            return True
+        if r.startswith("/") and self.file_provides is not None:
+            for repoid, pkgid, pkgtup in self.file_provides.get(r):
+                if repoid in self.lookaside_repos:
+                    return True
+        return False
+
     def _filtersrcdebug(self, po):
         """Filter out package objects that are of 'src' arch."""
 
@@ -401,35 +444,40 @@ class Pungi(pypungi.PungiBase):
 
         return True
 
-    def add_package(self, po, msg=None):
+    def _package_set(self, packages=()):
+        return pkgtable.PackageSet(self.package_table, packages)
+
+    def _add_provenance(self, po, reason, parent, pattern):
+        self.provenance.add(po, reason, parent, pattern)
+        self.package_logger.debug("Added %s.%s (repo: %s, reason: %s, parent: %s, pattern: %s)",
+                                  po.name, po.arch, po.repoid, reason, parent, pattern)
+
+    def add_package(self, po, reason, parent=None, pattern=None):
         if not is_package(po):
             raise ValueError("Not a binary package: %s" % po)
-        if msg:
-            self.logger.info(msg)
-        if po not in self.po_list:
-            self.po_list.add(po)
+        self._add_provenance(po, reason, parent, pattern)
+        self.po_list.add(po)
         self.ayum.install(po)
-        self.sourcerpm_arch_map.setdefault(po.sourcerpm, set()).add(po.arch)
+        package_id = self.package_table.id(po)
+        sourcerpm = self.package_table.sourcerpms[package_id]
+        self.sourcerpm_arch_map[sourcerpm] = self.sourcerpm_arch_map.get(sourcerpm, 0) | self.arch_table.bit(self.package_table.arches[package_id])
 
-    def add_debuginfo(self, po, msg=None):
+    def add_debuginfo(self, po, reason, parent=None, pattern=None):
         if not is_debug(po):
             raise ValueError("Not a debuginfog package: %s" % po)
-        if msg:
-            self.logger.info(msg)
-        if po not in self.debuginfo_po_list:
-            self.debuginfo_po_list.add(po)
+        self._add_provenance(po, reason, parent, pattern)
+        self.debuginfo_po_list.add(po)
 
-    def add_source(self, po, msg=None):
+    def add_source(self, po, reason, parent=None, pattern=None):
         if not is_source(po):
             raise ValueError("Not a source package: %s" % po)
-        if msg:
-            self.logger.info(msg)
-        if po not in self.srpm_po_list:
-            self.srpm_po_list.add(po)
+        self._add_provenance(po, reason, parent, pattern)
+        self.srpm_po_list.add(po)
 
     def verifyCachePkg(self, po, path): # Stolen from yum
         """check the package checksum vs the cache
            return True if pkg is good, False if not"""
+        import yum
 
         (csum_type, csum) = po.returnIdSum()
 
@@ -443,6 +491,7 @@ class Pungi(pypungi.PungiBase):
 
         return True
 
+    @tracing.counted()
     def excludePackages(self, pkg_sack):
         """exclude packages according to config file"""
         if not pkg_sack:
@@ -458,10 +507,15 @@ class Pungi(pypungi.PungiBase):
             name, arch = arch_module.split_name_arch(i)
             excludes.append((name, arch, pattern, multilib))
 
-        for name in self.ksparser.handler.multilib_blacklist:
-            excludes.append((name, None, "multilib-blacklist: %s" % name, True))
-
         for pkg in pkg_sack[:]:
+            if pkg.arch in self.valid_multilib_arches:
+                pattern = self.multilib_blacklist.match(pkg.name)
+                if pattern is not None:
+                    if pkg.nvra not in self.excluded_pkgs:
+                        self.logger.info("Excluding %s.%s (pattern: multilib-blacklist: %s)" % (pkg.name, pkg.arch, pattern))
+                        self.excluded_pkgs[pkg.nvra] = pkg
+                    pkg_sack.remove(pkg)
+                    continue
             for name, arch, exclude_pattern, multilib in excludes:
                 if fnmatch(pkg.name, name):
                     if not arch or fnmatch(pkg.arch, arch):
@@ -483,7 +537,7 @@ class Pungi(pypungi.PungiBase):
             return added
         self.completed_depsolve.add(po)
 
-        self.logger.info('Checking deps of %s.%s' % (po.name, po.arch))
+        self.package_logger.debug('Checking deps of %s.%s', po.name, po.arch)
 
         reqs = po.requires
         provs = po.provides
@@ -497,54 +551,186 @@ class Pungi(pypungi.PungiBase):
             if req in provs:
                 continue
 
-            try:
+            if self.file_provides is not None and r.startswith("/") and r not in self.file_provides:
+                # resolved in a batch by resolve_file_deps()
+                self.pending_file_deps.setdefault(req, []).append(po)
+                continue
+
+            self._add_dep_providers(po, req, added)
+
+        for add in added:
+            self.get_package_deps(add)
+        return added
+
+    def _add_dep_providers(self, po, req, added):
+        """Add packages providing a requirement of po; they're also added to the added set."""
+        import yum
+
+        r, f, v = req
+        if self._provided_by_lookaside(req):
+            self.package_logger.debug("Dependency %s of %s.%s is provided by a lookaside repo", r, po.name, po.arch)
+            self.resolved_deps[req] = None
+            return
+
+        try:
+            if self.file_provides is not None and r.startswith("/"):
+                deps = self._sack_packages(self.file_provides.get(r))
+            elif self.provides_index is not None and r in self.provides_index:
+                deps = self.provides_index.get(r, f, v)
+            else:
                 deps = self.ayum.whatProvides(r, f, v).returnPackages()
-                deps = self.excludePackages(deps)
-                if not deps:
-                    self.logger.warn("Unresolvable dependency %s in %s.%s" % (r, po.name, po.arch))
-                    continue
+            deps = self.excludePackages(deps)
+            if not deps:
+                self.logger.warn("Unresolvable dependency %s in %s.%s" % (r, po.name, po.arch))
+                return
 
-                if self.greedy_method == "all":
-                    deps = yum.packageSack.ListPackageSack(deps).returnNewestByNameArch()
-                else:
-                    found = False
-                    for dep in deps:
-                        if dep in self.po_list:
-                            # HACK: there can be builds in the input list on which we want to apply the "build" greedy rules
-                            if self.greedy_method == "build" and dep.sourcerpm not in self.completed_greedy_build:
-                                break
-                            found = True
+            if self.greedy_method == "all":
+                deps = yum.packageSack.ListPackageSack(deps).returnNewestByNameArch()
+            else:
+                found = False
+                for dep in deps:
+                    if dep in self.po_list:
+                        # HACK: there can be builds in the input list on which we want to apply the "build" greedy rules
+                        if self.greedy_method == "build" and dep.sourcerpm not in self.completed_greedy_build:
                             break
-                    if found:
-                        deps = []
-                    else:
-                        all_deps = deps
-                        deps = [self.ayum._bestPackageFromList(all_deps)]
-                        if self.greedy_method == "build":
-                            # handle "build" greedy method
-                            if deps:
-                                build_po = deps[0]
-                                if is_package(build_po):
-                                    if build_po.arch != "noarch" and build_po.arch not in self.valid_multilib_arches:
-                                        all_deps = [ i for i in all_deps if i.arch not in self.valid_multilib_arches ]
-                                    for dep in all_deps:
-                                        if dep != build_po and dep.sourcerpm == build_po.sourcerpm:
-                                            deps.append(dep)
-                                            self.completed_greedy_build.add(dep.sourcerpm)
+                        found = True
+                        break
+                if found:
+                    deps = []
+                else:
+                    all_deps = deps
+                    deps = [self.ayum._bestPackageFromList(all_deps)]
+                    if self.greedy_method == "build":
+                        # handle "build" greedy method
+                        if deps:
+                            build_po = deps[0]
+                            if is_package(build_po):
+                                native, multilib, noarch = self.sack.siblings(build_po)
+                                siblings = native + noarch
+                                if build_po.arch == "noarch" or build_po.arch in self.valid_multilib_arches:
+                                    siblings += multilib
+                                all_deps = set(all_deps)
+                                for dep in siblings:
+                                    if dep != build_po and dep in all_deps:
+                                        deps.append(dep)
+                                        self.completed_greedy_build.add(dep.sourcerpm)
+
+            for dep in deps:
+                if dep not in added:
+                    self.add_package(dep, "dependency", po, r)
+                    added.add(dep)
+
+        except (yum.Errors.InstallError, yum.Errors.YumBaseError), ex:
+            self.logger.warn("Unresolvable dependency %s in %s.%s (repo: %s)" % (r, po.name, po.arch, po.repoid))
+            return
+        self.resolved_deps[req] = None
 
-                for dep in deps:
-                    if dep not in added:
-                        msg = 'Added %s.%s (repo: %s) for %s.%s' % (dep.name, dep.arch, dep.repoid, po.name, po.arch)
-                        self.add_package(dep, msg)
-                        added.add(dep)
+    def _metadata_files(self, mdtype):
+        """Return [(repoid, path)] of a metadata file of enabled and lookaside repos,
+           None if it can't be retrieved. Files are read from the yum cache."""
+        import yum
+
+        result = []
+        try:
+            # downloads through yum (mirrors, proxy, checksums) unless it's cached already
+            with self.cachelock.exclusive():
+                for repo in self.ayum.repos.listEnabled() + self.lookaside_yumrepos:
+                    result.append((repo.id, repo.retrieveMD(mdtype)))
+        except (yum.Errors.RepoError, yum.Errors.RepoMDError), ex:
+            self.logger.warn("Unable to retrieve %s metadata: %s" % (mdtype, ex))
+            return None
+        return result
+
+    def _init_file_provides(self):
+        """Return index of file provides read from filelists of enabled repos, None if they can't be read."""
+        repos = self._metadata_files("filelists")
+        if repos is None:
+            return None
+        return repodata.FileProvidesIndex(repos, self.valid_arches)
+
+    def _init_provides_index(self):
+        """Return index of provides read from the primary metadata yum has loaded."""
+        return sack.ProvidesIndex(self.ayum.pkgSack)
+
+    def _sack_packages(self, entries):
+        """Return sack packages of (repoid, pkgid, pkgtup) entries of a repodata index."""
+        result = []
+        for repoid, pkgid, pkgtup in entries:
+            for po in self.ayum.pkgSack.searchPkgTuple(pkgtup):
+                if po.repoid == repoid and po.pkgId == pkgid:
+                    result.append(po)
+        return result
 
-            except (yum.Errors.InstallError, yum.Errors.YumBaseError), ex:
-                self.logger.warn("Unresolvable dependency %s in %s.%s (repo: %s)" % (r, po.name, po.arch, po.repoid))
+    def resolve_file_deps(self):
+        """
+        Resolve file requirements deferred by get_package_deps(). Filelists
+        are streamed once per batch of pending paths, keeping only entries
+        of those paths, instead of letting yum load filelists of the whole
+        sack.
+        """
+        added = set()
+        while self.pending_file_deps:
+            pending = self.pending_file_deps
+            self.pending_file_deps = {}
+            if self.file_provides is not None:
+                try:
+                    with tracing.span("gather:filelists", paths=len(pending)):
+                        self.file_provides.update([ req[0] for req in pending ])
+                except (IOError, KeyError, SyntaxError), ex:
+                    # SyntaxError covers XML parse errors
+                    self.logger.warn("Unable to read filelists, resolving file dependencies with yum: %s" % ex)
+                    self.file_provides = None
+
+            new = set()
+            for req in sorted(pending):
+                for po in pending[req]:
+                    if req in self.resolved_deps:
+                        break
+                    self._add_dep_providers(po, req, new)
+            added.update(new)
+            for po in new:
+                added.update(self.get_package_deps(po))
+        return added
+
+    def add_buildrequires(self, srpm_po_list=None):
+        """
+        Add packages providing BuildRequires of source packages (selfhosting).
+        Requirements of all new srpms are collected into a deduplicated table
+        and their providers are looked up in one batch, then runtime deps of
+        the added packages are resolved.
+        """
+        srpm_po_list = srpm_po_list or self.srpm_po_list
+        pending = {}    # {requirement: [srpm]}
+        for srpm_po in sorted(srpm_po_list):
+            if srpm_po in self.completed_selfhosting:
                 continue
-            self.resolved_deps[req] = None
+            self.completed_selfhosting.add(srpm_po)
+            for req in srpm_po.requires:
+                if req in self.resolved_deps:
+                    continue
+                r, f, v = req
+                if r.startswith('rpmlib(') or r.startswith('config('):
+                    continue
+                if self.file_provides is not None and r.startswith("/") and r not in self.file_provides:
+                    # resolved in a batch by resolve_file_deps()
+                    self.pending_file_deps.setdefault(req, []).append(srpm_po)
+                    continue
+                pending.setdefault(req, []).append(srpm_po)
 
-        for add in added:
-            self.get_package_deps(add)
+        if self.provides_index is not None:
+            names = [ req[0] for req in pending if not req[0].startswith("/") ]
+            with tracing.span("gather:provides", names=len(names)):
+                self.provides_index.update(names)
+
+        added = set()
+        for req in sorted(pending):
+            for srpm_po in pending[req]:
+                if req in self.resolved_deps:
+                    break
+                self._add_dep_providers(srpm_po, req, added)
+        for po in list(added):
+            added.update(self.get_package_deps(po))
+        added.update(self.resolve_file_deps())
         return added
 
     def add_langpacks(self, po_list=None):
@@ -564,8 +750,7 @@ class Pungi(pypungi.PungiBase):
 
             for langpack in langpacks:
                 pattern = langpack["install"] % "*" # replace '%s' with '*'
-                exactmatched, matched, unmatched = yum.packages.parsePackages(self.all_pkgs, [pattern], casematch=1, pkgdict=self.pkg_refs.copy())
-                matches = filter(self._filtersrcdebug, exactmatched + matched)
+                matches = self._searchPackages(pattern, ["native"])
                 matches = [ i for i in matches if not i.name.endswith("-devel") and not i.name.endswith("-static") and i.name != "man-pages-overrides" ]
                 matches = [ i for i in matches if fnmatch(i.name, pattern) ]
 
@@ -576,8 +761,7 @@ class Pungi(pypungi.PungiBase):
                 for i, pkg_sack in packages_by_name.iteritems():
                     pkg_sack = self.excludePackages(pkg_sack)
                     match = self.ayum._bestPackageFromList(pkg_sack)
-                    msg = 'Added langpack %s.%s (repo: %s) for package %s (pattern: %s)' % (match.name, match.arch, match.repoid, po.name, pattern)
-                    self.add_package(match, msg)
+                    self.add_package(match, "langpack", po, pattern)
                     self.completed_langpacks.add(match) # assuming langpack doesn't have langpacks
                     added.add(match)
 
@@ -590,6 +774,10 @@ class Pungi(pypungi.PungiBase):
         if not self.multilib_methods:
             return added
 
+        if self.multilib_verdicts is None:
+            self.multilib_verdicts = multilib.VerdictCache(self.config.get('pungi', 'cachedir'), self.multilib_methods,
+                                                           self.cachelock)
+
         for po in sorted(po_list):
             if po in self.completed_multilib:
                 continue
@@ -602,8 +790,7 @@ class Pungi(pypungi.PungiBase):
 
             self.completed_multilib.add(po)
 
-            matches = self.ayum.pkgSack.searchNevra(name=po.name, ver=po.version, rel=po.release)
-            matches = [i for i in matches if i.arch in self.valid_multilib_arches]
+            matches = self.sack.search_nvr("multilib", po.name, po.version, po.release)
             if not matches:
                 continue
             matches = self.excludePackages(matches)
@@ -611,18 +798,16 @@ class Pungi(pypungi.PungiBase):
             if not match:
                 continue
 
-            if po.name in self.ksparser.handler.multilib_whitelist:
-                msg = "Added multilib package %s.%s (repo: %s) for package %s.%s (method: %s)" % (match.name, match.arch, match.repoid, po.name, po.arch, "multilib-whitelist")
-                self.add_package(match, msg)
+            if po.name in self.multilib_whitelist:
+                self.add_package(match, "multilib", po, "multilib-whitelist")
                 self.completed_multilib.add(match)
                 added.add(match)
                 continue
 
-            method = multilib.po_is_multilib(po, self.multilib_methods)
+            method = multilib.po_is_multilib(po, self.multilib_methods, self.multilib_method_map, self.multilib_verdicts)
             if not method:
                 continue
-            msg = "Added multilib package %s.%s (repo: %s) for package %s.%s (method: %s)" % (match.name, match.arch, match.repoid, po.name, po.arch, method)
-            self.add_package(match, msg)
+            self.add_package(match, "multilib", po, method)
             self.completed_multilib.add(match)
             added.add(match)
         return added
@@ -683,6 +868,8 @@ class Pungi(pypungi.PungiBase):
         return groups
 
     def get_langpacks(self):
+        import yum
+
         try:
             self.langpacks = list(self.ayum.comps.langpacks)
         except AttributeError:
@@ -694,34 +881,68 @@ class Pungi(pypungi.PungiBase):
             self.logger.warning("Could not get langpacks due to missing comps in repodata or --ignoregroups=true option.")
             self.langpacks = []
 
+    def _filterSackPackages(self, packages):
+        """Drop excluded packages and packages also found in a lookaside repo."""
+        packages = self.excludePackages(packages)
+        if self.lookaside is not None:
+            lookaside_nvrs = self.lookaside.nvras
+        else:
+            lookaside_nvrs = set([ po.nvra for po in packages if po.repoid in self.lookaside_repos ])
+        if not lookaside_nvrs:
+            return packages
+        result = []
+        for po in packages:
+            if po.repoid not in self.lookaside_repos and po.nvra in lookaside_nvrs:
+                self.logger.debug("Removed %s (repo: %s), because it's also in a lookaside repo" % (po, po.repoid))
+                continue
+            result.append(po)
+        return result
+
+    def _searchPackages(self, pattern, partitions):
+        """Return packages of sack partitions matching a name, name.arch, nevra, ... pattern."""
+        import yum
+
+        result = []
+        for partition in partitions:
+            exactmatched, matched, unmatched = yum.packages.parsePackages(self.sack.packages(partition), [pattern], casematch=1,
+                                                                          pkgdict=self.sack.refs(partition).copy())
+            result.extend(exactmatched + matched)
+        return result
+
+    def _isGlob(self, pattern):
+        for char in "*?[":
+            if char in pattern:
+                return True
+        return False
+
+    def _matchesMultilibArch(self, pattern):
+        """Return True if a name.arch pattern may match a multilib arch."""
+        if "." not in pattern:
+            return False
+        arch = pattern.rsplit(".", 1)[1]
+        for multilib_arch in self.valid_multilib_arches:
+            if fnmatch(multilib_arch, arch):
+                return True
+        return False
+
     def getPackageObjects(self):
         """Cycle through the list of packages and get package object matches."""
+        import yum
 
         searchlist = [] # The list of package names/globs to search for
         matchdict = {} # A dict of objects to names
         excludeGroups = [] # A list of groups for removal defined in the ks file
 
-        # precompute pkgs and pkg_refs to speed things up
-        self.all_pkgs = list(set(self.ayum.pkgSack.returnPackages()))
-        self.all_pkgs = self.excludePackages(self.all_pkgs)
-
-
-        lookaside_nvrs = set()
-        for po in self.all_pkgs:
-            if po.repoid in self.lookaside_repos:
-                lookaside_nvrs.add(po.nvra)
-        for po in self.all_pkgs[:]:
-            if po.repoid not in self.lookaside_repos and po.nvra in lookaside_nvrs:
-                self.logger.debug("Removed %s (repo: %s), because it's also in a lookaside repo" % (po, po.repoid))
-                self.all_pkgs.remove(po)
-
-        self.pkg_refs = yum.packages.buildPkgRefDict(self.all_pkgs, casematch=True)
-
         self.get_langpacks()
 
         # First remove the excludes
         self.ayum.excludePackages()
 
+        # sack partitions are read when they're first needed, always after
+        # the excludes are applied
+        self.sack = sack.PartitionedSack(self.ayum.pkgSack, self.valid_arches, self.valid_native_arches,
+                                         self.valid_multilib_arches, self._filterSackPackages)
+
         # Get the groups set for removal
         for group in self.ksparser.handler.packages.excludedGroupList:
             excludeGroups.append(str(group)[1:])
@@ -768,8 +989,14 @@ class Pungi(pypungi.PungiBase):
                 # HACK: handles a special case, when system-release virtual provide is specified in the greedy mode
                 matches = self.ayum.whatProvides(name, None, None).returnPackages()
             else:
-                exactmatched, matched, unmatched = yum.packages.parsePackages(self.all_pkgs, [name], casematch=1, pkgdict=self.pkg_refs.copy())
-                matches = exactmatched + matched
+                partitions = ["native"]
+                if multilib or self.greedy_method == "all" or self._matchesMultilibArch(name) or self._isGlob(name):
+                    # a glob may match names which exist only for multilib arches
+                    partitions.append("multilib")
+                matches = self._searchPackages(name, partitions)
+                if not matches and "multilib" not in partitions:
+                    # packages built only for multilib arches
+                    matches = self._searchPackages(name, ["multilib"])
 
             matches = filter(self._filtersrcdebug, matches)
 
@@ -800,8 +1027,7 @@ class Pungi(pypungi.PungiBase):
                     self.comps_packages.update(packages)
 
                 for po in packages:
-                    msg = 'Found %s.%s' % (po.name, po.arch)
-                    self.add_package(po, msg)
+                    self.add_package(po, "input", pattern=pattern)
                     name_arch = "%s.%s" % (po.name, po.arch)
                     if name_arch in prepopulate_packages:
                         self.prepopulate_packages.add(po)
@@ -811,12 +1037,19 @@ class Pungi(pypungi.PungiBase):
 
         self.logger.info('Finished gathering package objects.')
 
+    @tracing.traced()
     def gather(self):
 
         # get package objects according to the input list
-        self.getPackageObjects()
+        with tracing.span("gather:input"):
+            self.getPackageObjects()
+        if self.is_resolve_deps or self.is_selfhosting:
+            self.file_provides = self._init_file_provides()
+        if self.is_selfhosting:
+            self.provides_index = self._init_provides_index()
         if self.is_sources:
-            self.createSourceHashes()
+            with tracing.span("gather:check_srpms"):
+                self.check_srpms()
 
         pass_num = 0
         added = set()
@@ -829,51 +1062,62 @@ class Pungi(pypungi.PungiBase):
 
             if self.is_resolve_deps:
                 # get conditional deps (defined in comps)
-                for txmbr in self.ayum.tsInfo:
-                    if not txmbr.po in self.po_list:
-                        if not is_package(txmbr.po):
-                            # we don't want sources which can be pulled in, because 'src' arch is part of self.valid_arches
-                            continue
-                        self.add_package(txmbr.po)
+                with tracing.span("gather:conditional", pass_num=pass_num):
+                    for txmbr in self.ayum.tsInfo:
+                        if not txmbr.po in self.po_list:
+                            if not is_package(txmbr.po):
+                                # we don't want sources which can be pulled in, because 'src' arch is part of self.valid_arches
+                                continue
+                            self.add_package(txmbr.po, "conditional")
 
             # resolve deps
             if self.is_resolve_deps:
-                for po in sorted(self.po_list):
-                    added.update(self.get_package_deps(po))
+                with tracing.span("gather:deps", pass_num=pass_num):
+                    for po in sorted(self.po_list):
+                        added.update(self.get_package_deps(po))
+                    added.update(self.resolve_file_deps())
 
             if self.is_sources:
-                added_srpms = self.add_srpms()
+                with tracing.span("gather:srpms", pass_num=pass_num):
+                    added_srpms = self.add_srpms()
                 added.update(added_srpms)
 
             if self.is_selfhosting:
-                for srpm_po in sorted(added_srpms):
-                    added.update(self.get_package_deps(srpm_po))
+                with tracing.span("gather:selfhosting", pass_num=pass_num):
+                    added.update(self.add_buildrequires(self.srpm_po_list))
 
             if self.is_fulltree:
-                new = self.add_fulltree()
+                with tracing.span("gather:fulltree", pass_num=pass_num):
+                    new = self.add_fulltree()
                 self.fulltree_packages.update(new)
-                self.fulltree_packages.update([ self.sourcerpm_srpmpo_map[i.sourcerpm] for i in new ])
+                self.fulltree_packages.update([ self.get_srpm_po(i) for i in new ])
                 added.update(new)
             if added:
                 continue
 
             # add langpacks
-            new = self.add_langpacks(self.po_list)
+            with tracing.span("gather:langpacks", pass_num=pass_num):
+                new = self.add_langpacks(self.po_list)
             self.langpack_packages.update(new)
             if self.is_sources:
-                self.langpack_packages.update([ self.sourcerpm_srpmpo_map[i.sourcerpm] for i in new ])
+                self.langpack_packages.update([ self.get_srpm_po(i) for i in new ])
             added.update(new)
             if added:
                 continue
 
             # add multilib packages
-            new = self.add_multilib(self.po_list)
+            with tracing.span("gather:multilib", pass_num=pass_num):
+                new = self.add_multilib(self.po_list)
             self.multilib_packages.update(new)
-            self.multilib_packages.update([ self.sourcerpm_srpmpo_map[i.sourcerpm] for i in new ])
+            if self.is_sources:
+                self.multilib_packages.update([ self.get_srpm_po(i) for i in new ])
             added.update(new)
             if added:
                 continue
 
+        if self.multilib_verdicts is not None:
+            self.multilib_verdicts.save()
+
     def get_srpm_po(self, po):
         """Given a package object, get a package object for the corresponding source rpm."""
 
@@ -887,42 +1131,26 @@ class Pungi(pypungi.PungiBase):
         name, ver, rel = nvr.rsplit('-', 2)
 
         # ... but even "nosrc" packages are stored as "src" in repodata
-        srpm_po_list = self.ayum.pkgSack.searchNevra(name=name, ver=ver, rel=rel, arch="src")
+        srpm_po_list = self.sack.search_nvr("source", name, ver, rel)
         if not srpm_po_list:
             raise RuntimeError("Cannot find a source rpm for %s" % po.sourcerpm)
         srpm_po = srpm_po_list[0]
         self.sourcerpm_srpmpo_map[po.sourcerpm] = srpm_po
         return srpm_po
 
-    def createSourceHashes(self):
-        """Create two dicts - one that maps binary POs to source POs, and
-           one that maps a single source PO to all binary POs it produces.
-           Requires yum still configured."""
-        self.src_by_bin = {}
-        self.bin_by_src = {}
-        self.logger.info("Generating source <-> binary package mappings")
-        #(dummy1, everything, dummy2) = yum.packages.parsePackages(self.all_pkgs, ['*'], pkgdict=self.pkg_refs.copy())
-        failed = []
-        for po in self.all_pkgs:
-            if is_source(po):
-                continue
-            try:
-                srpmpo = self.get_srpm_po(po)
-            except RuntimeError:
-                failed.append(po.sourcerpm)
-                continue
-
-            self.src_by_bin[po] = srpmpo
-            if self.bin_by_src.has_key(srpmpo):
-                self.bin_by_src[srpmpo].append(po)
-            else:
-                self.bin_by_src[srpmpo] = [po]
+    def check_srpms(self):
+        """Fail early if a source rpm of any binary package in the sack is missing."""
+        failed = set()
+        for partition in ("native", "multilib", "debuginfo"):
+            for po in self.sack.packages(partition):
+                try:
+                    self.get_srpm_po(po)
+                except RuntimeError:
+                    failed.add(po.sourcerpm)
 
         if failed:
-            self.logger.info("The following srpms could not be found: %s" % (
-                pprint.pformat(list(sorted(failed)))))
-            self.logger.info("Couldn't find %i of %i srpms." % (
-                len(failed), len(self.src_by_bin)))
+            self.logger.info("The following srpms could not be found: %s" % ", ".join(sorted(failed)))
+            self.logger.info("Couldn't find %i of %i srpms." % (len(failed), len(failed) + len(self.sourcerpm_srpmpo_map)))
             raise RuntimeError("Could not find all srpms.")
 
     def add_srpms(self, po_list=None):
@@ -933,11 +1161,10 @@ class Pungi(pypungi.PungiBase):
         srpms = set()
         po_list = po_list or self.po_list
         for po in sorted(po_list):
-            srpm_po = self.sourcerpm_srpmpo_map[po.sourcerpm]
+            srpm_po = self.get_srpm_po(po)
             if srpm_po in self.completed_add_srpms:
                 continue
-            msg = "Added source package %s.%s (repo: %s)" % (srpm_po.name, srpm_po.arch, srpm_po.repoid)
-            self.add_source(srpm_po, msg)
+            self.add_source(srpm_po, "source", po)
 
             # flags
             if po in self.input_packages:
@@ -977,22 +1204,19 @@ class Pungi(pypungi.PungiBase):
             has_native = False
             has_multilib = False
 
-            for po in self.excludePackages(self.bin_by_src[srpm_po]):
-                if not is_package(po):
-                    continue
-                if po.arch == "noarch":
-                    continue
-                if po not in self.po_list:
-                    # process only already included packages
-                    if po.arch in self.valid_multilib_arches:
-                        has_multilib = True
-                    elif po.arch in self.valid_native_arches:
-                        has_native = True
-                    continue
-                if po.arch in self.valid_multilib_arches and self.greedy_method == "all":
-                    include_multilib = True
-                elif po.arch in self.valid_native_arches:
+            # sack packages are already filtered by excludePackages()
+            native, multilib, noarch = self.sack.siblings(srpm_po)
+            for po in native:
+                if po in self.po_list:
                     include_native = True
+                else:
+                    has_native = True
+            for po in multilib:
+                if po in self.po_list:
+                    if self.greedy_method == "all":
+                        include_multilib = True
+                else:
+                    has_multilib = True
 
             # XXX: this is very fragile!
             # Do not make any changes unless you really know what you're doing!
@@ -1006,20 +1230,15 @@ class Pungi(pypungi.PungiBase):
                     # SCENARIO: a noarch package was already pulled in and there are no x86_64 packages; we want i686 in to complete the package set
                     include_multilib = True
 
-            for po in self.excludePackages(self.bin_by_src[srpm_po]):
-                if not is_package(po):
-                    continue
+            candidates = list(noarch)
+            if include_native:
+                candidates.extend(native)
+            if include_multilib:
+                candidates.extend(multilib)
+            for po in candidates:
                 if po in self.po_list:
                     continue
-                if po.arch != "noarch":
-                    if po.arch in self.valid_multilib_arches:
-                        if not include_multilib:
-                            continue
-                    if po.arch in self.valid_native_arches:
-                        if not include_native:
-                            continue
-                msg = "Added %s.%s (repo: %s) to complete package set" % (po.name, po.arch, po.repoid)
-                self.add_package(po, msg)
+                self.add_package(po, "fulltree", srpm_po)
         return added
 
     def getDebuginfoList(self):
@@ -1028,22 +1247,18 @@ class Pungi(pypungi.PungiBase):
            configured and a list of package objects"""
 
         added = set()
-        for po in self.all_pkgs:
-            if not is_debug(po):
-                continue
-
+        for po in self.sack.packages("debuginfo"):
             if po.sourcerpm not in self.sourcerpm_arch_map:
                 # TODO: print a warning / throw an error
                 continue
-            if not (set(self.compatible_arches[po.arch]) & set(self.sourcerpm_arch_map[po.sourcerpm]) - set(["noarch"])):
+            if not (self.arch_table.compatible_mask.get(po.arch, 0) & self.sourcerpm_arch_map[po.sourcerpm] & ~self.arch_table.bit("noarch")):
                 # skip all incompatible arches
                 # this pulls i386 debuginfo for a i686 package for example
                 continue
-            msg = 'Added debuginfo %s.%s (repo: %s)' % (po.name, po.arch, po.repoid)
-            self.add_debuginfo(po, msg)
+            srpm_po = self.get_srpm_po(po)
+            self.add_debuginfo(po, "debuginfo", srpm_po)
 
             # flags
-            srpm_po = self.sourcerpm_srpmpo_map[po.sourcerpm]
             if srpm_po in self.input_packages:
                 self.input_packages.add(po)
             if srpm_po in self.fulltree_packages:
@@ -1056,16 +1271,8 @@ class Pungi(pypungi.PungiBase):
             added.add(po)
         return added
 
-    def _downloadPackageList(self, polist, relpkgdir):
-        """Cycle through the list of package objects and
-           download them from their respective repos."""
-
-        downloads = []
-        for pkg in polist:
-            downloads.append('%s.%s' % (pkg.name, pkg.arch))
-            downloads.sort()
-        self.logger.info("Download list: %s" % downloads)
-
+    def _packageDir(self, relpkgdir):
+        """Return directory for packages in the tree; create and clean it if needed."""
         pkgdir = os.path.join(self.config.get('pungi', 'destdir'),
                               self.config.get('pungi', 'version'),
                               self.config.get('pungi', 'flavor'),
@@ -1077,8 +1284,51 @@ class Pungi(pypungi.PungiBase):
             pypungi.util._ensuredir(pkgdir, self.logger, force=True, clean=False)
         else:
             pypungi.util._ensuredir(pkgdir, self.logger, force=self.config.getboolean('pungi', 'force'), clean=True)
+        return pkgdir
+
+    def _linkPackage(self, po, local, pkgdir):
+        """Link a downloaded package into the tree."""
+        basename = os.path.basename(po.relativepath)
+
+        if self.config.getboolean('pungi', 'nohash'):
+            target = os.path.join(pkgdir, basename)
+        else:
+            target = os.path.join(pkgdir, po.name[0].lower(), basename)
+            # Make sure we have the hashed dir available to link into we only want dirs there to corrospond to packages
+            # that we are including so we can not just do A-Z 0-9
+            pypungi.util._ensuredir(os.path.join(pkgdir, po.name[0].lower()), self.logger, force=True, clean=False)
+
+        # Link downloaded package in (or link package from file repo)
+        try:
+            pypungi.util._link(local, target, self.logger, force=True)
+        except:
+            self.logger.error("Unable to link %s from the yum cache." % po.name)
+            sys.exit(1)
+
+    @tracing.traced()
+    def _downloadPackageList(self, polist, relpkgdir):
+        """Cycle through the list of package objects and
+           download them from their respective repos."""
+        if self.from_manifest:
+            return self._downloadManifestPackageList(polist, relpkgdir)
 
-        probs = self.ayum.downloadPkgs(polist)
+        import yum
+
+        downloads = []
+        for pkg in polist:
+            downloads.append('%s.%s' % (pkg.name, pkg.arch))
+            downloads.sort()
+        self.logger.info("Download list: %s" % downloads)
+
+        pkgdir = self._packageDir(relpkgdir)
+
+        # verify cached packages holding the shared lock,
+        # take the exclusive lock only to download missing or broken ones
+        missing = [ po for po in polist if not (os.path.exists(po.localPkg()) and self.verifyCachePkg(po, po.localPkg())) ]
+        probs = {}
+        if missing:
+            with self.cachelock.exclusive():
+                probs = self.ayum.downloadPkgs(missing)
 
         if len(probs.keys()) > 0:
             self.logger.error("Errors were encountered while downloading packages.")
@@ -1089,28 +1339,66 @@ class Pungi(pypungi.PungiBase):
             sys.exit(1)
 
         for po in polist:
-            basename = os.path.basename(po.relativepath)
+            self._linkPackage(po, po.localPkg(), pkgdir)
 
-            local = po.localPkg()
-            if self.config.getboolean('pungi', 'nohash'):
-                target = os.path.join(pkgdir, basename)
-            else:
-                target = os.path.join(pkgdir, po.name[0].lower(), basename)
-                # Make sure we have the hashed dir available to link into we only want dirs there to corrospond to packages
-                # that we are including so we can not just do A-Z 0-9
-                pypungi.util._ensuredir(os.path.join(pkgdir, po.name[0].lower()), self.logger, force=True, clean=False)
+        self.logger.info('Finished downloading packages.')
 
-            # Link downloaded package in (or link package from file repo)
+    def _verifyManifestPackage(self, po, path):
+        """check the package checksum recorded in the manifest
+           return True if pkg is good, False if not"""
+        csum_type, csum = po.returnIdSum()
+        if csum_type == "sha":
+            csum_type = "sha1"
+        return pypungi.util._doCheckSum(path, csum_type, self.logger) == "%s:%s" % (csum_type, csum)
+
+    def _fetchManifestPackage(self, po):
+        """Return local path of a manifest package, downloading it if needed."""
+        # the yum cache of the gather run, if it's on this machine
+        if po.localpath and os.path.isfile(po.localpath) and self._verifyManifestPackage(po, po.localpath):
+            return po.localpath
+
+        url = repodata.join_url(po.baseurl, po.relativepath)
+        if "://" not in url or url.startswith("file://"):
+            path = url.startswith("file://") and url[len("file://"):] or url
+            if os.path.isfile(path):
+                return path
+
+        cachedir = os.path.join(self.config.get('pungi', 'cachedir'), 'manifest', po.repoid)
+        path = os.path.join(cachedir, os.path.basename(po.relativepath))
+        if os.path.isfile(path) and self._verifyManifestPackage(po, path):
+            return path
+
+        with self.cachelock.exclusive():
+            pypungi.util._ensuredir(cachedir, self.logger, force=True, clean=False)
+            self.logger.info("Downloading %s" % url)
+            tmp_path = "%s.part" % path
             try:
-                pypungi.util._link(local, target, self.logger, force=True)
-                continue
-            except:
-                self.logger.error("Unable to link %s from the yum cache." % po.name)
+                src = repodata.open_url(url)
+                dst = open(tmp_path, "wb")
+                try:
+                    shutil.copyfileobj(src, dst)
+                finally:
+                    src.close()
+                    dst.close()
+            except (IOError, OSError), ex:
+                self.logger.error("Unable to download %s: %s" % (url, ex))
+                sys.exit(1)
+
+            if not self._verifyManifestPackage(po, tmp_path):
+                self.logger.error("Checksum mismatch: %s" % url)
                 sys.exit(1)
+            os.rename(tmp_path, path)
+        return path
 
+    def _downloadManifestPackageList(self, polist, relpkgdir):
+        """Download or link packages listed in a gather manifest, without yum."""
+        self.logger.info("Download list: %s" % sorted([ '%s.%s' % (po.name, po.arch) for po in polist ]))
+        pkgdir = self._packageDir(relpkgdir)
+        for po in polist:
+            self._linkPackage(po, self._fetchManifestPackage(po), pkgdir)
         self.logger.info('Finished downloading packages.')
 
-    @yumlocked
+    @cachelocked(cachelock.SHARED)
     def downloadPackages(self):
         """Download the package objects obtained in getPackageObjects()."""
 
@@ -1119,10 +1407,13 @@ class Pungi(pypungi.PungiBase):
                                                self.config.get('pungi', 'osdir'),
                                                self.config.get('pungi', 'product_path')))
 
+    def _compsPath(self):
+        return os.path.join(self.workdir, '%s-%s-comps.xml' % (self.config.get('pungi', 'name'), self.config.get('pungi', 'version')))
+
     def makeCompsFile(self):
         """Gather any comps files we can from repos and merge them into one."""
 
-        ourcompspath = os.path.join(self.workdir, '%s-%s-comps.xml' % (self.config.get('pungi', 'name'), self.config.get('pungi', 'version')))
+        ourcompspath = self._compsPath()
 
         # Filter out things we don't include
         ourgroups = []
@@ -1159,7 +1450,7 @@ class Pungi(pypungi.PungiBase):
 
         #pypungi.util._doRunCommand(compsfilter, self.logger)
 
-    @yumlocked
+    @cachelocked(cachelock.SHARED)
     def downloadSRPMs(self):
         """Cycle through the list of srpms and
            find the package objects for them, Then download them."""
@@ -1167,7 +1458,7 @@ class Pungi(pypungi.PungiBase):
         # do the downloads
         self._downloadPackageList(self.srpm_po_list, os.path.join('source', 'SRPMS'))
 
-    @yumlocked
+    @cachelocked(cachelock.SHARED)
     def downloadDebuginfo(self):
         """Cycle through the list of debuginfo rpms and
            download them."""
@@ -1176,63 +1467,102 @@ class Pungi(pypungi.PungiBase):
         self._downloadPackageList(self.debuginfo_po_list, os.path.join(self.tree_arch, 'debug'))
 
     def _list_packages(self, po_list):
-        """Cycle through the list of packages and return their paths."""
-        result = []
-        for po in po_list:
-            if po.repoid in self.lookaside_repos:
-                continue
-
-            flags = []
-
-            # input
-            if po in self.input_packages:
-                flags.append("input")
-
-            # comps
-            if po in self.comps_packages:
-                flags.append("comps")
-
-            # prepopulate
-            if po in self.prepopulate_packages:
-                flags.append("prepopulate")
-
-            # langpack
-            if po in self.langpack_packages:
-                flags.append("langpack")
-
-            # multilib
-            if po in self.multilib_packages:
-                flags.append("multilib")
-
-            # fulltree
-            if po in self.fulltree_packages:
-                flags.append("fulltree")
-
-            # fulltree-exclude
-            if is_source(po):
-                srpm_name = po.name
-            else:
-                srpm_name = po.sourcerpm.rsplit("-", 2)[0]
-            if srpm_name in self.fulltree_excludes:
-                flags.append("fulltree-exclude")
-
-            result.append({
-                "path": os.path.join(po.basepath or "", po.relativepath),
-                "flags": sorted(flags),
-            })
-        result.sort(lambda x, y: cmp(x["path"], y["path"]))
-        return result
+        """
+        Yield records of packages not from lookaside repos, sorted by path.
+        Package lists are sets, so paths are computed for all packages up
+        front; they're ordered with a heap, so the first record comes after
+        a linear pass instead of a full sort, and records are built one at
+        a time.
+        """
+        packages = [ (os.path.join(po.basepath or "", po.relativepath), i, po)
+                     for i, po in enumerate(po_list) if po.repoid not in self.lookaside_repos ]
+        heapq.heapify(packages)
+        while packages:
+            path, i, po = heapq.heappop(packages)
+            csum_type, csum = po.returnIdSum()
+            yield {
+                "path": path,
+                "name": po.name,
+                "epoch": po.epoch,
+                "version": po.version,
+                "release": po.release,
+                "arch": po.arch,
+                "size": po.size,
+                "checksum": "%s:%s" % (csum_type, csum),
+                "repoid": po.repoid,
+                "sourcerpm": po.sourcerpm,
+                "flags": sorted(self._package_flags(po)),
+            }
+
+    def _package_flags(self, po):
+        """Return list of flags of a package."""
+        flags = []
+        for flag, attr in self.PACKAGE_FLAGS:
+            if po in getattr(self, attr):
+                flags.append(flag)
+
+        # fulltree-exclude
+        if is_source(po):
+            srpm_name = po.name
+        else:
+            srpm_name = self._srpm_names.get(po.sourcerpm, None)
+            if srpm_name is None:
+                srpm_name = self._srpm_names[po.sourcerpm] = po.sourcerpm.rsplit("-", 2)[0]
+        if srpm_name in self.fulltree_excludes:
+            flags.append("fulltree-exclude")
+        return flags
+
+    def writeManifest(self, path=None):
+        """Write package lists and flags into a gather manifest."""
+        path = path or self.manifest_path
+        data = {
+            "arch": self.tree_arch,
+            "flavor": self.config.get('pungi', 'flavor'),
+            "compose_version": self.config.get('pungi', 'version'),
+            "comps": os.path.basename(self._compsPath()),
+        }
+        for key, attr in manifest.MANIFEST_LISTS:
+            data[key] = [ manifest.package_record(po, self._package_flags(po)) for po in getattr(self, attr) ]
+        manifest.write_manifest(path, data)
+        self.logger.info("Wrote gather manifest: %s" % path)
+
+    def writeProvenance(self, path=None):
+        """Write why packages were added; see pypungi.provenance for queries."""
+        path = path or self.provenance_path
+        self.provenance.write(path)
+        self.logger.info("Wrote package provenance: %s" % path)
+
+    def loadManifest(self, path):
+        """Load package lists and flags from a gather manifest instead of gathering."""
+        data = manifest.read_manifest(path)
+        if data["arch"] != self.tree_arch:
+            raise ValueError("Manifest %s is for arch %s, not %s" % (path, data["arch"], self.tree_arch))
+
+        for key, attr in manifest.MANIFEST_LISTS:
+            setattr(self, attr, self._package_set(data[key]))
+            for po in data[key]:
+                for flag, flag_attr in self.PACKAGE_FLAGS:
+                    if flag in po.flags:
+                        getattr(self, flag_attr).add(po)
+
+        # comps file is written by the gather run next to the manifest
+        comps = os.path.join(os.path.dirname(os.path.abspath(path)), data["comps"])
+        if os.path.isfile(comps) and not os.path.exists(self._compsPath()):
+            shutil.copy2(comps, self._compsPath())
+
+        self.from_manifest = True
+        self.logger.info("Loaded gather manifest: %s" % path)
 
     def list_packages(self):
-        """Cycle through the list of RPMs and return their paths."""
+        """Cycle through the list of RPMs and yield their records."""
         return self._list_packages(self.po_list)
 
     def list_srpms(self):
-        """Cycle through the list of SRPMs and return their paths."""
+        """Cycle through the list of SRPMs and yield their records."""
         return self._list_packages(self.srpm_po_list)
 
     def list_debuginfo(self):
-        """Cycle through the list of DEBUGINFO RPMs and return their paths."""
+        """Cycle through the list of DEBUGINFO RPMs and yield their records."""
         return self._list_packages(self.debuginfo_po_list)
 
     def _size_packages(self, po_list):
@@ -1262,10 +1592,13 @@ class Pungi(pypungi.PungiBase):
         if subfile.startswith(basedir):
             return subfile.replace(basedir + os.path.sep, '')
         
+    @tracing.traced()
     def _makeMetadata(self, path, cachedir, comps=False, repoview=False, repoviewtitle=False,
                       baseurl=False, output=False, basedir=False, update=True,
                       compress_type=None):
         """Create repodata and repoview."""
+        import createrepo
+
         
         conf = createrepo.MetaDataConfig()
         conf.cachedir = os.path.join(cachedir, 'createrepocache')
@@ -1310,24 +1643,31 @@ class Pungi(pypungi.PungiBase):
         
     def doCreaterepo(self, comps=True):
         """Run createrepo to generate repodata in the tree."""
+        self.doCreaterepoTree(comps=comps)
+        self.doCreaterepoDebuginfo()
 
-
-        compsfile = None
-        if comps:
-            compsfile = os.path.join(self.workdir, '%s-%s-comps.xml' % (self.config.get('pungi', 'name'), self.config.get('pungi', 'version')))
-        
+    def _createrepoCachedir(self):
         # setup the cache dirs
         for target in ['createrepocache', 'repoviewcache']:
             pypungi.util._ensuredir(os.path.join(self.config.get('pungi', 'cachedir'),
                                             target), 
                                self.logger, 
                                force=True)
-            
+        return self.config.get('pungi', 'cachedir')
+
+    def doCreaterepoTree(self, comps=True):
+        """Run createrepo to generate repodata in the os tree."""
+
+        compsfile = None
+        if comps:
+            compsfile = self._compsPath()
+
+        cachedir = self._createrepoCachedir()
+
         repoviewtitle = '%s %s - %s' % (self.config.get('pungi', 'name'), 
                                         self.config.get('pungi', 'version'),
                                         self.tree_arch)
 
-        cachedir = self.config.get('pungi', 'cachedir')
         compress_type = self.config.get('pungi', 'compress_type')
 
         # setup the createrepo call
@@ -1335,14 +1675,20 @@ class Pungi(pypungi.PungiBase):
                            repoview=True, repoviewtitle=repoviewtitle,
                            compress_type=compress_type)
 
-        # create repodata for debuginfo
-        if self.config.getboolean('pungi', 'debuginfo'):
-            path = os.path.join(self.archdir, 'debug')
-            if not os.path.isdir(path):
-                self.logger.debug("No debuginfo for %s" % self.tree_arch)
-                return
-            self._makeMetadata(path, cachedir, repoview=False,
-                               compress_type=compress_type)
+    def doCreaterepoDebuginfo(self):
+        """Run createrepo to generate repodata for debuginfo."""
+
+        if not self.config.getboolean('pungi', 'debuginfo'):
+            return
+
+        path = os.path.join(self.archdir, 'debug')
+        if not os.path.isdir(path):
+            self.logger.debug("No debuginfo for %s" % self.tree_arch)
+            return
+        cachedir = self._createrepoCachedir()
+        compress_type = self.config.get('pungi', 'compress_type')
+        self._makeMetadata(path, cachedir, repoview=False,
+                           compress_type=compress_type)
 
     def _shortenVolID(self):
         """shorten the volume id to make sure its under 32 characters"""
@@ -1368,8 +1714,199 @@ class Pungi(pypungi.PungiBase):
         else:
             return volid
 
+    def _mkCacheTmpDir(self, cachepath):
+        """Return a new private directory next to cachepath to fill before publishing it."""
+        parent = os.path.dirname(cachepath)
+        try:
+            os.makedirs(parent)
+        except OSError, ex:
+            # created by another compose
+            if ex.errno != errno.EEXIST:
+                raise
+        return tempfile.mkdtemp(prefix=".%s." % os.path.basename(cachepath), dir=parent)
+
+    def _publishCacheDir(self, tmppath, cachepath, replace=False):
+        """Move a directory filled by _mkCacheTmpDir() to cachepath.
+           An existing entry (possibly published by another compose meanwhile)
+           is kept unless replace is set."""
+
+        with self.cachelock.exclusive():
+            oldpath = None
+            if os.path.isdir(cachepath):
+                if not replace:
+                    shutil.rmtree(tmppath)
+                    return
+                oldpath = tempfile.mkdtemp(prefix=".%s." % os.path.basename(cachepath),
+                                           dir=os.path.dirname(cachepath))
+                os.rename(cachepath, os.path.join(oldpath, 'old'))
+            try:
+                os.rename(tmppath, cachepath)
+            except OSError, ex:
+                # published by a compose which doesn't hold the lock
+                if ex.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+                shutil.rmtree(tmppath)
+            if oldpath:
+                shutil.rmtree(oldpath)
+
+    def _buildinstallRepoChecksums(self):
+        """Return sorted [(repoid, mdtype, checksum)] of the metadata lorax reads
+           from the enabled repos, or None if it can't be retrieved."""
+        import yum
+
+        result = []
+        try:
+            # repomd.xml is downloaded again by yum (metadata_expire = 0)
+            with self.cachelock.exclusive():
+                for repo in self.ayum.repos.listEnabled():
+                    for mdtype in ("primary", "group"):
+                        try:
+                            data = repo.repoXML.getData(mdtype)
+                        except yum.Errors.RepoMDError:
+                            # no comps in the repo
+                            continue
+                        # the uncompressed checksum doesn't change when only the compression does
+                        csum = data.openchecksum[1] and data.openchecksum or data.checksum
+                        result.append((repo.id, mdtype, tuple(csum)))
+        except yum.Errors.RepoError, ex:
+            self.logger.warn("Unable to read repo metadata for the buildinstall cache: %s" % ex)
+            return None
+        return sorted(result)
+
+    def _buildinstallCacheKey(self, lorax, conf_file, installpkgs, repos, **kwargs):
+        """Return a hash of the lorax inputs other than the installed packages:
+           metadata checksums of the repos, lorax config and templates,
+           installpkgs and the product options."""
+
+        checksum = hashlib.sha256()
+        checksum.update("arch=%s\n" % self.tree_arch)
+        for key in sorted(kwargs):
+            checksum.update("%s=%r\n" % (key, kwargs[key]))
+        checksum.update("installpkgs=%r\n" % sorted(installpkgs or []))
+        for repo in repos:
+            checksum.update("repo=%r\n" % (repo, ))
+
+        if conf_file:
+            checksum.update(open(conf_file, 'r').read())
+        # the effective config also covers defaults of the installed lorax
+        try:
+            for section in sorted(lorax.conf.sections()):
+                checksum.update("[%s]\n" % section)
+                for key, value in sorted(lorax.conf.items(section, raw=True)):
+                    checksum.update("%s=%s\n" % (key, value))
+        except (AttributeError, TypeError, ConfigParser.Error):
+            pass
+
+        # templates live in the lorax sharedir; a lorax update changes them
+        try:
+            sharedir = lorax.conf.get('lorax', 'sharedir')
+        except (AttributeError, ConfigParser.Error):
+            sharedir = None
+        if sharedir and os.path.isdir(sharedir):
+            for dirpath, dirnames, filenames in os.walk(sharedir):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    path = os.path.join(dirpath, filename)
+                    st = os.stat(path)
+                    checksum.update("%s %s %s\n" % (path, st.st_size, st.st_mtime))
+
+        return checksum.hexdigest()
+
+    def _buildinstallCachePath(self, cache_key):
+        return os.path.join(self.config.get('pungi', 'cachedir'), 'buildinstall',
+                            self.tree_arch, cache_key)
+
+    def _buildinstallPackages(self):
+        """Return a sorted list of [name, arch, epoch, version, release, csum_type, csum]
+           for every package lorax installed, or None if they can't be identified."""
+
+        result = []
+        self.ayum.closeRpmDB()
+        for po in self.ayum.rpmdb.returnPackages():
+            if po.name == 'gpg-pubkey':
+                continue
+            matches = self.ayum.pkgSack.searchPkgTuple(po.pkgtup)
+            if not matches:
+                self.logger.warning("Cannot find %s in any repo, not caching buildinstall output" % po)
+                return None
+            csum_type, csum = matches[0].returnIdSum()
+            result.append(list(po.pkgtup) + [csum_type, csum])
+        if not result:
+            # an unreadable rpmdb would match any package set
+            self.logger.warning("No packages found in the buildinstall rpmdb, not caching buildinstall output")
+            return None
+        return sorted(result)
+
+    def _restoreBuildinstallCache(self, cache_key):
+        """Restore lorax output from the cache if every package lorax resolved
+           last time is still the newest one available with the same checksum."""
+        import yum
+
+        cachepath = self._buildinstallCachePath(cache_key)
+        try:
+            packages = json.load(open(os.path.join(cachepath, 'packages'), 'r'))
+        except (IOError, ValueError):
+            self.logger.info("No buildinstall cache entry for %s" % cache_key)
+            return False
+        if not packages:
+            self.logger.info("Buildinstall cache entry %s doesn't list packages, ignoring it" % cache_key)
+            return False
+
+        self.ayum._getSacks(archlist=self.valid_arches, thisrepo='ourtree')
+        for name, arch, epoch, version, release, csum_type, csum in packages:
+            matches = self.ayum.pkgSack.searchNevra(name=name, arch=arch)
+            if matches:
+                newest = yum.packageSack.ListPackageSack(matches).returnNewestByNameArch()[0]
+                if newest.pkgtup == (name, arch, epoch, version, release) and newest.returnIdSum() == (csum_type, csum):
+                    continue
+            self.logger.info("Buildinstall cache miss: %s.%s changed" % (name, arch))
+            return False
+
+        treepath = os.path.join(cachepath, 'tree')
+        for name in BUILDINSTALL_CACHE_OUTPUTS:
+            source = os.path.join(treepath, name)
+            target = os.path.join(self.topdir, name)
+            # copy, not link: files such as isolinux.bin are rewritten in the tree
+            # after buildinstall (mkisofs -boot-info-table)
+            if os.path.isdir(source):
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+                shutil.copytree(source, target, symlinks=True)
+            elif os.path.isfile(source):
+                shutil.copy2(source, target)
+        return True
+
+    def _storeBuildinstallCache(self, cache_key):
+        """Save lorax output together with the list of packages it installed."""
+
+        packages = self._buildinstallPackages()
+        if packages is None:
+            return
+
+        cachepath = self._buildinstallCachePath(cache_key)
+        tmppath = self._mkCacheTmpDir(cachepath)
+
+        treepath = os.path.join(tmppath, 'tree')
+        os.makedirs(treepath)
+        for name in BUILDINSTALL_CACHE_OUTPUTS:
+            source = os.path.join(self.topdir, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(treepath, name), symlinks=True)
+            elif os.path.isfile(source):
+                shutil.copy2(source, os.path.join(treepath, name))
+
+        packagesfile = open(os.path.join(tmppath, 'packages'), 'w')
+        json.dump(packages, packagesfile)
+        packagesfile.close()
+
+        # the entry at cachepath, if any, didn't match the packages installed now
+        self._publishCacheDir(tmppath, cachepath, replace=True)
+        self.logger.info("Saved buildinstall output to cache (key: %s)" % cache_key)
+
+    @tracing.traced()
     def doBuildinstall(self):
         """Run lorax on the tree."""
+        import pylorax
 
         # the old ayum object has transaction data that confuse lorax, reinit.
         self._inityum()
@@ -1414,6 +1951,7 @@ class Pungi(pypungi.PungiBase):
             conf_file = self.config.get('lorax', 'conf_file')
             lorax.configure(conf_file=conf_file)
         except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            conf_file = None
             lorax.configure()
 
         try:
@@ -1421,9 +1959,24 @@ class Pungi(pypungi.PungiBase):
         except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
             installpkgs = None
 
-        lorax.run(self.ayum, product=product, version=version, release=release,
-                  variant=variant, bugurl=bugurl, isfinal=isfinal, domacboot=domacboot,
-                  workdir=workdir, outputdir=outputdir, volid=volid, installpkgs=installpkgs)
+        cache_key = None
+        repos = None
+        if self.config.getboolean('pungi', 'buildinstall_cache'):
+            repos = self._buildinstallRepoChecksums()
+        if repos is not None:
+            cache_key = self._buildinstallCacheKey(lorax, conf_file, installpkgs, repos,
+                                                   product=product, version=version, release=release,
+                                                   variant=variant, bugurl=bugurl, isfinal=isfinal,
+                                                   domacboot=domacboot, volid=volid)
+
+        if cache_key and self._restoreBuildinstallCache(cache_key):
+            self.logger.info("Restored buildinstall output from cache (key: %s)" % cache_key)
+        else:
+            lorax.run(self.ayum, product=product, version=version, release=release,
+                      variant=variant, bugurl=bugurl, isfinal=isfinal, domacboot=domacboot,
+                      workdir=workdir, outputdir=outputdir, volid=volid, installpkgs=installpkgs)
+            if cache_key:
+                self._storeBuildinstallCache(cache_key)
 
         # write out the tree data for snake
         self.writeinfo('tree: %s' % self.mkrelative(self.topdir))
@@ -1483,6 +2036,37 @@ class Pungi(pypungi.PungiBase):
         treeinfo.write(treefile)
         treefile.close()
 
+    def _getRelnotePackages(self, relnoterpms):
+        """Return (path, checksum) of the release note packages, looked up in the
+           gathered package list or, if gather didn't run, in the tree."""
+
+        result = []
+        pkgdir = os.path.join(self.topdir, self.config.get('pungi', 'product_path'))
+        for po in sorted(self.po_list):
+            if po.name not in relnoterpms:
+                continue
+            path = po.localPkg()
+            if not os.path.exists(path):
+                basename = os.path.basename(po.relativepath)
+                if self.config.getboolean('pungi', 'nohash'):
+                    path = os.path.join(pkgdir, basename)
+                else:
+                    path = os.path.join(pkgdir, po.name[0].lower(), basename)
+            result.append((path, "%s:%s" % po.returnIdSum()))
+
+        if self.po_list:
+            return result
+
+        for dirpath, dirnames, filenames in os.walk(pkgdir):
+            for filename in sorted(filenames):
+                if not filename.endswith(".rpm"):
+                    continue
+                if filename.rsplit('-', 2)[0] not in relnoterpms:
+                    continue
+                path = os.path.join(dirpath, filename)
+                result.append((path, pypungi.util._doCheckSum(path, 'sha256', self.logger)))
+        return result
+
     def doGetRelnotes(self):
         """Get extra files from packages in the tree to put in the topdir of
            the tree."""
@@ -1501,28 +2085,35 @@ class Pungi(pypungi.PungiBase):
 
         pypungi.util._ensuredir(docsdir, self.logger, force=self.config.getboolean('pungi', 'force'), clean=True)
 
-        # Expload the packages we list as relnote packages
-        pkgs = os.listdir(os.path.join(self.topdir, self.config.get('pungi', 'product_path')))
-
-        rpm2cpio = ['/usr/bin/rpm2cpio']
-        cpio = ['cpio', '-imud']
-
-        for pkg in pkgs:
-            pkgname = pkg.rsplit('-', 2)[0]
-            for relnoterpm in relnoterpms:
-                if pkgname == relnoterpm:
-                    extraargs = [os.path.join(self.topdir, self.config.get('pungi', 'product_path'), pkg)]
-                    try:
-                        p1 = subprocess.Popen(rpm2cpio + extraargs, cwd=docsdir, stdout=subprocess.PIPE)
-                        (out, err) = subprocess.Popen(cpio, cwd=docsdir, stdin=p1.stdout, stdout=subprocess.PIPE, 
-                            stderr=subprocess.PIPE, universal_newlines=True).communicate()
-                    except:
-                        self.logger.error("Got an error from rpm2cpio")
-                        self.logger.error(err)
-                        raise
-
-                    if out:
-                        self.logger.debug(out)
+        def is_relnote(name):
+            parts = name.split("/")
+            for regex in fileres:
+                if regex.match(parts[-1]):
+                    return True
+            for directory in parts[:-1]:
+                for regex in dirres:
+                    if regex.match(directory):
+                        return True
+            return False
+
+        # extracted files are cached by package checksum and the patterns used
+        patterns = "%s\n%s" % (self.config.get('pungi', 'relnotefilere'), self.config.get('pungi', 'relnotedirre'))
+        for path, checksum in self._getRelnotePackages(relnoterpms):
+            cache_key = hashlib.sha256("%s\n%s" % (checksum, patterns)).hexdigest()
+            cachepath = os.path.join(self.config.get('pungi', 'cachedir'), 'relnotes', cache_key)
+            if not os.path.isdir(cachepath):
+                self.logger.info("Extracting release notes from %s" % os.path.basename(path))
+                tmppath = self._mkCacheTmpDir(cachepath)
+                try:
+                    extracted = rpmextract.extract_rpm(path, is_relnote, tmppath)
+                except (ValueError, IOError, OSError), ex:
+                    self.logger.error("Could not extract release notes from %s: %s" % (path, ex))
+                    shutil.rmtree(tmppath, ignore_errors=True)
+                    raise
+                self.logger.debug("Extracted %s" % extracted)
+                # entries are keyed by content, one published meanwhile is as good as ours
+                self._publishCacheDir(tmppath, cachepath)
+            pypungi.util._linktree(cachepath, docsdir, self.logger, force=True)
 
         # Walk the tree for our files
         for dirpath, dirname, filelist in os.walk(docsdir):
@@ -1562,6 +2153,7 @@ class Pungi(pypungi.PungiBase):
             sys.exit(1)
         checkfile.close()
 
+    @tracing.traced()
     def doCreateIsos(self):
         """Create iso of the tree."""
 
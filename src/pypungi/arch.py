@@ -40,42 +40,121 @@ def get_multilib_arch(yum_arch):
     return arch_info[0]
 
 
+# memoized results; rpmUtils.arch tables are static, so are these
+_VALID_MULTILIB_ARCHES_CACHE = {}   # {tree_arch: tuple}
+_VALID_ARCHES_CACHE = {}            # {(tree_arch, multilib, add_noarch, add_src): tuple}
+_ARCH_TABLE_CACHE = {}              # {tree_arch: ArchTable}
+_SPLIT_NAME_ARCH_CACHE = {}         # {name_arch: (name, arch)}
+
+
+def _valid_multilib_arches(tree_arch):
+    result = _VALID_MULTILIB_ARCHES_CACHE.get(tree_arch, None)
+    if result is None:
+        yum_arch = tree_arch_to_yum_arch(tree_arch)
+        multilib_arch = get_multilib_arch(yum_arch)
+        if not multilib_arch:
+            result = ()
+        else:
+            result = tuple([ i for i in rpmUtils.arch.getArchList(multilib_arch) if i not in ("noarch", "src") ])
+        _VALID_MULTILIB_ARCHES_CACHE[tree_arch] = result
+    return result
+
+
 def get_valid_multilib_arches(tree_arch):
-    yum_arch = tree_arch_to_yum_arch(tree_arch)
-    multilib_arch = get_multilib_arch(yum_arch)
-    if not multilib_arch:
-        return []
-    return [ i for i in rpmUtils.arch.getArchList(multilib_arch) if i not in ("noarch", "src") ]
+    return list(_valid_multilib_arches(tree_arch))
 
 
-def get_valid_arches(tree_arch, multilib=True, add_noarch=True, add_src=False):
+def _valid_arches(tree_arch, multilib=True, add_noarch=True, add_src=False):
+    key = (tree_arch, bool(multilib), bool(add_noarch), bool(add_src))
+    result = _VALID_ARCHES_CACHE.get(key, None)
+    if result is not None:
+        return result
+
     result = []
+    seen = set()
+    exclude = set()
+    if not multilib:
+        exclude.update(_valid_multilib_arches(tree_arch))
 
     yum_arch = tree_arch_to_yum_arch(tree_arch)
     for arch in rpmUtils.arch.getArchList(yum_arch):
-        if arch not in result:
+        if arch not in seen and arch not in exclude:
+            seen.add(arch)
             result.append(arch)
 
-    if not multilib:
-        for i in get_valid_multilib_arches(tree_arch):
-            while i in result:
-                result.remove(i)
-
-    if add_noarch and "noarch" not in result:
+    if add_noarch and "noarch" not in seen:
         result.append("noarch")
 
-    if add_src and "src" not in result:
+    if add_src and "src" not in seen:
         result.append("src")
 
+    result = tuple(result)
+    _VALID_ARCHES_CACHE[key] = result
     return result
 
 
+def get_valid_arches(tree_arch, multilib=True, add_noarch=True, add_src=False):
+    # return a new list, callers are free to modify it
+    return list(_valid_arches(tree_arch, multilib=multilib, add_noarch=add_noarch, add_src=add_src))
+
+
 def get_compatible_arches(arch, multilib=False):
     tree_arch = rpmUtils.arch.getBaseArch(arch)
     compatible_arches = get_valid_arches(tree_arch, multilib=multilib)
     return compatible_arches
 
 
+class ArchTable(object):
+    """
+    Immutable arch compatibility tables of a tree arch.
+    Each arch gets a bit, so sets of arches can be stored as ints
+    and tested with bit operations.
+    """
+
+    def __init__(self, tree_arch):
+        self.tree_arch = tree_arch
+        self.valid_arches = frozenset(_valid_arches(tree_arch, add_src=True))
+        self.native_arches = frozenset(_valid_arches(tree_arch, multilib=False))
+        self.multilib_arches = frozenset(_valid_multilib_arches(tree_arch))
+
+        self.compatible = {}        # {arch: frozenset(compatible arches)}
+        for arch in _valid_arches(tree_arch, add_src=True):
+            self.compatible[arch] = frozenset(get_compatible_arches(arch))
+
+        # all bits are assigned here, the table is never modified later
+        self._bits = {}
+        for arch in _valid_arches(tree_arch, add_src=True):
+            for i in [arch] + get_compatible_arches(arch):
+                if i not in self._bits:
+                    self._bits[i] = 1 << len(self._bits)
+
+        self.compatible_mask = {}   # {arch: bitmask of compatible arches}
+        for arch, compatible in self.compatible.iteritems():
+            self.compatible_mask[arch] = self.mask(compatible)
+
+    def bit(self, arch):
+        """Return bit assigned to an arch, 0 for arches unknown to the table."""
+        return self._bits.get(arch, 0)
+
+    def mask(self, arches):
+        result = 0
+        for arch in arches:
+            result |= self.bit(arch)
+        return result
+
+    def arches(self, mask):
+        """Return set of arches in a bitmask."""
+        return set([ arch for arch, bit in self._bits.iteritems() if mask & bit ])
+
+
+def get_arch_table(tree_arch):
+    result = _ARCH_TABLE_CACHE.get(tree_arch, None)
+    if result is None:
+        result = ArchTable(tree_arch)
+        _ARCH_TABLE_CACHE[tree_arch] = result
+    return result
+
+
 def is_valid_arch(arch):
     if arch in ("noarch", "src", "nosrc"):
         return True
@@ -85,10 +164,16 @@ def is_valid_arch(arch):
 
 
 def split_name_arch(name_arch):
+    result = _SPLIT_NAME_ARCH_CACHE.get(name_arch, None)
+    if result is not None:
+        return result
+
     if "." in name_arch:
         name, arch = name_arch.rsplit(".", 1)
         if not is_valid_arch(arch):
             name, arch = name_arch, None
     else:
         name, arch = name_arch, None
-    return name, arch
+    result = (name, arch)
+    _SPLIT_NAME_ARCH_CACHE[name_arch] = result
+    return result
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Shared/exclusive lock of the cache dir, shared by composes running in parallel.
+
+Sections reading the cache (repo metadata, cached packages) take the lock
+shared, sections writing to it take it exclusive. Sections nest: an
+exclusive section inside a shared one upgrades the lock and downgrades it
+again on exit. Neither flock() nor the upgrade between threads is atomic,
+so an exclusive section must not rely on anything it read before it started.
+
+Stages run in threads of one process and the flock() is held by the
+process, so each thread keeps its own stack of sections and an in-process
+reader/writer lock decides which threads may proceed; the flock() follows
+the strongest mode held by any thread.
+"""
+
+
+import errno
+import fcntl
+import os
+import threading
+import time
+
+import tracing
+
+
+SHARED = "shared"
+EXCLUSIVE = "exclusive"
+
+# lock file in the cache dir
+LOCK_FILE = "yumlock"
+
+_FLOCK_MODES = {
+    SHARED: fcntl.LOCK_SH,
+    EXCLUSIVE: fcntl.LOCK_EX,
+}
+
+
+class CacheLock(object):
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger
+        self.wait_time = {SHARED: 0.0, EXCLUSIVE: 0.0}   # seconds spent waiting for the lock
+        self._fd = None
+        self._flocked = None        # mode of the flock() held by the process
+        self._local = threading.local()
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0           # threads holding the lock shared
+        self._writer = None         # thread holding the lock exclusive
+        self._waiting_writers = 0
+
+    def shared(self):
+        return CacheLockSection(self, SHARED)
+
+    def exclusive(self):
+        return CacheLockSection(self, EXCLUSIVE)
+
+    def _held(self):
+        """Stack of modes of sections entered by the current thread."""
+        try:
+            return self._local.held
+        except AttributeError:
+            self._local.held = []
+            return self._local.held
+
+    @staticmethod
+    def _mode_of(held):
+        if not held:
+            return None
+        if EXCLUSIVE in held:
+            return EXCLUSIVE
+        return SHARED
+
+    @property
+    def mode(self):
+        """Mode of the lock held by the current thread: SHARED, EXCLUSIVE or None."""
+        return self._mode_of(self._held())
+
+    def acquire(self, mode):
+        held = self._held()
+        current = self._mode_of(held)
+        if mode == current or current == EXCLUSIVE:
+            held.append(mode)
+            return
+
+        with self._cond:
+            if mode == SHARED:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                self._readers += 1
+            else:
+                if current == SHARED:
+                    # upgrade: let other upgrading threads through first
+                    self._readers -= 1
+                    self._cond.notifyAll()
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = threading.currentThread()
+            try:
+                self._sync()
+            except:
+                self._drop(mode, current)
+                raise
+        held.append(mode)
+
+    def release(self):
+        held = self._held()
+        current = self._mode_of(held)
+        held.pop()
+        if current == self._mode_of(held):
+            return
+
+        with self._cond:
+            self._drop(current, self._mode_of(held))
+            self._sync()
+
+    def _drop(self, mode, new_mode):
+        """Account for the current thread going from mode to new_mode; called with _cond held."""
+        if mode == EXCLUSIVE:
+            self._writer = None
+        else:
+            self._readers -= 1
+        if new_mode == SHARED:
+            self._readers += 1
+        self._cond.notifyAll()
+
+    def _sync(self):
+        """Make the flock() match the modes held by the threads; called with _cond held."""
+        if self._writer is not None:
+            mode = EXCLUSIVE
+        elif self._readers:
+            mode = SHARED
+        else:
+            mode = None
+        if mode == self._flocked:
+            return
+        if mode is None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        elif mode == SHARED and self._flocked == EXCLUSIVE:
+            # downgrade; doesn't block
+            fcntl.flock(self._fd, _FLOCK_MODES[mode])
+        else:
+            self._flock(mode)
+        self._flocked = mode
+
+    def _flock(self, mode):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(self._fd, _FLOCK_MODES[mode] | fcntl.LOCK_NB)
+            return
+        except IOError, ex:
+            if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
+        if self.logger:
+            self.logger.info("Waiting for %s lock on %s" % (mode, self.path))
+        start = time.time()
+        fcntl.flock(self._fd, _FLOCK_MODES[mode])
+        wait = time.time() - start
+        self.wait_time[mode] += wait
+        tracing.count("cachelock:%s" % mode, seconds=wait)
+        if self.logger:
+            self.logger.info("Got %s lock on %s after %.1fs" % (mode, self.path, wait))
+
+
+class CacheLockSection(object):
+    """Context manager holding a CacheLock in a mode; can be entered repeatedly."""
+
+    def __init__(self, lock, mode):
+        self.lock = lock
+        self.mode = mode
+
+    def __enter__(self):
+        self.lock.acquire(self.mode)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.lock.release()
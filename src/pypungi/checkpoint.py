@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Stage checkpoints stored in the work dir.
+
+A checkpoint records the input hash of a finished stage and a digest of
+its outputs (sizes and mtimes of all files under the output paths).
+A checkpoint is valid if the input hash is the same and the outputs
+haven't changed since the stage finished.
+"""
+
+
+import hashlib
+import json
+import os
+import time
+
+
+def input_hash(*parts):
+    """Return hash of strings, used to chain stage inputs."""
+    result = hashlib.sha256()
+    for part in parts:
+        result.update(part)
+        result.update("\0")
+    return result.hexdigest()
+
+
+def snapshot(path):
+    """Return {"files": count, "digest": sha256} of all files under path, None if it doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    entries = []
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                entries.append(os.path.join(root, name))
+    else:
+        entries.append(path)
+
+    digest = hashlib.sha256()
+    for entry in entries:
+        try:
+            st = os.stat(entry)
+        except OSError:
+            # dangling symlink
+            st = os.lstat(entry)
+        digest.update("%s\0%s\0%s\n" % (os.path.relpath(entry, path), st.st_size, int(st.st_mtime)))
+    return {"files": len(entries), "digest": digest.hexdigest()}
+
+
+class CheckpointStore(object):
+    def __init__(self, path, base_hash, logger=None):
+        self.path = path
+        self.base_hash = base_hash
+        self.logger = logger
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _path(self, name):
+        return os.path.join(self.path, "%s.json" % name)
+
+    def load(self, name):
+        try:
+            fo = open(self._path(name), "r")
+        except IOError:
+            return None
+        try:
+            try:
+                return json.load(fo)
+            except ValueError:
+                return None
+        finally:
+            fo.close()
+
+    def save(self, name, stage_input, outputs):
+        data = {
+            "stage": name,
+            "input": stage_input,
+            "outputs": dict([ (i, snapshot(i)) for i in outputs ]),
+            "finished": time.time(),
+        }
+        tmp_path = "%s.tmp" % self._path(name)
+        fo = open(tmp_path, "w")
+        try:
+            json.dump(data, fo, sort_keys=True, indent=1)
+        finally:
+            fo.close()
+        os.rename(tmp_path, self._path(name))
+
+    def remove(self, name):
+        try:
+            os.unlink(self._path(name))
+        except OSError:
+            pass
+
+    def is_valid(self, name, stage_input, outputs):
+        data = self.load(name)
+        if data is None:
+            return False
+        if data.get("input", None) != stage_input:
+            self._log("Checkpoint of stage %s: inputs changed" % name)
+            return False
+        recorded = data.get("outputs", {})
+        if sorted(recorded.keys()) != sorted(outputs):
+            self._log("Checkpoint of stage %s: outputs changed" % name)
+            return False
+        for path in outputs:
+            if recorded[path] != snapshot(path):
+                self._log("Checkpoint of stage %s: %s changed" % (name, path))
+                return False
+        return True
+
+    def _log(self, msg):
+        if self.logger:
+            self.logger.info(msg)
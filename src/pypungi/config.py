@@ -14,7 +14,7 @@
 
 import os
 import time
-import yum
+import rpmUtils.arch
 
 from ConfigParser import SafeConfigParser
 
@@ -35,7 +35,7 @@ class Config(SafeConfigParser):
         self.set('pungi', 'product_path', 'Packages')
         self.set('pungi', 'cachedir', '/var/cache/pungi')
         self.set('pungi', 'compress_type', 'xz')
-        self.set('pungi', 'arch', yum.rpmUtils.arch.getBaseArch())
+        self.set('pungi', 'arch', rpmUtils.arch.getBaseArch())
         self.set('pungi', 'name', 'Fedora')
         self.set('pungi', 'iso_basename', 'Fedora')
         self.set('pungi', 'version', time.strftime('%Y%m%d', time.localtime()))
@@ -51,6 +51,8 @@ class Config(SafeConfigParser):
         self.set('pungi', 'full_archlist', "False")
         self.set('pungi', 'multilib', '')
         self.set('pungi', 'lookaside_repos', '')
+        self.set('pungi', 'lookaside_mode', 'full')
         self.set('pungi', 'resolve_deps', "True")
         self.set('pungi', 'no_dvd', "False")
         self.set('pungi', 'nomacboot', "False")
+        self.set('pungi', 'buildinstall_cache', "True")
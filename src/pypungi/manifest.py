@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Gather manifest: the result of gather() serialized to JSON.
+
+A manifest lists packages, source packages and debuginfo packages with
+their locations, checksums, sizes, repo ids and flags, so the download,
+createrepo and buildinstall stages can run in another invocation
+(or on another machine) without depsolving again.
+"""
+
+
+import json
+import os
+
+
+MANIFEST_VERSION = 1
+
+# manifest sections and the Pungi attributes holding their packages
+MANIFEST_LISTS = (
+    ("packages", "po_list"),
+    ("srpms", "srpm_po_list"),
+    ("debuginfo", "debuginfo_po_list"),
+)
+
+
+class ManifestPackage(object):
+    """A package read from a manifest; provides the package API used by the later stages."""
+
+    __slots__ = ("name", "epoch", "version", "release", "arch", "repoid", "baseurl", "basepath",
+                 "relativepath", "localpath", "checksum_type", "checksum", "size",
+                 "sourcerpm", "flags")
+
+    def __init__(self, record):
+        for key in self.__slots__:
+            setattr(self, key, record.get(key, None))
+        self.flags = record.get("flags", [])
+
+    def __str__(self):
+        return self.nvra
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.nvra)
+
+    @property
+    def pkgtup(self):
+        return (self.name, self.arch, self.epoch, self.version, self.release)
+
+    @property
+    def nvra(self):
+        return "%s-%s-%s.%s" % (self.name, self.version, self.release, self.arch)
+
+    def returnIdSum(self):
+        return (self.checksum_type, self.checksum)
+
+    def localPkg(self):
+        return self.localpath
+
+
+def package_record(po, flags):
+    """Return manifest record of a yum package object.
+       baseurl is where the package is downloaded from; basepath is kept
+       as yum reports it (None for packages under their repo's baseurl)."""
+    baseurl = po.basepath
+    if not baseurl and po.repo.urls:
+        baseurl = po.repo.urls[0]
+    checksum_type, checksum = po.returnIdSum()
+    return {
+        "name": po.name,
+        "epoch": po.epoch,
+        "version": po.version,
+        "release": po.release,
+        "arch": po.arch,
+        "repoid": po.repoid,
+        "baseurl": baseurl,
+        "basepath": po.basepath,
+        "relativepath": po.relativepath,
+        "localpath": po.localPkg(),
+        "checksum_type": checksum_type,
+        "checksum": checksum,
+        "size": po.size,
+        "sourcerpm": po.sourcerpm,
+        "flags": sorted(flags),
+    }
+
+
+def write_manifest(path, manifest):
+    """Write manifest dict to path atomically."""
+    manifest = dict(manifest)
+    manifest["version"] = MANIFEST_VERSION
+    tmp_path = "%s.tmp" % path
+    fo = open(tmp_path, "w")
+    try:
+        json.dump(manifest, fo, sort_keys=True, separators=(",", ":"))
+    finally:
+        fo.close()
+    os.rename(tmp_path, path)
+
+
+def read_manifest(path):
+    """Read manifest from path; package records are turned into ManifestPackage objects."""
+    fo = open(path, "r")
+    try:
+        manifest = json.load(fo)
+    finally:
+        fo.close()
+    if manifest.get("version", None) != MANIFEST_VERSION:
+        raise ValueError("Unsupported manifest version in %s: %s" % (path, manifest.get("version", None)))
+    for key, attr in MANIFEST_LISTS:
+        manifest[key] = [ ManifestPackage(i) for i in manifest.get(key, []) ]
+    return manifest
@@ -16,8 +16,14 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+import os
 import re
+import time
 import fnmatch
+import hashlib
+import json
+import cPickle as pickle
+import cachelock
 import pathmatch
 
 import pypungi
@@ -28,6 +34,14 @@ LINE_PATTERN_RE = re.compile(r"^\s*(?P<line>[^#]+)(:?\s+(?P<comment>#.*))?$")
 RUNTIME_PATTERN_SPLIT_RE = re.compile(r"^\s*(?P<path>[^\s]+)\s+(?P<pattern>[^\s]+)(:?\s+(?P<comment>#.*))?$")
 SONAME_PATTERN_RE = re.compile(r"^(.+\.so\.[a-zA-Z0-9_\.]+).*$")
 
+MULTILIB_CONF_DIR = "/usr/share/pungi/multilib"
+
+# parsed config files: {path: ((mtime, size), data)}
+_CONFIG_CACHE = {}
+
+# bump when pickled runtime patterns (pathmatch.PathMatch) change
+PATTERNS_PICKLE_FORMAT = 2
+
 
 def read_lines(lines):
     result = []
@@ -88,10 +102,191 @@ def expand_runtime_patterns(patterns):
     return pm
 
 
+def conf_path(name):
+    return os.path.join(MULTILIB_CONF_DIR, name)
+
+
+def file_version(path):
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+
+class NameSet(object):
+    """
+    A set of package names and fnmatch-style globs.
+    Exact names are looked up by hash and globs are combined into a
+    few compiled regexes, so a lookup doesn't loop over the patterns in Python.
+    """
+
+    GROUPS_PER_REGEX = 99
+
+    def __init__(self, patterns=None):
+        self.names = set()
+        self.globs = []
+        self._regex = None
+        for pattern in patterns or []:
+            self.add(pattern)
+
+    def add(self, pattern):
+        if pathmatch.GLOB_CHARS_RE.search(pattern):
+            if pattern not in self.globs:
+                self.globs.append(pattern)
+                self._regex = None
+        else:
+            self.names.add(pattern)
+
+    def match(self, name):
+        """Return the pattern matching name or None."""
+        if name in self.names:
+            return name
+        if not self.globs:
+            return None
+        if self._regex is None:
+            self._regex = self._compile()
+        for offset, regex in self._regex:
+            match = regex.match(name)
+            if match is not None:
+                return self.globs[offset + match.lastindex - 1]
+        return None
+
+    def _compile(self):
+        # one group per glob, lastindex tells which one matched;
+        # the re module supports at most 100 groups in a pattern
+        result = []
+        for offset in xrange(0, len(self.globs), self.GROUPS_PER_REGEX):
+            globs = self.globs[offset:offset + self.GROUPS_PER_REGEX]
+            result.append((offset, re.compile("|".join([ "(%s)" % fnmatch.translate(i) for i in globs ]))))
+        return result
+
+    def __contains__(self, name):
+        return self.match(name) is not None
+
+    def __iter__(self):
+        return iter(sorted(self.names) + self.globs)
+
+    def __len__(self):
+        return len(self.names) + len(self.globs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_regex"] = None
+        return state
+
+
+def read_set_from_file(path):
+    """Return lines of a blacklist/whitelist as a NameSet; each file version is parsed once."""
+    version = file_version(path)
+    cached = _CONFIG_CACHE.get(path, None)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    result = NameSet(read_lines_from_file(path))
+    _CONFIG_CACHE[path] = (version, result)
+    return result
+
+
+def get_cache_lock(cachedir, lock=None):
+    """Return lock, or a new lock of cachedir if it's None."""
+    if lock is None:
+        lock = cachelock.CacheLock(os.path.join(cachedir, cachelock.LOCK_FILE))
+    return lock
+
+
+def load_runtime_patterns(path, cachedir=None, lock=None):
+    """
+    Return expanded runtime patterns read from path.
+    The result is cached in memory and, if cachedir is set, pickled there;
+    both caches are keyed by the file's mtime and size, the pickle also
+    by PATTERNS_PICKLE_FORMAT. Pickles are written under the exclusive
+    cache lock (lock, or a new lock of cachedir).
+    """
+    version = file_version(path)
+    cached = _CONFIG_CACHE.get(path, None)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    pickle_path = None
+    if cachedir:
+        pickle_dir = os.path.join(cachedir, "multilib")
+        pickle_prefix = "%s-" % os.path.basename(path)
+        pickle_name = "%sv%s-%s-%s.pickle" % (pickle_prefix, PATTERNS_PICKLE_FORMAT, int(version[0]), version[1])
+        pickle_path = os.path.join(pickle_dir, pickle_name)
+
+    patterns = None
+    if pickle_path and os.path.exists(pickle_path):
+        try:
+            patterns = pickle.load(open(pickle_path, "rb"))
+            patterns.compile()
+        except (IOError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+            # unreadable or written by an incompatible version; rebuild
+            patterns = None
+
+    if patterns is None:
+        patterns = expand_runtime_patterns(read_runtime_patterns_from_file(path))
+        if pickle_path:
+            with get_cache_lock(cachedir, lock).exclusive():
+                if not os.path.isdir(pickle_dir):
+                    os.makedirs(pickle_dir)
+                # drop finished pickles of other versions; tmp files may be in use
+                for i in os.listdir(pickle_dir):
+                    if i.startswith(pickle_prefix) and i.endswith(".pickle") and i != pickle_name:
+                        os.remove(os.path.join(pickle_dir, i))
+                tmp_path = pickle_path + ".%s" % os.getpid()
+                tmp_file = open(tmp_path, "wb")
+                pickle.dump(patterns, tmp_file, pickle.HIGHEST_PROTOCOL)
+                tmp_file.close()
+                os.rename(tmp_path, pickle_path)
+        patterns.compile()
+
+    _CONFIG_CACHE[path] = (version, patterns)
+    return patterns
+
+
+class PackageFeatures(object):
+    """provides-derived properties of a package, shared by all multilib methods"""
+
+    __slots__ = ("is_kernel", "is_kernel_devel", "has_devel_provides", "sonames")
+
+    def __init__(self, po):
+        self.is_kernel = False
+        self.is_kernel_devel = False
+        self.has_devel_provides = False
+        sonames = set()
+
+        for p_name, p_flag, (p_e, p_v, p_r) in po.provides:
+            if p_name == "kernel":
+                self.is_kernel = True
+            elif p_name == "kernel-devel":
+                self.is_kernel_devel = True
+            if p_name.endswith("-devel") or p_name.endswith("-static"):
+                self.has_devel_provides = True
+            if ".so." in p_name:
+                match = SONAME_PATTERN_RE.match(p_name)
+                if match is not None:
+                    sonames.add(match.group(1))
+
+        self.sonames = frozenset(sonames)
+
+
+# {pkgtup: PackageFeatures}
+FEATURES_CACHE = {}
+
+
+def get_features(po):
+    """Return PackageFeatures of a package; computed once per pkgtup."""
+    features = FEATURES_CACHE.get(po.pkgtup, None)
+    if features is None:
+        features = PackageFeatures(po)
+        FEATURES_CACHE[po.pkgtup] = features
+    return features
+
+
 class MultilibMethodBase(object):
     """a base class for multilib methods"""
     name = "base"
 
+    def __init__(self, **kwargs):
+        pass
+
     def select(self, po):
         raise NotImplementedError
 
@@ -101,22 +296,14 @@ class MultilibMethodBase(object):
         return False
 
     def is_kernel(self, po):
-        for p_name, p_flag, (p_e, p_v, p_r) in po.provides:
-            if p_name == "kernel":
-                return True
-        return False
+        return get_features(po).is_kernel
 
     def is_kernel_devel(self, po):
-        for p_name, p_flag, (p_e, p_v, p_r) in po.provides:
-            if p_name == "kernel-devel":
-                return True
-        return False
+        return get_features(po).is_kernel_devel
 
     def is_kernel_or_kernel_devel(self, po):
-        for p_name, p_flag, (p_e, p_v, p_r) in po.provides:
-            if p_name in ("kernel", "kernel-devel"):
-                return True
-        return False
+        features = get_features(po)
+        return features.is_kernel or features.is_kernel_devel
 
 
 class NoneMultilibMethod(MultilibMethodBase):
@@ -142,11 +329,41 @@ class RuntimeMultilibMethod(MultilibMethodBase):
     name = "runtime"
 
     def __init__(self, **kwargs):
-        self.blacklist = read_lines_from_file("/usr/share/pungi/multilib/runtime-blacklist.conf")
-        self.whitelist = read_lines_from_file("/usr/share/pungi/multilib/runtime-whitelist.conf")
-        self.patterns = expand_runtime_patterns(read_runtime_patterns_from_file("/usr/share/pungi/multilib/runtime-patterns.conf"))
+        self.blacklist = read_set_from_file(conf_path("runtime-blacklist.conf"))
+        self.whitelist = read_set_from_file(conf_path("runtime-whitelist.conf"))
+        self.patterns = load_runtime_patterns(conf_path("runtime-patterns.conf"), kwargs.get("cachedir", None),
+                                              kwargs.get("cachelock", None))
+        self.dir_rules = {}         # {dirname: (dir_matches, [(filename_match, is_soname_pattern)])}
+        self.files_inspected = None # number of files inspected by the last select()
+
+    def get_dir_rules(self, dirname):
+        """Return compiled rules for files in a directory, cached for the whole run."""
+        rules = self.dir_rules.get(dirname, None)
+        if rules is not None:
+            return rules
+
+        dir_matches = False
+        file_rules = []
+        for dir_pattern, file_pattern in self.patterns[dirname]:
+            if file_pattern == "-":
+                # any file in the directory matches
+                dir_matches = True
+                file_rules = []
+                break
+            file_rules.append((re.compile(fnmatch.translate(file_pattern)).match, ".so.*" in file_pattern))
+        rules = (dir_matches, file_rules)
+        self.dir_rules[dirname] = rules
+        return rules
+
+    @staticmethod
+    def iter_files(po):
+        # query ghost files only if the regular ones don't decide
+        for ftype in ("file", "ghost"):
+            for path in po.returnFileEntries(ftype):
+                yield path
 
     def select(self, po):
+        self.files_inspected = 0
         if self.skip(po):
             return False
         if po.name in self.blacklist:
@@ -156,38 +373,41 @@ class RuntimeMultilibMethod(MultilibMethodBase):
         if self.is_kernel(po):
             return False
 
-        # gather all *.so.* provides from the RPM header
-        provides = set()
-        for i in po.provides:
-            match = SONAME_PATTERN_RE.match(i[0])
-            if match is not None:
-                provides.add(match.group(1))
-
-        for path in po.returnFileEntries() + po.returnFileEntries("ghost"):
+        sonames = get_features(po).sonames
+        inspected = 0
+        result = False
+        for path in self.iter_files(po):
+            inspected += 1
             dirname, filename = path.rsplit("/", 1)
             dirname = dirname.rstrip("/")
 
-            patterns = self.patterns[dirname]
-            if not patterns:
-                continue
-            for dir_pattern, file_pattern in patterns:
-                if file_pattern == "-":
-                    return True
-                if fnmatch.fnmatch(filename, file_pattern):
-                    if ".so.*" in file_pattern:
-                        if filename in provides:
-                            # return only if the lib is provided in RPM header
-                            # (some libs may be private, hence not exposed in Provides)
-                            return True
-                    else:
-                        return True
-        return False
+            dir_matches, file_rules = self.get_dir_rules(dirname)
+            if dir_matches:
+                result = True
+                break
+            for match, is_soname_pattern in file_rules:
+                if not match(filename):
+                    continue
+                if not is_soname_pattern:
+                    result = True
+                    break
+                if filename in sonames:
+                    # return only if the lib is provided in RPM header
+                    # (some libs may be private, hence not exposed in Provides)
+                    result = True
+                    break
+            if result:
+                break
+
+        self.files_inspected = inspected
+        return result
 
 
 class FileMultilibMethod(MultilibMethodBase):
     """explicitely defined whitelist and blacklist"""
+    name = "file"
+
     def __init__(self, **kwargs):
-        self.name = "file"
         whitelist = kwargs.pop("whitelist", None)
         blacklist = kwargs.pop("blacklist", None)
         self.whitelist = self.read_file(whitelist)
@@ -196,24 +416,21 @@ class FileMultilibMethod(MultilibMethodBase):
     @staticmethod
     def read_file(path):
         if not path:
-            return []
-        result = [ i.strip() for i in open(path, "r") if not i.strip().startswith("#") ]
+            return NameSet()
+        result = NameSet([ i.strip() for i in open(path, "r") if i.strip() and not i.strip().startswith("#") ])
         return result
 
     def select(self, po):
-        for pattern in self.blacklist:
-            if fnmatch.fnmatch(po.name, pattern):
-                return False
-        for pattern in self.whitelist:
-            if fnmatch.fnmatch(po.name, pattern):
-                return False
+        if po.name in self.blacklist:
+            return False
+        if po.name in self.whitelist:
+            return False
         return False
 
 
 class KernelMultilibMethod(MultilibMethodBase):
     """kernel and kernel-devel"""
-    def __init__(self, **kwargs):
-        self.name = "kernel"
+    name = "kernel"
 
     def select(self, po):
         if self.is_kernel_or_kernel_devel(po):
@@ -223,8 +440,7 @@ class KernelMultilibMethod(MultilibMethodBase):
 
 class YabootMultilibMethod(MultilibMethodBase):
     """yaboot on ppc"""
-    def __init__(self, **kwargs):
-        self.name = "yaboot"
+    name = "yaboot"
 
     def select(self, po):
         if po.arch in ["ppc"]:
@@ -238,8 +454,8 @@ class DevelMultilibMethod(MultilibMethodBase):
     name = "devel"
 
     def __init__(self, **kwargs):
-        self.blacklist = read_lines_from_file("/usr/share/pungi/multilib/devel-blacklist.conf")
-        self.whitelist = read_lines_from_file("/usr/share/pungi/multilib/devel-whitelist.conf")
+        self.blacklist = read_set_from_file(conf_path("devel-blacklist.conf"))
+        self.whitelist = read_set_from_file(conf_path("devel-whitelist.conf"))
 
     def select(self, po):
         if self.skip(po):
@@ -257,93 +473,297 @@ class DevelMultilibMethod(MultilibMethodBase):
             return True
         if po.name.endswith("-static"):
             return True
-        for p_name, p_flag, (p_e, p_v, p_r) in po.provides:
-            if p_name.endswith("-devel"):
-                return True
-            if p_name.endswith("-static"):
-                return True
+        if get_features(po).has_devel_provides:
+            return True
         return False
 
 
+class MethodMap(object):
+    """
+    {method_name: method} mapping which instantiates methods on first use,
+    so config files are read only for methods which are actually used.
+    """
+
+    def __init__(self, classes, **kwargs):
+        self.classes = dict([ (cls.name, cls) for cls in classes ])
+        self.kwargs = kwargs
+        self.methods = {}
+
+    def __contains__(self, name):
+        return name in self.classes
+
+    def __getitem__(self, name):
+        method = self.methods.get(name, None)
+        if method is None:
+            method = self.classes[name](**self.kwargs)
+            self.methods[name] = method
+        return method
+
+    def keys(self):
+        return self.classes.keys()
+
+
 DEFAULT_METHODS = ["devel", "runtime"]
-METHOD_MAP = {}
-for cls in (AllMultilibMethod, DevelMultilibMethod, FileMultilibMethod, KernelMultilibMethod, NoneMultilibMethod, RuntimeMultilibMethod, YabootMultilibMethod):
-    method = cls()
-    METHOD_MAP[method.name] = method
+METHOD_CLASSES = (AllMultilibMethod, DevelMultilibMethod, FileMultilibMethod, KernelMultilibMethod, NoneMultilibMethod, RuntimeMultilibMethod, YabootMultilibMethod)
+METHOD_MAP = MethodMap(METHOD_CLASSES)
+
+
+class VerdictCache(object):
+    """
+    Persistent {package checksum: multilib method or None} cache.
+    Verdicts depend on the methods, the multilib config files and this module,
+    so a file is kept for every combination of them in <cachedir>/multilib.
+    Entries unused for max_age seconds and files of other combinations
+    not written for max_age seconds are pruned on save(). save() runs
+    under the exclusive cache lock (lock, or a new lock of cachedir) and
+    merges entries saved meanwhile by other processes.
+    """
+
+    max_age = 30 * 24 * 3600
+
+    def __init__(self, cachedir, methods, lock=None):
+        self.lock = get_cache_lock(cachedir, lock)
+        self.dir = os.path.join(cachedir, "multilib")
+        self.config_hash = self.get_config_hash(methods)
+        self.path = os.path.join(self.dir, "verdicts-%s.json" % self.config_hash)
+        self.now = int(time.time())
+        self.changed = False
+        self.entries = self.load()  # {checksum: [method, last_used]}
+
+    def load(self):
+        try:
+            return json.load(open(self.path, "r"))
+        except (IOError, ValueError):
+            return {}
 
+    @staticmethod
+    def get_config_hash(methods):
+        checksum = hashlib.sha256()
+        checksum.update(" ".join([ i for i in methods if i ]))
+        paths = [os.path.splitext(__file__)[0] + ".py"]
+        if os.path.isdir(MULTILIB_CONF_DIR):
+            paths.extend(sorted([ conf_path(i) for i in os.listdir(MULTILIB_CONF_DIR) ]))
+        for path in paths:
+            if os.path.isfile(path):
+                checksum.update(path)
+                checksum.update(open(path, "r").read())
+        return checksum.hexdigest()[:16]
 
-def po_is_multilib(po, methods):
+    @staticmethod
+    def get_key(po):
+        return "%s:%s" % po.returnIdSum()
+
+    def get(self, po):
+        """Return (found, method)."""
+        entry = self.entries.get(self.get_key(po), None)
+        if entry is None:
+            return False, None
+        if entry[1] != self.now:
+            entry[1] = self.now
+            self.changed = True
+        return True, entry[0]
+
+    def set(self, po, method):
+        self.entries[self.get_key(po)] = [method, self.now]
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        with self.lock.exclusive():
+            self._save()
+
+    def _save(self):
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+
+        # keep entries saved by other processes since this cache was loaded
+        saved = self.load()
+        saved.update(self.entries)
+        self.entries = saved
+
+        limit = self.now - self.max_age
+        for key, (method, last_used) in self.entries.items():
+            if last_used < limit:
+                del self.entries[key]
+        for name in os.listdir(self.dir):
+            path = os.path.join(self.dir, name)
+            if name.startswith("verdicts-") and path != self.path and os.path.getmtime(path) < limit:
+                os.remove(path)
+
+        tmp_path = self.path + ".%s" % os.getpid()
+        tmp_file = open(tmp_path, "w")
+        json.dump(self.entries, tmp_file)
+        tmp_file.close()
+        os.rename(tmp_path, self.path)
+        self.changed = False
+
+
+def po_is_multilib(po, methods, method_map=None, verdict_cache=None):
+    if verdict_cache is not None:
+        found, result = verdict_cache.get(po)
+        if found:
+            return result
+
+    method_map = method_map or METHOD_MAP
+    result = None
     for method_name in methods:
         if not method_name:
             continue
-        method = METHOD_MAP[method_name]
+        method = method_map[method_name]
         if method.select(po):
-            return method_name
-    return None
-
-
-def do_multilib(yum_arch, methods, repos, tmpdir, logfile):
-    import os
-    import yum
-    import rpm
-    import logging
-
-    archlist = yum.rpmUtils.arch.getArchList(yum_arch)
-
-    yumbase = yum.YumBase()
-    yumbase.preconf.init_plugins = False
-    yumbase.preconf.root = tmpdir
-    # order matters!
-    # must run doConfigSetup() before touching yumbase.conf
-    yumbase.doConfigSetup(fn="/dev/null")
-    yumbase.conf.cache = False
-    yumbase.conf.cachedir = tmpdir
-    yumbase.conf.exactarch = True
-    yumbase.conf.gpgcheck = False
-    yumbase.conf.logfile = logfile
-    yumbase.conf.plugins = False
-    yumbase.conf.reposdir = []
-    yumbase.verbose_logger.setLevel(logging.ERROR)
-
-    yumbase.doRepoSetup()
-    yumbase.doTsSetup()
-    yumbase.doRpmDBSetup()
-    yumbase.ts.pushVSFlags((rpm._RPMVSF_NOSIGNATURES|rpm._RPMVSF_NODIGESTS))
-
-    for repo in yumbase.repos.findRepos("*"):
-        repo.disable()
-
-    for i, baseurl in enumerate(repos):
-        repo_id = "multilib-%s" % i
-        if "://" not in baseurl:
-            baseurl = "file://" + os.path.abspath(baseurl)
-        yumbase.add_enable_repo(repo_id, baseurls=[baseurl])
-
-    yumbase.doSackSetup(archlist=archlist)
-    yumbase.doSackFilelistPopulate()
-
-    method_kwargs = {}
+            result = method_name
+            break
+
+    if verdict_cache is not None:
+        verdict_cache.set(po, result)
+    return result
 
+
+def classify_packages(packages, methods):
+    """
+    Return [(pkgtup, method, {method_name: seconds}, files_inspected)] for packages;
+    timing covers only methods which were actually run, files_inspected is
+    the number of files the runtime method inspected (None if it didn't run).
+    """
     result = []
-    for po in sorted(yumbase.pkgSack):
-        method = po_is_multilib(po, methods)
-        if method:
-            nvra = "%s-%s-%s.%s.rpm" % (po.name, po.version, po.release, po.arch)
-            result.append((nvra, method))
+    for po in packages:
+        selected = None
+        timing = {}
+        files_inspected = None
+        for method_name in methods:
+            if not method_name:
+                continue
+            method = METHOD_MAP[method_name]
+            start = time.time()
+            found = method.select(po)
+            timing[method_name] = time.time() - start
+            if method_name == RuntimeMultilibMethod.name:
+                files_inspected = method.files_inspected
+            if found:
+                selected = method_name
+                break
+        # every package is seen once, don't let the cache grow
+        FEATURES_CACHE.pop(po.pkgtup, None)
+        result.append((po.pkgtup, selected, timing, files_inspected))
     return result
 
 
+def _classify_chunk(args):
+    # process pool worker
+    methods, packages = args
+    return classify_packages(packages, methods)
+
+
+def iter_chunks(packages, size):
+    chunk = []
+    for po in packages:
+        chunk.append(po)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def classify_repos(yum_arch, methods, repos, jobs=1, cachedir=None, chunk_size=500):
+    """
+    Classify packages of repos by streaming their repodata.
+    With jobs > 1, chunks of packages are classified in a process pool;
+    results are collected in input order, so output is deterministic.
+    Verdicts are cached in cachedir if set.
+    Return ([{"nvra", "method", "timing", "files_inspected"}] of multilib packages, {method_name: total seconds}).
+    """
+    import rpmUtils.arch
+    import rpmUtils.miscutils
+    import repodata
+
+    archlist = rpmUtils.arch.getArchList(yum_arch)
+
+    verdict_cache = None
+    if cachedir:
+        verdict_cache = VerdictCache(cachedir, methods)
+
+    result = {}     # {pkgtup: (method, timing, files_inspected)}
+    pending = {}    # {pkgtup: po} of packages being classified
+
+    def iter_uncached():
+        # yield packages which need classification, cached verdicts go straight to result
+        for baseurl in repos:
+            for po in repodata.iter_packages(baseurl, archlist=archlist):
+                if po.pkgtup in result or po.pkgtup in pending:
+                    continue
+                if verdict_cache is not None:
+                    found, method = verdict_cache.get(po)
+                    if found:
+                        result[po.pkgtup] = (method, {}, None)
+                        continue
+                pending[po.pkgtup] = po
+                yield po
+
+    chunks = ((methods, chunk) for chunk in iter_chunks(iter_uncached(), chunk_size))
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        classified = pool.imap(_classify_chunk, chunks)
+    else:
+        pool = None
+        classified = (_classify_chunk(i) for i in chunks)
+
+    total_timing = {}
+    for chunk_result in classified:
+        for pkgtup, method, timing, files_inspected in chunk_result:
+            result.setdefault(pkgtup, (method, timing, files_inspected))
+            po = pending.pop(pkgtup, None)
+            if po is not None and verdict_cache is not None:
+                verdict_cache.set(po, method)
+            for method_name, seconds in timing.iteritems():
+                total_timing[method_name] = total_timing.get(method_name, 0) + seconds
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if verdict_cache is not None:
+        verdict_cache.save()
+
+    def compare(pkgtup1, pkgtup2):
+        # same order as yum uses for sorting a package sack: name, evr, arch
+        (n1, a1, e1, v1, r1), (n2, a2, e2, v2, r2) = pkgtup1, pkgtup2
+        return cmp(n1, n2) or rpmUtils.miscutils.compareEVR((e1, v1, r1), (e2, v2, r2)) or cmp(a1, a2)
+
+    records = []
+    for pkgtup in sorted(result, compare):
+        method, timing, files_inspected = result[pkgtup]
+        if not method:
+            continue
+        name, arch, epoch, version, release = pkgtup
+        records.append({
+            "nvra": "%s-%s-%s.%s.rpm" % (name, version, release, arch),
+            "method": method,
+            "timing": timing,
+            "files_inspected": files_inspected,
+        })
+    return records, total_timing
+
+
+def do_multilib(yum_arch, methods, repos, tmpdir=None, logfile=None, cachedir=None, jobs=1):
+    """
+    Return [(nvra, method)] of multilib packages in repos.
+    tmpdir and logfile are unused and kept for compatibility.
+    """
+    records, total_timing = classify_repos(yum_arch, methods, repos, jobs=jobs, cachedir=cachedir)
+    return [ (i["nvra"], i["method"]) for i in records ]
+
+
 def main():
     import optparse
-    import shutil
-    import tempfile
 
     class MyOptionParser(optparse.OptionParser):
         def print_help(self, *args, **kwargs):
             optparse.OptionParser.print_help(self, *args, **kwargs)
             print
             print "Available multilib methods:"
-            for key, value in sorted(METHOD_MAP.items()):
+            for key, value in sorted(METHOD_MAP.classes.items()):
                 default = (key in DEFAULT_METHODS) and " (default)" or ""
                 print "  %-10s %s%s" % (key, value.__doc__ or "", default)
 
@@ -364,8 +784,24 @@ def main():
         action="append",
         help="path or url to yum repo; can be specified multiple times",
     )
-    parser.add_option("--tmpdir")
-    parser.add_option("--logfile", action="store")
+    parser.add_option(
+        "--cachedir",
+        help="directory for caching multilib verdicts between runs",
+    )
+    parser.add_option(
+        "--jobs",
+        type="int",
+        default=1,
+        help="number of processes classifying packages",
+    )
+    parser.add_option(
+        "--json",
+        action="store_true",
+        help="print nvra, method, per-method timing and files inspected by the runtime method as JSON",
+    )
+    # no longer used, kept for compatibility
+    parser.add_option("--tmpdir", help=optparse.SUPPRESS_HELP)
+    parser.add_option("--logfile", action="store", help=optparse.SUPPRESS_HELP)
 
     opts, args = parser.parse_args()
 
@@ -378,19 +814,20 @@ def main():
     for method_name in opts.method:
         if method_name not in METHOD_MAP:
             parser.error("unknown method: %s" % method_name)
-    print opts.method
+    if opts.jobs < 1:
+        parser.error("--jobs must be a positive number")
 
-    tmpdir = opts.tmpdir
-    if not opts.tmpdir:
-        tmpdir = tempfile.mkdtemp(prefix="multilib_")
+    if opts.json:
+        records, total_timing = classify_repos(opts.arch, opts.method, opts.repos, jobs=opts.jobs, cachedir=opts.cachedir)
+        print json.dumps({"methods": opts.method, "timing": total_timing, "packages": records}, indent=2, sort_keys=True)
+        return
 
-    nvra_list = do_multilib(opts.arch, opts.method, opts.repos, tmpdir, opts.logfile)
+    print opts.method
+
+    nvra_list = do_multilib(opts.arch, opts.method, opts.repos, cachedir=opts.cachedir, jobs=opts.jobs)
     for nvra, method in nvra_list:
         print "MULTILIB(%s): %s" % (method, nvra)
 
-    if not opts.tmpdir:
-        shutil.rmtree(tmpdir)
-
 
 if __name__ == "__main__":
     main()
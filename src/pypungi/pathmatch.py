@@ -2,6 +2,10 @@
 
 
 import fnmatch
+import re
+
+
+GLOB_CHARS_RE = re.compile(r"[*?\[]")
 
 
 def head_tail_split(name):
@@ -14,13 +18,36 @@ def head_tail_split(name):
     return head, tail
 
 
+def split_patterns(patterns):
+    """
+    Split {pattern: node} into a dict of exact names (looked up by hash)
+    and a list of (compiled_match, node) for glob patterns.
+    """
+    exact = {}
+    globs = []
+    for pattern, node in patterns.iteritems():
+        if GLOB_CHARS_RE.search(pattern):
+            globs.append((re.compile(fnmatch.translate(pattern)).match, node))
+        else:
+            exact[pattern] = node
+    return exact, globs
+
+
 class PathMatch(object):
     def __init__(self, parent=None, desc=None):
         self._patterns = {}
         self._final_patterns = {}
         self._values = []
+        self._value_set = set()
+
+        # compiled patterns and lookup memo; reset on every change
+        self._compiled = None
+        self._cache = {}
 
     def __setitem__(self, name, value):
+        self._compiled = None
+        self._cache = {}
+
         head, tail = head_tail_split(name)
 
         if tail is not None:
@@ -31,30 +58,65 @@ class PathMatch(object):
         else:
             if head not in self._final_patterns:
                 self._final_patterns[head] = PathMatch(parent=self, desc=head)
-            if value not in self._final_patterns[head]._values:
-                self._final_patterns[head]._values.append(value)
+            node = self._final_patterns[head]
+            if value not in node._value_set:
+                node._value_set.add(value)
+                node._values.append(value)
 
     def __getitem__(self, name):
+        result = self._cache.get(name, None)
+        if result is None:
+            result = self._lookup(name)
+            self._cache[name] = result
+        return list(result)
+
+    def compile(self):
+        """Precompile patterns of this node and all its subnodes."""
+        exact, globs = split_patterns(self._patterns)
+        exact_final, globs_final = split_patterns(self._final_patterns)
+        self._compiled = (exact, globs, exact_final, globs_final)
+        for node in self._patterns.itervalues():
+            node.compile()
+
+    def _lookup(self, name):
+        if self._compiled is None:
+            self.compile()
+        exact, globs, exact_final, globs_final = self._compiled
+
         result = []
+        seen = set()
         head, tail = head_tail_split(name)
-        for pattern in self._patterns:
-            if fnmatch.fnmatch(head, pattern):
-                if tail is None:
-                    values = self._patterns[pattern]._values
-                else:
-                    values = self._patterns[pattern][tail]
-                for value in values:
-                    if value not in result:
-                        result.append(value)
-
-        for pattern in self._final_patterns:
+
+        nodes = [ node for match, node in globs if match(head) ]
+        if head in exact:
+            nodes.append(exact[head])
+        for node in nodes:
             if tail is None:
-                x = head
+                values = node._values
             else:
-                x = "%s/%s" % (head, tail)
-            if fnmatch.fnmatch(x, pattern):
-                values = self._final_patterns[pattern]._values
-                for value in values:
-                    if value not in result:
-                        result.append(value)
+                values = node._lookup(tail)
+            for value in values:
+                if value not in seen:
+                    seen.add(value)
+                    result.append(value)
+
+        if tail is None:
+            x = head
+        else:
+            x = "%s/%s" % (head, tail)
+        nodes = [ node for match, node in globs_final if match(x) ]
+        if x in exact_final:
+            nodes.append(exact_final[x])
+        for node in nodes:
+            for value in node._values:
+                if value not in seen:
+                    seen.add(value)
+                    result.append(value)
         return result
+
+    def __getstate__(self):
+        # compiled regexes are cheap to rebuild, don't pickle them
+        state = self.__dict__.copy()
+        state["_compiled"] = None
+        state["_cache"] = {}
+        return state
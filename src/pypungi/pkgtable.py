@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Package table and bitset package sets for gather bookkeeping.
+
+The table assigns each package a dense integer id the first time it's
+seen and keeps name, arch and sourcerpm columns, so hot loops don't go
+back to yum package objects (whose attributes may be loaded lazily from
+sqlite). Packages are identified by pkgtup and repoid, so different
+objects of the same package share an id, while the same NVRA from two
+repos doesn't (yum doesn't consider them equal either).
+
+PackageSet is a set of packages of one table stored as a bitset over
+the ids: membership doesn't hash package objects, and sets are compact.
+"""
+
+
+# bit positions set in each byte value
+_BITS = tuple([ tuple([ bit for bit in range(8) if byte & (1 << bit) ]) for byte in range(256) ])
+
+
+class PackageTable(object):
+    def __init__(self):
+        self.packages = []      # package objects, index is id
+        self.names = []
+        self.arches = []
+        self.sourcerpms = []
+        self._by_object = {}    # {id(po): package id}
+        self._by_pkgtup = {}    # {(pkgtup, repoid): package id}
+        self._aliases = []      # other objects of known packages
+
+    def __len__(self):
+        return len(self.packages)
+
+    def find(self, po):
+        """Return id of a package, None if it's not in the table."""
+        result = self._by_object.get(id(po), None)
+        if result is None:
+            result = self._by_pkgtup.get((po.pkgtup, getattr(po, "repoid", None)), None)
+        return result
+
+    def id(self, po):
+        """Return id of a package, adding it to the table if needed."""
+        result = self._by_object.get(id(po), None)
+        if result is not None:
+            return result
+        pkgtup = (po.pkgtup, getattr(po, "repoid", None))
+        result = self._by_pkgtup.get(pkgtup, None)
+        if result is None:
+            result = len(self.packages)
+            self.packages.append(po)
+            self.names.append(po.name)
+            self.arches.append(po.arch)
+            self.sourcerpms.append(getattr(po, "sourcerpm", None))
+            self._by_pkgtup[pkgtup] = result
+        else:
+            # keep the object alive, so its id() isn't reused
+            self._aliases.append(po)
+        self._by_object[id(po)] = result
+        return result
+
+    def sourcerpm(self, po):
+        return self.sourcerpms[self.id(po)]
+
+
+class PackageSet(object):
+    """Set of packages backed by a bitset over PackageTable ids."""
+
+    def __init__(self, table, packages=()):
+        self.table = table
+        self._bits = bytearray()
+        self._len = 0
+        self.update(packages)
+
+    def __repr__(self):
+        return "<%s: %s packages>" % (self.__class__.__name__, self._len)
+
+    def __len__(self):
+        return self._len
+
+    def __nonzero__(self):
+        return self._len > 0
+
+    def _has(self, package_id):
+        byte = package_id >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (package_id & 7)))
+
+    def __contains__(self, po):
+        package_id = self.table.find(po)
+        return package_id is not None and self._has(package_id)
+
+    def ids(self):
+        """Iterate ids of packages in the set, in ascending order."""
+        bits = _BITS
+        for byte_index, byte in enumerate(self._bits):
+            if byte:
+                base = byte_index << 3
+                for bit in bits[byte]:
+                    yield base + bit
+
+    def __iter__(self):
+        packages = self.table.packages
+        for package_id in self.ids():
+            yield packages[package_id]
+
+    def add(self, po):
+        package_id = self.table.id(po)
+        byte = package_id >> 3
+        if byte >= len(self._bits):
+            self._bits.extend("\0" * (byte + 1 - len(self._bits)))
+        mask = 1 << (package_id & 7)
+        if not self._bits[byte] & mask:
+            self._bits[byte] |= mask
+            self._len += 1
+
+    def discard(self, po):
+        package_id = self.table.find(po)
+        if package_id is not None and self._has(package_id):
+            self._bits[package_id >> 3] &= ~(1 << (package_id & 7)) & 0xff
+            self._len -= 1
+
+    def remove(self, po):
+        if po not in self:
+            raise KeyError(po)
+        self.discard(po)
+
+    def update(self, packages):
+        if isinstance(packages, PackageSet) and packages.table is self.table:
+            # bytewise or
+            other = packages._bits
+            if len(other) > len(self._bits):
+                self._bits.extend("\0" * (len(other) - len(self._bits)))
+            bits = self._bits
+            count = 0
+            for i, byte in enumerate(other):
+                if byte:
+                    bits[i] |= byte
+            for byte in bits:
+                if byte:
+                    count += len(_BITS[byte])
+            self._len = count
+            return
+        for po in packages:
+            self.add(po)
+
+    def copy(self):
+        result = PackageSet(self.table)
+        result._bits = bytearray(self._bits)
+        result._len = self._len
+        return result
+
+    def clear(self):
+        self._bits = bytearray()
+        self._len = 0
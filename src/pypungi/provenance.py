@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Package provenance: why was a package added to the compose.
+
+Gather records an edge (package, reason, parent package, pattern) for
+every package it adds. The graph is written once, as JSON lines:
+  ["p", id, nevra, repoid]              a package
+  ["e", id, reason, parent_id, pattern] an edge; parent_id is null for roots
+Run this module to explain packages from a written file.
+"""
+
+
+import fnmatch
+import json
+
+
+REASONS = (
+    "input",            # matched a %packages or %prepopulate entry (pattern)
+    "conditional",      # conditional comps requirement
+    "dependency",       # provides a requirement (pattern) of parent
+    "langpack",         # langpack (pattern) of parent
+    "multilib",         # multilib counterpart of parent (pattern: method)
+    "fulltree",         # built from the same source (parent) as an included package
+    "source",           # source package of parent
+    "debuginfo",        # debuginfo of the source (parent)
+)
+
+
+def nevra(po):
+    return "%s-%s:%s-%s.%s" % (po.name, po.epoch or "0", po.version, po.release, po.arch)
+
+
+class Provenance(object):
+    def __init__(self):
+        self.packages = []          # [(nevra, repoid)], index is package id
+        self.edges = []             # [(id, reason, parent_id, pattern)]
+        self._ids = {}              # {po: id}
+        self._edge_set = set()
+
+    def package_id(self, po):
+        result = self._ids.get(po, None)
+        if result is None:
+            result = len(self.packages)
+            self.packages.append((nevra(po), po.repoid))
+            self._ids[po] = result
+        return result
+
+    def add(self, po, reason, parent=None, pattern=None):
+        if reason not in REASONS:
+            raise ValueError("Unknown reason: %s" % reason)
+        parent_id = None
+        if parent is not None:
+            parent_id = self.package_id(parent)
+        edge = (self.package_id(po), reason, parent_id, pattern)
+        if edge not in self._edge_set:
+            self._edge_set.add(edge)
+            self.edges.append(edge)
+
+    def write(self, path):
+        fo = open(path, "w")
+        try:
+            for package_id, (name, repoid) in enumerate(self.packages):
+                fo.write(json.dumps(["p", package_id, name, repoid]) + "\n")
+            for edge in self.edges:
+                fo.write(json.dumps(["e"] + list(edge)) + "\n")
+        finally:
+            fo.close()
+
+    @classmethod
+    def read(cls, path):
+        result = cls()
+        for line in open(path, "r"):
+            record = json.loads(line)
+            if record[0] == "p":
+                result.packages.append((record[2], record[3]))
+            elif record[0] == "e":
+                result.edges.append(tuple(record[1:]))
+        return result
+
+    def find(self, pattern):
+        """Return ids of packages whose name, name.arch or nevra matches pattern."""
+        result = []
+        for package_id, (package_nevra, repoid) in enumerate(self.packages):
+            name = package_nevra.rsplit("-", 2)[0]
+            name_arch = "%s.%s" % (name, package_nevra.rsplit(".", 1)[1])
+            for i in (name, name_arch, package_nevra):
+                if fnmatch.fnmatch(i, pattern):
+                    result.append(package_id)
+                    break
+        return result
+
+    def explain(self, package_id):
+        """Return lines explaining why a package was added, following parents up to a root."""
+        edges_by_id = {}
+        for edge in self.edges:
+            edges_by_id.setdefault(edge[0], []).append(edge)
+
+        name, repoid = self.packages[package_id]
+        result = ["%s (repo: %s)" % (name, repoid)]
+        for edge in edges_by_id.get(package_id, []):
+            seen = set([package_id])
+            depth = 1
+            while edge is not None:
+                child_id, reason, parent_id, pattern = edge
+                line = "%s<- %s" % ("  " * depth, reason)
+                if pattern:
+                    line += " '%s'" % pattern
+                if parent_id is not None:
+                    line += " of %s" % self.packages[parent_id][0]
+                result.append(line)
+                if parent_id is None or parent_id in seen:
+                    break
+                seen.add(parent_id)
+                edge = edges_by_id.get(parent_id, [None])[0]
+                depth += 1
+        return result
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser("%prog [options] <provenance.jsonl> <package pattern>...")
+    (opts, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error("Please specify a provenance file and at least one package")
+
+    provenance = Provenance.read(args[0])
+    for pattern in args[1:]:
+        package_ids = provenance.find(pattern)
+        if not package_ids:
+            print "%s: not in the compose" % pattern
+            continue
+        for package_id in package_ids:
+            print "\n".join(provenance.explain(package_id))
+
+
+if __name__ == "__main__":
+    main()
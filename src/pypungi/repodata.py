@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Streaming reader of yum repodata (repomd.xml, primary.xml, filelists.xml).
+
+Packages are parsed one at a time and the XML tree is discarded as soon as
+a package is complete, so memory use doesn't depend on the repo size.
+The package objects provide the subset of the yum package API used by
+multilib methods.
+"""
+
+
+import os
+import urllib2
+import urlparse
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+import util
+
+
+REPO_NS = "{http://linux.duke.edu/metadata/repo}"
+COMMON_NS = "{http://linux.duke.edu/metadata/common}"
+RPM_NS = "{http://linux.duke.edu/metadata/rpm}"
+FILELISTS_NS = "{http://linux.duke.edu/metadata/filelists}"
+
+COMPRESSION_SUFFIXES = {
+    ".gz": "gzip",
+    ".bz2": "bzip2",
+    ".xz": "xz",
+}
+
+
+class Package(object):
+    """A lightweight package record read from repodata."""
+
+    __slots__ = ("name", "arch", "epoch", "version", "release", "checksum_type", "checksum",
+                 "sourcerpm", "location", "size", "provides", "files", "ghosts")
+
+    def __init__(self, name, arch, epoch, version, release):
+        self.name = name
+        self.arch = arch
+        self.epoch = epoch
+        self.version = version
+        self.release = release
+        self.checksum_type = None
+        self.checksum = None
+        self.sourcerpm = None
+        self.location = None
+        self.size = 0
+        self.provides = []
+        self.files = []
+        self.ghosts = []
+
+    def __getstate__(self):
+        return [ getattr(self, i) for i in self.__slots__ ]
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+    def __str__(self):
+        return self.nvra
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.nvra)
+
+    @property
+    def pkgtup(self):
+        return (self.name, self.arch, self.epoch, self.version, self.release)
+
+    @property
+    def nvra(self):
+        return "%s-%s-%s.%s" % (self.name, self.version, self.release, self.arch)
+
+    def returnIdSum(self):
+        return (self.checksum_type, self.checksum)
+
+    def returnFileEntries(self, ftype="file"):
+        if ftype == "file":
+            return self.files
+        if ftype == "ghost":
+            return self.ghosts
+        return []
+
+
+def open_url(url):
+    """Open a local path, file:// or remote url for reading."""
+    if "://" not in url:
+        return open(url, "rb")
+    if url.startswith("file://"):
+        return open(url[len("file://"):], "rb")
+    return urllib2.urlopen(url)
+
+
+def join_url(baseurl, href):
+    if "://" not in baseurl:
+        return os.path.join(baseurl, href)
+    return urlparse.urljoin(baseurl.rstrip("/") + "/", href)
+
+
+def open_compressed(url):
+    """Open a local path or url for reading, decompressing it on the fly."""
+    fileobj = open_url(url)
+    compression = COMPRESSION_SUFFIXES.get(os.path.splitext(url)[1], None)
+    if compression:
+        fileobj = util.DecompressReader(fileobj, compression)
+    return fileobj
+
+
+def open_metadata(baseurl, href):
+    """Open a repodata file, decompressing it on the fly."""
+    return open_compressed(join_url(baseurl, href))
+
+
+def read_repomd(baseurl):
+    """Return {metadata_type: href} read from repodata/repomd.xml."""
+    result = {}
+    fileobj = open_url(join_url(baseurl, "repodata/repomd.xml"))
+    try:
+        tree = ElementTree.parse(fileobj)
+    finally:
+        fileobj.close()
+    for data in tree.getroot().findall(REPO_NS + "data"):
+        location = data.find(REPO_NS + "location")
+        result[data.get("type")] = location.get("href")
+    return result
+
+
+def iterparse(fileobj, tag):
+    """Yield complete elements with the given tag, freeing each of them afterwards."""
+    context = iter(ElementTree.iterparse(fileobj, events=("start", "end")))
+    event, root = context.next()
+    for event, elem in context:
+        if event == "end" and elem.tag == tag:
+            yield elem
+            root.clear()
+
+
+def iter_primary(fileobj, archlist=None):
+    """Yield Package objects from primary.xml; files are only those listed in primary.xml."""
+    for elem in iterparse(fileobj, COMMON_NS + "package"):
+        arch = elem.findtext(COMMON_NS + "arch")
+        if archlist is not None and arch not in archlist:
+            continue
+
+        version = elem.find(COMMON_NS + "version")
+        po = Package(elem.findtext(COMMON_NS + "name"), arch,
+                     version.get("epoch"), version.get("ver"), version.get("rel"))
+
+        checksum = elem.find(COMMON_NS + "checksum")
+        po.checksum_type = checksum.get("type")
+        po.checksum = checksum.text
+        po.location = elem.find(COMMON_NS + "location").get("href")
+        po.size = int(elem.find(COMMON_NS + "size").get("package"))
+
+        fmt = elem.find(COMMON_NS + "format")
+        po.sourcerpm = fmt.findtext(RPM_NS + "sourcerpm") or None
+        provides = fmt.find(RPM_NS + "provides")
+        if provides is not None:
+            for entry in provides.findall(RPM_NS + "entry"):
+                po.provides.append((entry.get("name"), entry.get("flags"),
+                                    (entry.get("epoch"), entry.get("ver"), entry.get("rel"))))
+        for entry in fmt.findall(COMMON_NS + "file"):
+            ftype = entry.get("type", "file")
+            if ftype == "file":
+                po.files.append(entry.text)
+            elif ftype == "ghost":
+                po.ghosts.append(entry.text)
+        yield po
+
+
+def iter_filelists(fileobj, archlist=None):
+    """Yield (pkgid, files, ghosts) from filelists.xml; directories are skipped."""
+    for elem in iterparse(fileobj, FILELISTS_NS + "package"):
+        if archlist is not None and elem.get("arch") not in archlist:
+            continue
+        files = []
+        ghosts = []
+        for entry in elem.findall(FILELISTS_NS + "file"):
+            ftype = entry.get("type", "file")
+            if ftype == "file":
+                files.append(entry.text)
+            elif ftype == "ghost":
+                ghosts.append(entry.text)
+        yield elem.get("pkgid"), files, ghosts
+
+
+def iter_packages(baseurl, archlist=None, filelists=True):
+    """
+    Yield Package objects of a repo, optionally limited to archlist.
+    With filelists enabled, primary.xml and filelists.xml are read side by side;
+    createrepo writes both in the same order, so only one package is held at a time.
+    """
+    repomd = read_repomd(baseurl)
+    primary = open_metadata(baseurl, repomd["primary"])
+    if not filelists:
+        try:
+            for po in iter_primary(primary, archlist):
+                yield po
+        finally:
+            primary.close()
+        return
+
+    files = open_metadata(baseurl, repomd["filelists"])
+    files_iter = iter_filelists(files, archlist)
+    pending = {}    # {pkgid: (files, ghosts)}; stays empty unless the order differs
+    try:
+        for po in iter_primary(primary, archlist):
+            while po.checksum not in pending:
+                try:
+                    pkgid, pkg_files, pkg_ghosts = files_iter.next()
+                except StopIteration:
+                    raise ValueError("Package %s missing in filelists: %s" % (po, baseurl))
+                pending[pkgid] = (pkg_files, pkg_ghosts)
+            po.files, po.ghosts = pending.pop(po.checksum)
+            yield po
+    finally:
+        primary.close()
+        files.close()
+
+
+def provides_match(name, flags, evr, prov_flags, prov_evr):
+    """Return True if a provide (flags, evr) of name satisfies a requirement (yum tuple)."""
+    if not flags or not prov_flags:
+        return True
+    # rpmUtils is needed only for versioned requirements
+    import rpmUtils.miscutils
+    return bool(rpmUtils.miscutils.rangeCompare((name, flags, evr), (name, prov_flags, prov_evr)))
+
+
+class FileProvidesIndex(object):
+    """
+    Packages providing requested file paths, read from filelists.xml.
+    Each update() batch streams filelists of each repo once and keeps only
+    entries of the requested paths, so memory use depends on the number of
+    requested paths rather than on the number of files in the repos.
+    """
+
+    def __init__(self, repos, archlist=None):
+        self.repos = repos          # [(repoid, path or url of filelists.xml[.gz])]
+        self.archlist = archlist
+        self.index = {}             # {path: [(repoid, pkgid, pkgtup)]}
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def get(self, path):
+        return self.index.get(path, [])
+
+    def update(self, paths):
+        """Index paths which are not indexed yet."""
+        paths = set([ i for i in paths if i not in self.index ])
+        if not paths:
+            return
+        result = dict([ (path, []) for path in paths ])
+        for repoid, url in self.repos:
+            fileobj = open_compressed(url)
+            try:
+                for elem in iterparse(fileobj, FILELISTS_NS + "package"):
+                    arch = elem.get("arch")
+                    if self.archlist is not None and arch not in self.archlist:
+                        continue
+                    entry = None
+                    for path in elem.findall(FILELISTS_NS + "file"):
+                        if path.text not in paths:
+                            continue
+                        if entry is None:
+                            version = elem.find(FILELISTS_NS + "version")
+                            entry = (repoid, elem.get("pkgid"), (elem.get("name"), arch, version.get("epoch"),
+                                                                 version.get("ver"), version.get("rel")))
+                        result[path.text].append(entry)
+            finally:
+                fileobj.close()
+        # only once all repos were read; on errors resolve_file_deps() falls back to yum
+        self.index.update(result)
+
+
+class LookasideIndex(object):
+    """
+    NVRAs and provides of lookaside repos, read from primary.xml
+    without creating yum package objects. File provides are limited
+    to files listed in primary.xml.
+    """
+
+    def __init__(self):
+        self.nvras = set()
+        self.provides = {}      # {name: [(flags, (epoch, ver, rel))]}
+        self.files = set()
+
+    def add_repo(self, primary, archlist=None):
+        """Index a repo given the path or url of its primary.xml[.gz]."""
+        fileobj = open_compressed(primary)
+        try:
+            for po in iter_primary(fileobj, archlist):
+                self.nvras.add(po.nvra)
+                for name, flags, evr in po.provides:
+                    self.provides.setdefault(name, []).append((flags, evr))
+                self.files.update(po.files)
+                self.files.update(po.ghosts)
+        finally:
+            fileobj.close()
+
+    def provides_req(self, name, flags=None, evr=(None, None, None)):
+        """Return True if a requirement (yum tuple) is provided by a lookaside package."""
+        if name.startswith("/") and name in self.files:
+            return True
+        for prov_flags, prov_evr in self.provides.get(name, []):
+            if provides_match(name, flags, evr, prov_flags, prov_evr):
+                return True
+        return False
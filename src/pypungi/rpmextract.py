@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Extract selected members of an RPM payload without unpacking it to disk.
+Only the "newc" cpio format (which is what rpm writes) is supported.
+"""
+
+
+import os
+import stat
+
+import util
+
+
+CPIO_MAGIC = ("070701", "070702")
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = "TRAILER!!!"
+CHUNK_SIZE = 65536
+
+
+def _padding(size):
+    return (4 - size % 4) % 4
+
+
+def _read(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of cpio archive")
+    return data
+
+
+def _copy(fileobj, size, target=None):
+    """Read size bytes from fileobj, writing them to target if set."""
+    while size > 0:
+        data = _read(fileobj, min(size, CHUNK_SIZE))
+        if target is not None:
+            target.write(data)
+        size -= len(data)
+
+
+def extract_cpio(fileobj, match, destdir):
+    """Extract members of a newc cpio stream for which match(name) is true.
+       Directories of extracted members are created as needed.
+       Return a list of extracted names."""
+
+    result = []
+    while True:
+        header = _read(fileobj, CPIO_HEADER_SIZE)
+        if header[:6] not in CPIO_MAGIC:
+            raise ValueError("Not a newc cpio archive")
+        fields = [int(header[i:i + 8], 16) for i in range(6, CPIO_HEADER_SIZE, 8)]
+        mode, filesize, namesize = fields[1], fields[6], fields[11]
+
+        name = _read(fileobj, namesize)[:-1]
+        _read(fileobj, _padding(CPIO_HEADER_SIZE + namesize))
+        if name == CPIO_TRAILER:
+            break
+
+        if name.startswith("./"):
+            name = name[2:]
+        name = os.path.normpath(name.lstrip("/"))
+        if name == "." or name.startswith("..") or not match(name):
+            _copy(fileobj, filesize + _padding(filesize))
+            continue
+
+        path = os.path.join(destdir, name)
+        if stat.S_ISDIR(mode):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            _copy(fileobj, filesize + _padding(filesize))
+            result.append(name)
+            continue
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if stat.S_ISLNK(mode):
+            os.symlink(_read(fileobj, filesize), path)
+        elif stat.S_ISREG(mode):
+            target = open(path, "wb")
+            _copy(fileobj, filesize, target)
+            target.close()
+            os.chmod(path, stat.S_IMODE(mode))
+        else:
+            # devices, fifos, ...
+            _copy(fileobj, filesize + _padding(filesize))
+            continue
+        _read(fileobj, _padding(filesize))
+        result.append(name)
+    return result
+
+
+def open_payload(path):
+    """Return a decompressed file-like object positioned at the start of
+       the cpio payload of an RPM."""
+    import rpm
+
+    fd = os.open(path, os.O_RDONLY)
+    ts = rpm.TransactionSet()
+    ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS)
+    try:
+        hdr = ts.hdrFromFdno(fd)
+    except rpm.error:
+        os.close(fd)
+        raise ValueError("Cannot read RPM header: %s" % path)
+    compression = hdr[rpm.RPMTAG_PAYLOADCOMPRESSOR] or "gzip"
+    # the descriptor is now positioned right after the header
+    return util.DecompressReader(os.fdopen(fd, "rb"), compression)
+
+
+def extract_rpm(path, match, destdir):
+    """Extract members of an RPM payload for which match(name) is true."""
+    payload = open_payload(path)
+    try:
+        return extract_cpio(payload, match, destdir)
+    finally:
+        payload.close()
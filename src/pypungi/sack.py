@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Packages of a yum sack split into native, multilib, source and debuginfo
+partitions, so gather phases only create package objects they look at.
+
+yum sets up the sack of all valid arches at once; a partition's package
+objects are read from it (searchNevra by arch) the first time it's used.
+Binary and debuginfo packages share arches, so reading native or multilib
+arches fills the respective part of the debuginfo partition; the
+debuginfo partition needs both.
+
+Binary packages are also indexed by their source package (siblings),
+split into native, multilib and noarch packages.
+"""
+
+
+import repodata
+import tracing
+
+
+PARTITIONS = ("native", "multilib", "source", "debuginfo")
+
+
+def source_nvr(po):
+    """Return name-version-release of the source package of po, or of po if it's a source package."""
+    if po.arch in ("src", "nosrc"):
+        return "%s-%s-%s" % (po.name, po.version, po.release)
+    if not po.sourcerpm:
+        return None
+    # arch can be "src" or "nosrc"
+    return po.sourcerpm.rsplit(".", 2)[0]
+
+
+class PartitionedSack(object):
+    def __init__(self, pkgsack, arches, native_arches, multilib_arches, package_filter=None):
+        """
+        arches are arches of packages in the sack; package_filter is applied
+        to binary packages once they're read. Source packages aren't
+        filtered: sources of included packages must be found regardless.
+        """
+        self.pkgsack = pkgsack
+        self.package_filter = package_filter
+        self._arch_groups = {
+            "native": [ i for i in arches if i in native_arches ],
+            "multilib": [ i for i in arches if i in multilib_arches ],
+            "source": [ i for i in arches if i in ("src", "nosrc") ],
+        }
+        self._groups = {}       # {arch group: (packages, debuginfo packages)}
+        self._refs = {}         # {partition: yum pkgdict}
+        self._nvr = {}          # {partition: {(name, ver, rel): [po]}}
+        self._siblings = None   # {source nvr: (native, multilib, noarch)}
+
+    def _group(self, name):
+        result = self._groups.get(name, None)
+        if result is None:
+            with tracing.span("sack:%s" % name):
+                packages = []
+                for arch in self._arch_groups[name]:
+                    packages.extend(self.pkgsack.searchNevra(arch=arch))
+                if self.package_filter is not None and name != "source":
+                    packages = self.package_filter(packages)
+            # same test as pypungi.is_debug()
+            debuginfo = [ i for i in packages if "debuginfo" in i.name ]
+            if debuginfo:
+                packages = [ i for i in packages if "debuginfo" not in i.name ]
+            result = (packages, debuginfo)
+            self._groups[name] = result
+        return result
+
+    def is_loaded(self, partition):
+        if partition == "debuginfo":
+            return "native" in self._groups and "multilib" in self._groups
+        return partition in self._groups
+
+    def packages(self, partition):
+        """Return list of packages of a partition; don't modify it."""
+        if partition == "debuginfo":
+            return self._group("native")[1] + self._group("multilib")[1]
+        if partition not in PARTITIONS:
+            raise ValueError("Unknown partition: %s" % partition)
+        return self._group(partition)[0]
+
+    def refs(self, partition):
+        """Return yum package dict of a partition for yum.packages.parsePackages()."""
+        result = self._refs.get(partition, None)
+        if result is None:
+            import yum
+            result = yum.packages.buildPkgRefDict(self.packages(partition), casematch=True)
+            self._refs[partition] = result
+        return result
+
+    def search_nvr(self, partition, name, ver, rel):
+        """Return packages of a partition with name, version and release."""
+        index = self._nvr.get(partition, None)
+        if index is None:
+            index = {}
+            for po in self.packages(partition):
+                index.setdefault((po.name, po.version, po.release), []).append(po)
+            self._nvr[partition] = index
+        return index.get((name, ver, rel), [])
+
+    def siblings(self, po):
+        """
+        Return (native, multilib, noarch) lists of binary packages built
+        from the same source package as po; don't modify them.
+        """
+        if self._siblings is None:
+            index = {}
+            with tracing.span("sack:siblings"):
+                for partition in ("native", "multilib"):
+                    for i in self.packages(partition):
+                        key = source_nvr(i)
+                        if key is None:
+                            continue
+                        entry = index.get(key, None)
+                        if entry is None:
+                            entry = index[key] = ([], [], [])
+                        if i.arch == "noarch":
+                            entry[2].append(i)
+                        elif partition == "multilib":
+                            entry[1].append(i)
+                        else:
+                            entry[0].append(i)
+            self._siblings = index
+        return self._siblings.get(source_nvr(po), ([], [], []))
+
+
+class ProvidesIndex(object):
+    """
+    Packages providing requested capabilities, looked up in the primary
+    metadata yum has already loaded. Each update() batch reads the provides
+    of the sack once: one query per repo for a yum sqlite sack, one pass
+    over the packages otherwise. Versioned requirements are matched from
+    memory.
+    """
+
+    # names per query, below the sqlite limit of bound parameters
+    query_size = 500
+
+    def __init__(self, pkgsack):
+        self.pkgsack = pkgsack
+        self.index = {}         # {name: [(po, flags, evr)]}
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def get(self, name, flags=None, evr=(None, None, None)):
+        """Return packages providing a requirement (yum tuple)."""
+        result = []
+        for po, prov_flags, prov_evr in self.index.get(name, []):
+            if po not in result and repodata.provides_match(name, flags, evr, prov_flags, prov_evr):
+                result.append(po)
+        return result
+
+    def update(self, names):
+        """Index names which are not indexed yet."""
+        names = set([ i for i in names if i not in self.index ])
+        if not names:
+            return
+        for name in names:
+            self.index[name] = []
+        if getattr(self.pkgsack, "primarydb", None):
+            provides = self._query_provides(sorted(names))
+        else:
+            provides = self._scan_provides(names)
+        for po, name, flags, evr in provides:
+            self.index[name].append((po, flags, evr))
+        for name in names:
+            self.index[name].sort(key=lambda i: (i[0].pkgtup, i[0].repoid))
+
+    def _scan_provides(self, names):
+        for po in self.pkgsack.returnPackages():
+            for name, flags, evr in po.provides:
+                if name in names:
+                    yield po, name, flags, evr
+
+    def _query_provides(self, names):
+        """Query the provides tables of the primary sqlite dbs yum has opened."""
+        for repo, db in self.pkgsack.primarydb.items():
+            cur = db.cursor()
+            for i in range(0, len(names), self.query_size):
+                chunk = names[i:i + self.query_size]
+                cur.execute("SELECT name, flags, epoch, version, release, pkgKey FROM provides"
+                            " WHERE name IN (%s)" % ",".join("?" * len(chunk)), chunk)
+                for name, flags, epoch, version, release, pkgKey in cur.fetchall():
+                    # None for excluded packages
+                    po = self.pkgsack._packageByKey(repo, pkgKey)
+                    if po is not None:
+                        yield po, name, flags, (epoch, version, release)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Compose stage graph and scheduler.
+
+Stages are added in the order they'd run sequentially; each one lists the
+stages it depends on and the resources it needs. With more than one job,
+independent stages run in threads as long as their resources are free.
+A resource may carry a lock (context manager) held while a stage uses it.
+
+With a checkpoint store, each finished stage records a checkpoint. On
+resume, stages with a valid checkpoint are skipped unless a stage they
+depend on runs again. A stage which runs still needs the in-memory state
+of the stages listed in its state_deps, so those run again too.
+"""
+
+
+import sys
+import threading
+import time
+
+import checkpoint
+import tracing
+
+
+class Stage(object):
+    def __init__(self, name, func, deps=(), resources=(), outputs=(), state_deps=(), checkpoint=True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.resources = tuple(resources)
+        self.outputs = tuple(outputs)
+        self.state_deps = tuple(state_deps)
+        self.checkpoint = checkpoint    # False: always run (e.g. stages printing results)
+        self.input_hash = None
+        self.skipped = False
+        self.start = None   # seconds since the scheduler started
+        self.end = None
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.name)
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+class Resource(object):
+    def __init__(self, name, capacity=1, lock=None):
+        self.name = name
+        self.capacity = capacity
+        self.lock = lock
+
+
+class StageGraph(object):
+    def __init__(self, checkpoints=None):
+        self.stages = []
+        self._stage_map = {}
+        self._resources = {}
+        self.checkpoints = checkpoints  # checkpoint.CheckpointStore or None
+
+    def __contains__(self, name):
+        return name in self._stage_map
+
+    def __getitem__(self, name):
+        return self._stage_map[name]
+
+    def add_resource(self, name, capacity=1, lock=None):
+        self._resources[name] = Resource(name, capacity, lock)
+
+    def add(self, name, func, deps=(), resources=(), outputs=(), state_deps=(), checkpoint=True):
+        """Add a stage; deps must be added first, which keeps the graph acyclic."""
+        if name in self._stage_map:
+            raise ValueError("Duplicate stage: %s" % name)
+        for dep in tuple(deps) + tuple(state_deps):
+            if dep not in self._stage_map:
+                raise ValueError("Stage %s depends on unknown stage: %s" % (name, dep))
+        for resource in resources:
+            if resource not in self._resources:
+                raise ValueError("Stage %s uses unknown resource: %s" % (name, resource))
+        stage = Stage(name, func, deps, resources, outputs, state_deps, checkpoint)
+        self.stages.append(stage)
+        self._stage_map[name] = stage
+        return stage
+
+    def _execute(self, stage, start_time):
+        stage.start = time.time() - start_time
+        try:
+            locks = [ self._resources[i].lock for i in stage.resources if self._resources[i].lock is not None ]
+            with tracing.span("stage:%s" % stage.name):
+                self._call_locked(stage.func, locks)
+        finally:
+            stage.end = time.time() - start_time
+        if self.checkpoints is not None and stage.checkpoint:
+            self.checkpoints.save(stage.name, stage.input_hash, stage.outputs)
+
+    def plan(self, resume=False):
+        """Compute stage input hashes and mark stages which can be skipped."""
+        if self.checkpoints is None:
+            return
+        for stage in self.stages:
+            stage.input_hash = checkpoint.input_hash(self.checkpoints.base_hash, stage.name,
+                                                     *[ self._stage_map[i].input_hash for i in stage.deps ])
+        if not resume:
+            for stage in self.stages:
+                self.checkpoints.remove(stage.name)
+            return
+
+        # skip stages with a valid checkpoint unless a dep runs again;
+        # stages without checkpoints produce no outputs for others
+        for stage in self.stages:
+            rerun_deps = [ i for i in stage.deps if self._stage_map[i].checkpoint and not self._stage_map[i].skipped ]
+            stage.skipped = stage.checkpoint and not rerun_deps \
+                and self.checkpoints.is_valid(stage.name, stage.input_hash, stage.outputs)
+
+        # stages which run need in-memory state of their state_deps;
+        # reverse order covers state_deps of state_deps
+        for stage in reversed(self.stages):
+            if stage.skipped:
+                continue
+            for name in stage.state_deps:
+                self._stage_map[name].skipped = False
+
+    def _call_locked(self, func, locks):
+        if not locks:
+            return func()
+        with locks[0]:
+            return self._call_locked(func, locks[1:])
+
+    def run(self, jobs=1, resume=False):
+        """Run all stages; an exception of a stage is re-raised once running stages finish."""
+        self.plan(resume=resume)
+        start_time = time.time()
+        if jobs <= 1:
+            for stage in self.stages:
+                if not stage.skipped:
+                    self._execute(stage, start_time)
+            return
+        self._run_parallel(jobs, start_time)
+
+    def _run_parallel(self, jobs, start_time):
+        cond = threading.Condition()
+        pending = [ i for i in self.stages if not i.skipped ]
+        running = set()
+        done = set([ i.name for i in self.stages if i.skipped ])
+        available = dict([ (name, resource.capacity) for name, resource in self._resources.iteritems() ])
+        errors = []
+
+        def worker(stage):
+            exc_info = None
+            try:
+                self._execute(stage, start_time)
+            except BaseException:
+                exc_info = sys.exc_info()
+            cond.acquire()
+            try:
+                running.remove(stage)
+                done.add(stage.name)
+                for resource in stage.resources:
+                    available[resource] += 1
+                if exc_info is not None:
+                    errors.append(exc_info)
+                cond.notify()
+            finally:
+                cond.release()
+
+        cond.acquire()
+        try:
+            while pending or running:
+                if not errors:
+                    for stage in pending[:]:
+                        if len(running) >= jobs:
+                            break
+                        if [ i for i in stage.deps if i not in done ]:
+                            continue
+                        if [ i for i in stage.resources if not available[i] ]:
+                            continue
+                        for resource in stage.resources:
+                            available[resource] -= 1
+                        pending.remove(stage)
+                        running.add(stage)
+                        thread = threading.Thread(target=worker, args=(stage, ), name=stage.name)
+                        thread.daemon = True
+                        thread.start()
+                if not running:
+                    break
+                # wait with a timeout, otherwise KeyboardInterrupt is not delivered
+                cond.wait(1)
+        finally:
+            cond.release()
+
+        if errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
+
+    def critical_path(self):
+        """
+        Return stages of the longest chain ending with the last finished stage.
+        A stage is preceded by the dependency or the stage holding a shared
+        resource which finished last before it started.
+        """
+        finished = [ i for i in self.stages if i.end is not None ]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda x: x.end)
+        result = [stage]
+        while True:
+            candidates = [ self._stage_map[i] for i in stage.deps ]
+            for other in finished:
+                if other is not stage and set(other.resources) & set(stage.resources) and other.end <= stage.start:
+                    candidates.append(other)
+            if not candidates:
+                break
+            stage = max(candidates, key=lambda x: x.end)
+            if stage in result:
+                break
+            result.insert(0, stage)
+        return result
+
+    def summary(self):
+        """Return lines of a timing summary; stages on the critical path are marked with '*'."""
+        critical = set([ i.name for i in self.critical_path() ])
+        result = []
+        result.append("%-2s %-24s %10s %10s" % ("", "stage", "start [s]", "time [s]"))
+        for stage in self.stages:
+            if stage.skipped:
+                result.append("%-2s %-24s %10s %10s" % ("", stage.name, "skipped", "-"))
+                continue
+            if stage.duration is None:
+                continue
+            mark = stage.name in critical and "*" or ""
+            result.append("%-2s %-24s %10.1f %10.1f" % (mark, stage.name, stage.start, stage.duration))
+        finished = [ i for i in self.stages if i.duration is not None ]
+        if finished:
+            wall = max([ i.end for i in finished ]) - min([ i.start for i in finished ])
+            total = sum([ i.duration for i in finished ])
+            critical_time = sum([ self._stage_map[i].duration for i in critical ])
+            result.append("wall time: %.1fs, stage time: %.1fs, critical path: %.1fs" % (wall, total, critical_time))
+        return result
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Compose profiling: timed spans and call counters.
+
+Spans record wall time, CPU time and peak RSS and can be written as
+a Chrome trace (chrome://tracing, Perfetto) and as a text summary.
+CPU time and peak RSS are process-wide, so spans running in parallel
+threads share them. Everything is a no-op until enable() is called.
+"""
+
+
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+
+_ENABLED = False
+_LOCK = threading.Lock()
+_START = None
+_EVENTS = []        # [(name, tid, start, wall, cpu, maxrss, args)]
+_COUNTERS = {}      # {name: [calls, seconds]}
+
+
+def enable():
+    global _ENABLED, _START
+    _START = time.time()
+    _ENABLED = True
+
+
+def is_enabled():
+    return _ENABLED
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _maxrss():
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class span(object):
+    """Context manager recording a span; args are shown in the trace viewer."""
+
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if _ENABLED:
+            self.start = time.time()
+            self.cpu = _cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if not _ENABLED:
+            return
+        wall = time.time() - self.start
+        cpu = _cpu_time() - self.cpu
+        event = (self.name, threading.current_thread().name, self.start - _START, wall, cpu, _maxrss(), self.args)
+        with _LOCK:
+            _EVENTS.append(event)
+
+
+def traced(name=None):
+    """Decorator recording a span for every call."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, calls=1, seconds=0.0):
+    if not _ENABLED:
+        return
+    with _LOCK:
+        counter = _COUNTERS.setdefault(name, [0, 0.0])
+        counter[0] += calls
+        counter[1] += seconds
+
+
+def counted(name=None, timed=True):
+    """Decorator counting calls (and their time) without recording spans; for hot functions."""
+    def decorator(func):
+        counter_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            if not timed:
+                count(counter_name)
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                count(counter_name, seconds=time.time() - start)
+        return wrapper
+    return decorator
+
+
+def write_chrome_trace(path):
+    """Write spans and counters in the Chrome trace event format."""
+    pid = os.getpid()
+    events = []
+    for name, tid, start, wall, cpu, maxrss, args in _EVENTS:
+        event_args = dict(args)
+        event_args["cpu_s"] = round(cpu, 6)
+        event_args["maxrss_kb"] = maxrss
+        events.append({
+            "name": name,
+            "ph": "X",
+            "pid": pid,
+            "tid": tid,
+            "ts": int(start * 1000000),
+            "dur": int(wall * 1000000),
+            "args": event_args,
+        })
+    end = max([ i[2] + i[3] for i in _EVENTS ] or [0])
+    for name, (calls, seconds) in sorted(_COUNTERS.items()):
+        events.append({
+            "name": name,
+            "ph": "C",
+            "pid": pid,
+            "ts": int(end * 1000000),
+            "args": {"calls": calls},
+        })
+    fo = open(path, "w")
+    try:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fo)
+    finally:
+        fo.close()
+
+
+def summary():
+    """Return lines of a summary: spans aggregated by name, then counters."""
+    spans = {}
+    for name, tid, start, wall, cpu, maxrss, args in _EVENTS:
+        item = spans.setdefault(name, [0, 0.0, 0.0, 0])
+        item[0] += 1
+        item[1] += wall
+        item[2] += cpu
+        item[3] = max(item[3], maxrss)
+
+    result = []
+    result.append("%-40s %8s %10s %10s %12s" % ("span", "calls", "wall [s]", "cpu [s]", "maxrss [MiB]"))
+    for name, (calls, wall, cpu, maxrss) in sorted(spans.items(), key=lambda x: -x[1][1]):
+        result.append("%-40s %8s %10.2f %10.2f %12.1f" % (name, calls, wall, cpu, maxrss / 1024.0))
+    result.append("")
+    result.append("%-40s %8s %10s" % ("counter", "calls", "time [s]"))
+    for name, (calls, seconds) in sorted(_COUNTERS.items()):
+        result.append("%-40s %8s %10.2f" % (name, calls, seconds))
+    return result
@@ -17,6 +17,9 @@ import os
 import shutil
 import sys
 import hashlib
+import zlib
+import bz2
+import threading
 
 def _doRunCommand(command, logger, rundir='/tmp', output=subprocess.PIPE, error=subprocess.PIPE, env=None):
     """Run a command and log the output.  Error out if we get something on stderr"""
@@ -121,3 +124,116 @@ def _doCheckSum(path, hash, logger):
     myfile.close()
 
     return '%s:%s' % (hash, sum.hexdigest())
+
+def _linktree(src, dst, logger, force=False):
+    """Recreate the directory tree 'src' at 'dst', linking files where
+    possible and copying them otherwise."""
+
+    for dirpath, dirnames, filenames in os.walk(src):
+        targetdir = os.path.join(dst, os.path.relpath(dirpath, src))
+        if not os.path.isdir(targetdir):
+            os.makedirs(targetdir)
+        for filename in filenames:
+            _link(os.path.join(dirpath, filename), os.path.join(targetdir, filename),
+                  logger, force=force)
+
+
+def _decompressor(compression):
+    """Return a decompressor object for a compression name used in RPM payloads
+    and repodata (gzip, bzip2, xz, lzma).  Python 2 has no lzma module in the
+    standard library, so None is returned for xz/lzma when pyliblzma is not
+    installed; the caller then pipes the data through xz instead."""
+
+    if compression in ("gzip", "gz"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression in ("bzip2", "bz2"):
+        return bz2.BZ2Decompressor()
+    if compression in ("xz", "lzma"):
+        try:
+            import lzma
+        except ImportError:
+            return None
+        return lzma.LZMADecompressor()
+    raise ValueError("Unsupported compression: %s" % compression)
+
+
+class _CommandReader(object):
+    """Read the output of a filter command fed from a file object."""
+
+    def __init__(self, fileobj, command):
+        self.fileobj = fileobj
+        self.command = command
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     close_fds=True)
+        self.feeder = threading.Thread(target=self._feed)
+        self.feeder.setDaemon(True)
+        self.feeder.start()
+
+    def _feed(self):
+        try:
+            try:
+                while True:
+                    data = self.fileobj.read(DecompressReader.chunk_size)
+                    if not data:
+                        break
+                    self.proc.stdin.write(data)
+            except (IOError, OSError):
+                # the reader went away early (close() before EOF)
+                pass
+        finally:
+            try:
+                self.proc.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    def read(self, size=-1):
+        data = self.proc.stdout.read(size)
+        if not data and self.proc.wait() != 0:
+            raise IOError("%s exited with status %s" % (self.command[0], self.proc.returncode))
+        return data
+
+    def close(self):
+        self.proc.stdout.close()
+        self.feeder.join()
+        self.fileobj.close()
+        self.proc.wait()
+
+
+class DecompressReader(object):
+    """A read-only file-like object decompressing a stream on the fly."""
+
+    chunk_size = 65536
+
+    def __init__(self, fileobj, compression):
+        self.decompressor = _decompressor(compression)
+        if self.decompressor is None:
+            fileobj = _CommandReader(fileobj, ["xz", "-dc"])
+        self.fileobj = fileobj
+        self.buffer = ""
+        self.eof = False
+
+    def _fill(self, size):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while not self.eof and (size < 0 or length < size):
+            data = self.fileobj.read(self.chunk_size)
+            if not data:
+                self.eof = True
+                flush = getattr(self.decompressor, "flush", None)
+                data = flush and flush() or ""
+            elif self.decompressor is not None:
+                data = self.decompressor.decompress(data)
+            chunks.append(data)
+            length += len(data)
+        self.buffer = "".join(chunks)
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            result, self.buffer = self.buffer, ""
+        else:
+            result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+    def close(self):
+        self.fileobj.close()
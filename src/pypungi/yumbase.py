@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Yum classes used by Pungi.
+Kept apart from pypungi so yum and urlgrabber are imported only by
+the stages which need them.
+"""
+
+
+import os
+
+import yum
+import urlgrabber.progress
+
+import tracing
+
+
+class CallBack(urlgrabber.progress.TextMeter):
+    """A call back function used with yum."""
+
+    def progressbar(self, current, total, name=None):
+        return
+
+
+class PungiYum(yum.YumBase):
+    """Subclass of Yum"""
+
+    def __init__(self, config):
+        self.pungiconfig = config
+        yum.YumBase.__init__(self)
+
+    def doLoggingSetup(self, debuglevel, errorlevel, syslog_ident=None, syslog_facility=None):
+        """Setup the logging facility."""
+
+        logdir = os.path.join(self.pungiconfig.get('pungi', 'destdir'), 'logs')
+        if not os.path.exists(logdir):
+            os.makedirs(logdir)
+        if self.pungiconfig.get('pungi', 'flavor'):
+            logfile = os.path.join(logdir, '%s.%s.log' % (self.pungiconfig.get('pungi', 'flavor'),
+                                                          self.pungiconfig.get('pungi', 'arch')))
+        else:
+            logfile = os.path.join(logdir, '%s.log' % (self.pungiconfig.get('pungi', 'arch')))
+
+        yum.logging.basicConfig(level=yum.logging.DEBUG, filename=logfile)
+
+    def doFileLogSetup(self, uid, logfile):
+        # This function overrides a yum function, allowing pungi to control
+        # the logging.
+        pass
+
+    @tracing.counted()
+    def whatProvides(self, *args, **kwargs):
+        return yum.YumBase.whatProvides(self, *args, **kwargs)
+
+    @tracing.counted()
+    def _bestPackageFromList(self, *args, **kwargs):
+        return yum.YumBase._bestPackageFromList(self, *args, **kwargs)
+
+    def _compare_providers(self, *args, **kwargs):
+        # HACK: always prefer 64bit over 32bit packages
+        result = yum.YumBase._compare_providers(self, *args, **kwargs)
+        if len(result) >= 2:
+            pkg1 = result[0][0]
+            pkg2 = result[1][0]
+            if pkg1.name == pkg2.name:
+                best_arch = self.arch.get_best_arch_from_list([pkg1.arch, pkg2.arch], self.arch.canonarch)
+                if best_arch != "noarch" and best_arch != pkg1.arch:
+                    result[0:1] = result[0:1:-1]
+        return result
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+"""
+Compare multilib.NameSet lookups with a linear fnmatch loop.
+Not collected by unittest; run it directly: python bench_nameset.py
+"""
+
+
+import fnmatch
+import os
+import sys
+import time
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(DIR, "..", "src", "pypungi"))
+
+from multilib import NameSet
+
+
+LOOKUPS = 200
+
+# fnmatch caches only 100 compiled patterns, beyond that every call recompiles
+MAX_LOOP_PATTERNS = 1000
+
+
+def fnmatch_loop(patterns, name):
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern):
+            return pattern
+    return None
+
+
+def main():
+    names = [ "package-%s" % i for i in xrange(LOOKUPS) ]
+    print "%8s %12s %12s" % ("patterns", "fnmatch [s]", "NameSet [s]")
+    for size in (10, 100, 1000, 10000):
+        patterns = [ "name-%s" % i for i in xrange(size - size / 10) ]
+        patterns += [ "glob-%s-*" % i for i in xrange(size / 10) ]
+        name_set = NameSet(patterns)
+
+        loop_time = "-"
+        if size <= MAX_LOOP_PATTERNS:
+            start = time.time()
+            for name in names:
+                fnmatch_loop(patterns, name)
+            loop_time = "%.4f" % (time.time() - start)
+
+        start = time.time()
+        for name in names:
+            name_set.match(name)
+        set_time = time.time() - start
+
+        print "%8s %12s %12.4f" % (size, loop_time, set_time)
+
+
+if __name__ == "__main__":
+    main()
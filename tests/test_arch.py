@@ -61,6 +61,27 @@ class TestArch(unittest.TestCase):
         self.assertEqual(get_valid_multilib_arches("athlon"), [])
         self.assertEqual(get_valid_multilib_arches("x86_64"), ['athlon', 'i686', 'i586', 'i486', 'i386'])
 
+    def test_get_valid_arches_returns_copy(self):
+        arches = get_valid_arches("x86_64")
+        arches.append("src")
+        self.assertEqual(get_valid_arches("x86_64"), ['x86_64', 'athlon', 'i686', 'i586', 'i486', 'i386', 'noarch'])
+
+    def test_arch_table(self):
+        table = get_arch_table("x86_64")
+        self.assertTrue(table is get_arch_table("x86_64"))
+        self.assertEqual(table.native_arches, frozenset(['x86_64', 'noarch']))
+        self.assertEqual(table.multilib_arches, frozenset(['athlon', 'i686', 'i586', 'i486', 'i386']))
+        self.assertEqual(table.compatible["i586"], frozenset(get_compatible_arches("i586")))
+
+        mask = table.mask(["i686", "noarch"])
+        self.assertEqual(table.arches(mask), set(["i686", "noarch"]))
+        self.assertTrue(table.compatible_mask["i386"] & mask & ~table.bit("noarch"))
+        self.assertFalse(table.compatible_mask["x86_64"] & mask & ~table.bit("noarch"))
+        # unknown arches don't modify the table
+        self.assertEqual(table.bit("ppc64"), 0)
+        self.assertEqual(table.mask(["ppc64", "i686"]), table.bit("i686"))
+        self.assertEqual(table.arches(table.mask(["ppc64"])), set())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+import cachelock
+
+
+class TestCacheLock(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_cachelock_")
+        self.path = os.path.join(self.tmp_dir, "yumlock")
+        self.lock = cachelock.CacheLock(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def try_flock(self, mode):
+        """Return True if another open file description can take the lock in mode."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            try:
+                fcntl.flock(fd, mode | fcntl.LOCK_NB)
+            except IOError:
+                return False
+            return True
+        finally:
+            os.close(fd)
+
+    def test_shared(self):
+        with self.lock.shared():
+            self.assertEqual(self.lock.mode, cachelock.SHARED)
+            self.assertTrue(self.try_flock(fcntl.LOCK_SH))
+            self.assertFalse(self.try_flock(fcntl.LOCK_EX))
+        self.assertEqual(self.lock.mode, None)
+        self.assertTrue(self.try_flock(fcntl.LOCK_EX))
+
+    def test_upgrade_downgrade(self):
+        section = self.lock.shared()
+        with section:
+            with self.lock.exclusive():
+                self.assertEqual(self.lock.mode, cachelock.EXCLUSIVE)
+                self.assertFalse(self.try_flock(fcntl.LOCK_SH))
+                # nested shared section keeps the exclusive lock
+                with section:
+                    self.assertEqual(self.lock.mode, cachelock.EXCLUSIVE)
+                self.assertFalse(self.try_flock(fcntl.LOCK_SH))
+            self.assertEqual(self.lock.mode, cachelock.SHARED)
+            self.assertTrue(self.try_flock(fcntl.LOCK_SH))
+        self.assertEqual(self.lock.mode, None)
+
+    def test_threads(self):
+        entered = threading.Event()
+        leave = threading.Event()
+        result = {}
+
+        def reader():
+            with self.lock.shared():
+                result["reader"] = self.lock.mode
+                entered.set()
+                leave.wait(5)
+
+        def writer():
+            with self.lock.exclusive():
+                result["writer"] = self.try_flock(fcntl.LOCK_SH)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        entered.wait(5)
+        # sections are per thread
+        self.assertEqual(self.lock.mode, None)
+        with self.lock.shared():
+            self.assertEqual(self.lock.mode, cachelock.SHARED)
+        # the other thread still holds the lock shared
+        self.assertFalse(self.try_flock(fcntl.LOCK_EX))
+
+        thread2 = threading.Thread(target=writer)
+        thread2.start()
+        thread2.join(0.2)
+        # the writer waits for the reader in the other thread
+        self.assertTrue(thread2.isAlive())
+        leave.set()
+        thread.join()
+        thread2.join()
+        self.assertEqual(result, {"reader": cachelock.SHARED, "writer": False})
+        self.assertTrue(self.try_flock(fcntl.LOCK_EX))
+
+    def test_wait_time(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        pid = os.fork()
+        if pid == 0:
+            # the lock belongs to the open file description shared with
+            # the child; the parent closes its fd, the child unlocks later
+            import time
+            time.sleep(0.2)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os._exit(0)
+        os.close(fd)
+        with self.lock.shared():
+            pass
+        os.waitpid(pid, 0)
+        self.assertTrue(self.lock.wait_time[cachelock.SHARED] > 0.1)
+        self.assertEqual(self.lock.wait_time[cachelock.EXCLUSIVE], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
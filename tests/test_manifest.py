@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import os
+import shutil
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+import manifest
+
+
+class FakeRepo(object):
+    urls = ["http://example.com/repo/"]
+
+
+class FakePackage(object):
+    name = "foo"
+    epoch = "0"
+    version = "1.0"
+    release = "1"
+    arch = "x86_64"
+    repoid = "base"
+    repo = FakeRepo()
+    basepath = None
+    relativepath = "Packages/foo-1.0-1.x86_64.rpm"
+    size = 1234
+    sourcerpm = "foo-1.0-1.src.rpm"
+
+    def returnIdSum(self):
+        return ("sha256", "abc")
+
+    def localPkg(self):
+        return "/var/cache/yum/base/packages/foo-1.0-1.x86_64.rpm"
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "gather-manifest.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_roundtrip(self):
+        record = manifest.package_record(FakePackage(), ["multilib", "input"])
+        self.assertEqual(record["baseurl"], "http://example.com/repo/")
+        self.assertEqual(record["flags"], ["input", "multilib"])
+
+        manifest.write_manifest(self.path, {"arch": "x86_64", "packages": [record]})
+        data = manifest.read_manifest(self.path)
+        self.assertEqual(data["srpms"], [])
+        self.assertEqual(len(data["packages"]), 1)
+
+        po = data["packages"][0]
+        self.assertEqual(po.pkgtup, ("foo", "x86_64", "0", "1.0", "1"))
+        self.assertEqual(po.returnIdSum(), ("sha256", "abc"))
+        self.assertEqual(po.localPkg(), FakePackage().localPkg())
+        self.assertEqual(po.size, 1234)
+        # download url, but listed relative to the repo like the yum package
+        self.assertEqual(po.baseurl, "http://example.com/repo/")
+        self.assertEqual(po.basepath, None)
+        self.assertEqual(po.flags, ["input", "multilib"])
+
+    def test_unsupported_version(self):
+        open(self.path, "w").write('{"version": 0}')
+        self.assertRaises(ValueError, manifest.read_manifest, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
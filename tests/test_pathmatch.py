@@ -66,6 +66,25 @@ class TestPathMatch(unittest.TestCase):
 
         self.assertEqual(sorted(self.pm["/lib/foo"]), ["/star/star1", "/star2"])
 
+    def test_exact_and_glob(self):
+        self.pm["/usr/lib"] = "/usr/lib"
+        self.pm["/usr/lib*"] = "/usr/lib*"
+        self.pm["/usr/lib"] = "/usr/lib"
+        self.assertEqual(self.pm._patterns["usr"]._final_patterns["lib"]._values, ["/usr/lib"])
+        self.assertEqual(sorted(self.pm["/usr/lib"]), ["/usr/lib", "/usr/lib*"])
+        self.assertEqual(sorted(self.pm["/usr/lib64"]), ["/usr/lib*"])
+        self.assertEqual(self.pm["/usr/share"], [])
+
+    def test_cache_invalidation(self):
+        self.pm["/lib"] = "/lib"
+        self.assertEqual(self.pm["/lib"], ["/lib"])
+        self.pm["/l?b"] = "/l?b"
+        self.assertEqual(sorted(self.pm["/lib"]), ["/l?b", "/lib"])
+
+        # returned lists are copies of the cached ones
+        self.pm["/lib"].append("foo")
+        self.assertEqual(sorted(self.pm["/lib"]), ["/l?b", "/lib"])
+
 
 if __name__ == "__main__":
     unittest.main()
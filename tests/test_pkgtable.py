@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+import pkgtable
+
+
+class FakePackage(object):
+    def __init__(self, name, arch="x86_64", repoid="base"):
+        self.name = name
+        self.arch = arch
+        self.repoid = repoid
+        self.sourcerpm = "%s-1.0-1.src.rpm" % name
+        self.pkgtup = (name, arch, "0", "1.0", "1")
+
+
+class TestPackageTable(unittest.TestCase):
+    def test_ids(self):
+        table = pkgtable.PackageTable()
+        bash = FakePackage("bash")
+        self.assertEqual(table.id(bash), 0)
+        self.assertEqual(table.id(FakePackage("glibc")), 1)
+        self.assertEqual(table.id(bash), 0)
+        # another object of the same package
+        self.assertEqual(table.id(FakePackage("bash")), 0)
+        # the same package in another repo
+        self.assertEqual(table.id(FakePackage("bash", repoid="updates")), 2)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.names, ["bash", "glibc", "bash"])
+        self.assertEqual(table.sourcerpm(bash), "bash-1.0-1.src.rpm")
+
+
+class TestPackageSet(unittest.TestCase):
+    def setUp(self):
+        self.table = pkgtable.PackageTable()
+        self.packages = [ FakePackage("pkg%03d" % i) for i in range(100) ]
+
+    def test_add_contains(self):
+        pkgs = pkgtable.PackageSet(self.table)
+        self.assertFalse(pkgs)
+        pkgs.add(self.packages[10])
+        pkgs.add(self.packages[10])
+        pkgs.add(self.packages[3])
+        self.assertEqual(len(pkgs), 2)
+        self.assertTrue(self.packages[10] in pkgs)
+        self.assertTrue(FakePackage("pkg010") in pkgs)
+        self.assertFalse(self.packages[11] in pkgs)
+        # lookups don't add packages to the table
+        self.assertFalse(FakePackage("unknown") in pkgs)
+        self.assertEqual(self.table.find(FakePackage("unknown")), None)
+        self.assertEqual(list(pkgs), [self.packages[10], self.packages[3]])
+
+    def test_discard_remove(self):
+        pkgs = pkgtable.PackageSet(self.table, self.packages[:5])
+        pkgs.discard(self.packages[2])
+        pkgs.discard(self.packages[50])
+        self.assertEqual(len(pkgs), 4)
+        self.assertFalse(self.packages[2] in pkgs)
+        self.assertRaises(KeyError, pkgs.remove, self.packages[2])
+        pkgs.remove(self.packages[0])
+        self.assertEqual(list(pkgs), self.packages[1:2] + self.packages[3:5])
+
+    def test_update(self):
+        first = pkgtable.PackageSet(self.table, self.packages[::2])
+        second = pkgtable.PackageSet(self.table, self.packages[::3])
+        expected = set(self.packages[::2]) | set(self.packages[::3])
+        first.update(second)
+        self.assertEqual(len(first), len(expected))
+        self.assertEqual(set(first), expected)
+        copy = first.copy()
+        copy.add(self.packages[1])
+        self.assertFalse(self.packages[1] in first)
+        self.assertEqual(len(copy), len(first) + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import os
+import shutil
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+import provenance
+
+
+class FakePackage(object):
+    def __init__(self, name, arch="x86_64", repoid="base"):
+        self.name = name
+        self.epoch = "0"
+        self.version = "1.0"
+        self.release = "1"
+        self.arch = arch
+        self.repoid = repoid
+
+
+class TestProvenance(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_provenance_")
+        self.bash = FakePackage("bash")
+        self.glibc = FakePackage("glibc")
+        self.glibc_i686 = FakePackage("glibc", arch="i686")
+
+        self.provenance = provenance.Provenance()
+        self.provenance.add(self.bash, "input", pattern="@core")
+        self.provenance.add(self.glibc, "dependency", self.bash, "libc.so.6()(64bit)")
+        self.provenance.add(self.glibc, "dependency", self.bash, "libc.so.6()(64bit)")
+        self.provenance.add(self.glibc_i686, "multilib", self.glibc, "runtime")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_duplicate_edges(self):
+        self.assertEqual(len(self.provenance.packages), 3)
+        self.assertEqual(len(self.provenance.edges), 3)
+
+    def test_unknown_reason(self):
+        self.assertRaises(ValueError, self.provenance.add, self.bash, "magic")
+
+    def test_write_read(self):
+        path = os.path.join(self.tmp_dir, "provenance.jsonl")
+        self.provenance.write(path)
+        loaded = provenance.Provenance.read(path)
+        self.assertEqual(loaded.packages, self.provenance.packages)
+        self.assertEqual(loaded.edges, self.provenance.edges)
+
+    def test_explain(self):
+        self.assertEqual(self.provenance.find("glibc"), [1, 2])
+        self.assertEqual(self.provenance.find("glibc.i686"), [2])
+        self.assertEqual(self.provenance.explain(2), [
+            "glibc-0:1.0-1.i686 (repo: base)",
+            "  <- multilib 'runtime' of glibc-0:1.0-1.x86_64",
+            "    <- dependency 'libc.so.6()(64bit)' of bash-0:1.0-1.x86_64",
+            "      <- input '@core'",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
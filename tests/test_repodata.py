@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+import repodata
+
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+  <data type="primary"><location href="repodata/primary.xml.gz"/></data>
+  <data type="filelists"><location href="repodata/filelists.xml.gz"/></data>
+</repomd>
+"""
+
+PRIMARY_PACKAGE = """<package type="rpm">
+  <name>%(name)s</name>
+  <arch>%(arch)s</arch>
+  <version epoch="0" ver="1.0" rel="1"/>
+  <checksum type="sha256" pkgid="YES">%(pkgid)s</checksum>
+  <size package="1234" installed="4321" archive="5000"/>
+  <location href="Packages/%(name)s-1.0-1.%(arch)s.rpm"/>
+  <format>
+    <rpm:sourcerpm>%(name)s-1.0-1.src.rpm</rpm:sourcerpm>
+    <rpm:provides>
+      <rpm:entry name="%(name)s" flags="EQ" epoch="0" ver="1.0" rel="1"/>
+      <rpm:entry name="lib%(name)s.so.1()(64bit)"/>
+    </rpm:provides>
+    <file>/usr/bin/%(name)s</file>
+  </format>
+</package>
+"""
+
+FILELISTS_PACKAGE = """<package pkgid="%(pkgid)s" name="%(name)s" arch="%(arch)s">
+  <version epoch="0" ver="1.0" rel="1"/>
+  <file>/usr/lib64/lib%(name)s.so.1</file>
+  <file type="dir">/usr/lib64/%(name)s</file>
+  <file type="ghost">/var/log/%(name)s.log</file>
+</package>
+"""
+
+PACKAGES = [
+    {"name": "foo", "arch": "x86_64", "pkgid": "aaa"},
+    {"name": "bar", "arch": "i686", "pkgid": "bbb"},
+    {"name": "baz", "arch": "noarch", "pkgid": "ccc"},
+]
+
+
+def write_gzip(path, data):
+    fo = gzip.open(path, "wb")
+    fo.write(data)
+    fo.close()
+
+
+def write_xz(path, data):
+    fo = open(path, "wb")
+    proc = subprocess.Popen(["xz", "-c"], stdin=subprocess.PIPE, stdout=fo)
+    proc.communicate(data)
+    fo.close()
+
+
+class TestRepodata(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_repodata_")
+        os.makedirs(os.path.join(self.tmpdir, "repodata"))
+        open(os.path.join(self.tmpdir, "repodata", "repomd.xml"), "w").write(REPOMD)
+
+        primary = ['<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="3">']
+        primary.extend([ PRIMARY_PACKAGE % i for i in PACKAGES ])
+        primary.append("</metadata>")
+        write_gzip(os.path.join(self.tmpdir, "repodata", "primary.xml.gz"), "\n".join(primary))
+
+        # filelists deliberately in a different order
+        filelists = ['<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="3">']
+        filelists.extend([ FILELISTS_PACKAGE % i for i in reversed(PACKAGES) ])
+        filelists.append("</filelists>")
+        write_gzip(os.path.join(self.tmpdir, "repodata", "filelists.xml.gz"), "\n".join(filelists))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_repomd(self):
+        repomd = repodata.read_repomd(self.tmpdir)
+        self.assertEqual(repomd["primary"], "repodata/primary.xml.gz")
+        self.assertEqual(repomd["filelists"], "repodata/filelists.xml.gz")
+
+    def test_iter_packages(self):
+        packages = list(repodata.iter_packages(self.tmpdir))
+        self.assertEqual([ i.nvra for i in packages ], ["foo-1.0-1.x86_64", "bar-1.0-1.i686", "baz-1.0-1.noarch"])
+
+        po = packages[0]
+        self.assertEqual(po.pkgtup, ("foo", "x86_64", "0", "1.0", "1"))
+        self.assertEqual(po.returnIdSum(), ("sha256", "aaa"))
+        self.assertEqual(po.sourcerpm, "foo-1.0-1.src.rpm")
+        self.assertEqual(po.size, 1234)
+        self.assertEqual(po.provides, [("foo", "EQ", ("0", "1.0", "1")), ("libfoo.so.1()(64bit)", None, (None, None, None))])
+        self.assertEqual(po.returnFileEntries(), ["/usr/lib64/libfoo.so.1"])
+        self.assertEqual(po.returnFileEntries("ghost"), ["/var/log/foo.log"])
+
+    def test_archlist(self):
+        packages = list(repodata.iter_packages("file://" + self.tmpdir, archlist=["x86_64", "noarch"]))
+        self.assertEqual([ i.name for i in packages ], ["foo", "baz"])
+
+    def test_primary_only(self):
+        packages = list(repodata.iter_packages(self.tmpdir, filelists=False))
+        self.assertEqual(len(packages), 3)
+        # only files listed in primary.xml
+        self.assertEqual(packages[1].returnFileEntries(), ["/usr/bin/bar"])
+
+    def test_xz_metadata(self):
+        repodir = os.path.join(self.tmpdir, "repodata")
+        for name in ("primary", "filelists"):
+            data = gzip.open(os.path.join(repodir, "%s.xml.gz" % name)).read()
+            write_xz(os.path.join(repodir, "%s.xml.xz" % name), data)
+            os.unlink(os.path.join(repodir, "%s.xml.gz" % name))
+        open(os.path.join(repodir, "repomd.xml"), "w").write(REPOMD.replace(".xml.gz", ".xml.xz"))
+
+        packages = list(repodata.iter_packages(self.tmpdir))
+        self.assertEqual([ i.nvra for i in packages ], ["foo-1.0-1.x86_64", "bar-1.0-1.i686", "baz-1.0-1.noarch"])
+        self.assertEqual(packages[2].returnFileEntries(), ["/usr/lib64/libbaz.so.1"])
+
+    def test_file_provides_index(self):
+        filelists = os.path.join(self.tmpdir, "repodata", "filelists.xml.gz")
+        index = repodata.FileProvidesIndex([("base", filelists)], archlist=["x86_64", "i686"])
+        index.update(["/usr/lib64/libfoo.so.1", "/var/log/bar.log", "/usr/lib64/bar", "/usr/lib64/baz", "/missing"])
+        self.assertEqual(index.get("/usr/lib64/libfoo.so.1"), [("base", "aaa", ("foo", "x86_64", "0", "1.0", "1"))])
+        # ghosts and directories are provided too
+        self.assertEqual(index.get("/var/log/bar.log"), [("base", "bbb", ("bar", "i686", "0", "1.0", "1"))])
+        self.assertEqual(index.get("/usr/lib64/bar"), [("base", "bbb", ("bar", "i686", "0", "1.0", "1"))])
+        self.assertTrue("/missing" in index)
+        self.assertEqual(index.get("/missing"), [])
+        # noarch is not in archlist
+        self.assertEqual(index.get("/usr/lib64/baz"), [])
+        self.assertFalse("/usr/lib64/libbaz.so.1" in index)
+        # only requested paths are kept
+        self.assertFalse("/var/log/foo.log" in index)
+        index.update(["/var/log/foo.log"])
+        self.assertEqual(index.get("/var/log/foo.log"), [("base", "aaa", ("foo", "x86_64", "0", "1.0", "1"))])
+        # indexed paths don't read filelists again
+        os.unlink(filelists)
+        index.update(["/var/log/foo.log", "/usr/lib64/libfoo.so.1"])
+
+    def test_lookaside_index(self):
+        index = repodata.LookasideIndex()
+        index.add_repo(os.path.join(self.tmpdir, "repodata", "primary.xml.gz"), archlist=["x86_64", "noarch"])
+        self.assertEqual(index.nvras, set(["foo-1.0-1.x86_64", "baz-1.0-1.noarch"]))
+        self.assertTrue(index.provides_req("libfoo.so.1()(64bit)"))
+        self.assertTrue(index.provides_req("baz"))
+        self.assertTrue(index.provides_req("/usr/bin/foo"))
+        self.assertFalse(index.provides_req("bar"))
+        self.assertFalse(index.provides_req("/usr/lib64/libfoo.so.1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import gzip
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+from StringIO import StringIO
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+from rpmextract import extract_cpio
+from util import DecompressReader
+
+
+def make_cpio(members):
+    """members: list of (name, mode, data)"""
+    result = []
+    for i, (name, mode, data) in enumerate(members + [("TRAILER!!!", 0, "")]):
+        name += "\0"
+        fields = [i + 1, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0]
+        header = "070701" + "".join(["%08X" % field for field in fields])
+        result.append(header + name)
+        result.append("\0" * ((4 - (len(header) + len(name)) % 4) % 4))
+        result.append(data)
+        result.append("\0" * ((4 - len(data) % 4) % 4))
+    return "".join(result)
+
+
+class TestExtractCpio(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_rpmextract_")
+        self.archive = make_cpio([
+            ("./usr/share/doc/release", stat.S_IFDIR | 0755, ""),
+            ("./usr/share/doc/release/GPL", stat.S_IFREG | 0644, "license text"),
+            ("./usr/bin/tool", stat.S_IFREG | 0755, "x" * 70001),
+            ("./usr/share/doc/release/README", stat.S_IFREG | 0644, "readme"),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_extract_matching(self):
+        result = extract_cpio(StringIO(self.archive), lambda name: name.endswith("GPL"), self.tmpdir)
+        self.assertEqual(result, ["usr/share/doc/release/GPL"])
+        path = os.path.join(self.tmpdir, "usr/share/doc/release/GPL")
+        self.assertEqual(open(path).read(), "license text")
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "usr/bin/tool")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "usr/share/doc/release/README")))
+
+    def test_extract_all(self):
+        result = extract_cpio(StringIO(self.archive), lambda name: True, self.tmpdir)
+        self.assertEqual(len(result), 4)
+        self.assertEqual(os.path.getsize(os.path.join(self.tmpdir, "usr/bin/tool")), 70001)
+        self.assertEqual(open(os.path.join(self.tmpdir, "usr/share/doc/release/README")).read(), "readme")
+
+    def test_extract_gzip_stream(self):
+        path = os.path.join(self.tmpdir, "payload.gz")
+        fo = gzip.open(path, "wb")
+        fo.write(self.archive)
+        fo.close()
+
+        reader = DecompressReader(open(path, "rb"), "gzip")
+        result = extract_cpio(reader, lambda name: name.endswith("README"), self.tmpdir)
+        reader.close()
+        self.assertEqual(result, ["usr/share/doc/release/README"])
+
+    def test_extract_xz_stream(self):
+        path = os.path.join(self.tmpdir, "payload.xz")
+        fo = open(path, "wb")
+        proc = subprocess.Popen(["xz", "-c"], stdin=subprocess.PIPE, stdout=fo)
+        proc.communicate(self.archive)
+        fo.close()
+
+        reader = DecompressReader(open(path, "rb"), "xz")
+        result = extract_cpio(reader, lambda name: name.endswith("README"), self.tmpdir)
+        reader.close()
+        self.assertEqual(result, ["usr/share/doc/release/README"])
+        self.assertEqual(open(os.path.join(self.tmpdir, "usr/share/doc/release/README")).read(), "readme")
+
+    def test_invalid_archive(self):
+        self.assertRaises(ValueError, extract_cpio, StringIO("x" * 200), lambda name: True, self.tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
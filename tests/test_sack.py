@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import os
+import sqlite3
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+import sack
+
+
+class FakePackage(object):
+    def __init__(self, name, arch, version="1.0", release="1", sourcerpm="glibc-1.0-1.src.rpm"):
+        self.name = name
+        self.arch = arch
+        self.version = version
+        self.release = release
+        self.sourcerpm = sourcerpm
+
+    def __repr__(self):
+        return "%s.%s" % (self.name, self.arch)
+
+
+class FakePkgSack(object):
+    def __init__(self, packages):
+        self.packages = packages
+        self.searched = []
+
+    def returnPackages(self):
+        self.searched.append(None)
+        return self.packages
+
+    def searchNevra(self, arch=None):
+        self.searched.append(arch)
+        return [ i for i in self.packages if i.arch == arch ]
+
+
+class TestPartitionedSack(unittest.TestCase):
+    def setUp(self):
+        self.bash = FakePackage("bash", "x86_64", sourcerpm="bash-1.0-1.src.rpm")
+        self.glibc = FakePackage("glibc", "x86_64")
+        self.glibc_i686 = FakePackage("glibc", "i686")
+        self.glibc_common = FakePackage("glibc-common", "noarch")
+        self.glibc_debuginfo = FakePackage("glibc-debuginfo", "x86_64")
+        self.glibc_src = FakePackage("glibc", "src", sourcerpm=None)
+        self.pkgsack = FakePkgSack([self.bash, self.glibc, self.glibc_i686, self.glibc_common,
+                                    self.glibc_debuginfo, self.glibc_src])
+        self.sack = sack.PartitionedSack(self.pkgsack, ["x86_64", "noarch", "i686", "src"],
+                                         ["x86_64", "noarch"], ["i686"], self._filter)
+
+    def _filter(self, packages):
+        return [ i for i in packages if i.name != "bash" ]
+
+    def test_lazy(self):
+        self.assertEqual(self.sack.packages("native"), [self.glibc, self.glibc_common])
+        self.assertEqual(self.pkgsack.searched, ["x86_64", "noarch"])
+        self.assertFalse(self.sack.is_loaded("multilib"))
+        self.assertFalse(self.sack.is_loaded("debuginfo"))
+
+    def test_partitions(self):
+        self.assertEqual(self.sack.packages("multilib"), [self.glibc_i686])
+        self.assertEqual(self.sack.packages("debuginfo"), [self.glibc_debuginfo])
+        self.assertEqual(self.sack.search_nvr("source", "glibc", "1.0", "1"), [self.glibc_src])
+        self.assertEqual(self.sack.search_nvr("multilib", "glibc", "1.0", "2"), [])
+        self.assertRaises(ValueError, self.sack.packages, "everything")
+
+    def test_siblings(self):
+        expected = ([self.glibc], [self.glibc_i686], [self.glibc_common])
+        self.assertEqual(self.sack.siblings(self.glibc_src), expected)
+        self.assertEqual(self.sack.siblings(self.glibc_i686), expected)
+        # filtered out
+        self.assertEqual(self.sack.siblings(self.bash), ([], [], []))
+
+
+class TestProvidesIndex(unittest.TestCase):
+    def setUp(self):
+        self.glibc = FakePackage("glibc", "x86_64")
+        self.glibc.pkgtup = ("glibc", "x86_64", "0", "1.0", "1")
+        self.glibc.repoid = "base"
+        self.glibc.provides = [("glibc", "EQ", ("0", "1.0", "1")), ("libc.so.6()(64bit)", None, (None, None, None))]
+
+    def test_update_get(self):
+        pkgsack = FakePkgSack([self.glibc])
+        index = sack.ProvidesIndex(pkgsack)
+        index.update(["glibc", "libc.so.6()(64bit)", "missing"])
+        index.update(["glibc"])
+        # one pass over the sack, nothing left for the second batch
+        self.assertEqual(pkgsack.searched, [None])
+        self.assertTrue("missing" in index)
+        self.assertEqual(index.get("glibc"), [self.glibc])
+        self.assertEqual(index.get("libc.so.6()(64bit)"), [self.glibc])
+        self.assertEqual(index.get("missing"), [])
+
+    def test_sqlite(self):
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE provides (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER)")
+        db.execute("INSERT INTO provides VALUES ('glibc', 'EQ', '0', '1.0', '1', 1)")
+        db.execute("INSERT INTO provides VALUES ('glibc', 'EQ', '0', '2.0', '1', 2)")
+        pkgsack = FakePkgSack([])
+        pkgsack.primarydb = {"base": db}
+        # pkgKey 2 is excluded
+        pkgsack._packageByKey = lambda repo, key: key == 1 and self.glibc or None
+        index = sack.ProvidesIndex(pkgsack)
+        index.update(["glibc", "missing"])
+        self.assertEqual(pkgsack.searched, [])
+        self.assertEqual(index.index["glibc"], [(self.glibc, "EQ", ("0", "1.0", "1"))])
+        self.assertEqual(index.get("missing"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+from stages import StageGraph
+from checkpoint import CheckpointStore
+
+
+class TestStageGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.log_lock = threading.Lock()
+
+    def stage(self, name, duration=0):
+        def func():
+            with self.log_lock:
+                self.log.append(("start", name))
+            time.sleep(duration)
+            with self.log_lock:
+                self.log.append(("end", name))
+        return func
+
+    def test_unknown_dependency(self):
+        graph = StageGraph()
+        self.assertRaises(ValueError, graph.add, "a", self.stage("a"), deps=["b"])
+        self.assertRaises(ValueError, graph.add, "a", self.stage("a"), resources=["yum"])
+
+    def test_serial(self):
+        graph = StageGraph()
+        graph.add("a", self.stage("a"))
+        graph.add("b", self.stage("b"))
+        graph.add("c", self.stage("c"), deps=["a"])
+        graph.run()
+        self.assertEqual(self.log, [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")])
+
+    def test_parallel(self):
+        graph = StageGraph()
+        graph.add_resource("yum", 1)
+        graph.add("a", self.stage("a", 0.1), resources=["yum"])
+        graph.add("b", self.stage("b", 0.1), resources=["yum"])
+        graph.add("c", self.stage("c", 0.1))
+        graph.add("d", self.stage("d"), deps=["a", "c"])
+        graph.run(jobs=4)
+
+        # a and b share a resource with capacity 1
+        self.assertTrue(self.log.index(("end", "a")) < self.log.index(("start", "b")))
+        # c is independent, d waits for a and c
+        self.assertTrue(self.log.index(("start", "c")) < self.log.index(("end", "a")))
+        self.assertTrue(self.log.index(("end", "c")) < self.log.index(("start", "d")))
+        self.assertTrue(self.log.index(("end", "a")) < self.log.index(("start", "d")))
+
+        self.assertEqual([ i.name for i in graph.critical_path() ], ["a", "b"])
+        self.assertEqual(len(graph.summary()), 6)
+
+    def test_failure(self):
+        def fail():
+            raise RuntimeError("failed")
+        graph = StageGraph()
+        graph.add("a", fail)
+        graph.add("b", self.stage("b"), deps=["a"])
+        graph.add("c", self.stage("c", 0.1))
+        self.assertRaises(RuntimeError, graph.run, jobs=2)
+        self.assertTrue(("start", "b") not in self.log)
+        self.assertTrue(("end", "c") in self.log)
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log = []
+        self.fail = set()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def stage(self, name, output=None):
+        def func():
+            self.log.append(name)
+            if name in self.fail:
+                raise RuntimeError(name)
+            if output:
+                open(output, "w").write(name)
+        return func
+
+    def make_graph(self, base_hash="base"):
+        graph = StageGraph(CheckpointStore(os.path.join(self.tmp_dir, "checkpoints"), base_hash))
+        out_b = os.path.join(self.tmp_dir, "b")
+        out_c = os.path.join(self.tmp_dir, "c")
+        graph.add("init", self.stage("init"))
+        graph.add("b", self.stage("b", out_b), deps=["init"], outputs=[out_b], state_deps=["init"])
+        graph.add("c", self.stage("c", out_c), deps=["b"], outputs=[out_c], state_deps=["init"])
+        graph.add("d", self.stage("d"), deps=["b"])
+        return graph
+
+    def test_resume_after_failure(self):
+        self.fail.add("c")
+        self.assertRaises(RuntimeError, self.make_graph().run)
+        self.assertEqual(self.log, ["init", "b", "c"])
+
+        # b is skipped; init runs again because c needs its state
+        self.fail = set()
+        self.log = []
+        graph = self.make_graph()
+        graph.run(resume=True)
+        self.assertEqual(self.log, ["init", "c", "d"])
+        self.assertTrue(graph["b"].skipped)
+
+        self.log = []
+        self.make_graph().run(resume=True)
+        self.assertEqual(self.log, [])
+
+    def test_changed_output(self):
+        self.make_graph().run()
+        os.unlink(os.path.join(self.tmp_dir, "b"))
+        self.log = []
+        self.make_graph().run(resume=True)
+        self.assertEqual(self.log, ["init", "b", "c", "d"])
+
+    def test_changed_input(self):
+        self.make_graph().run()
+        self.log = []
+        self.make_graph(base_hash="changed").run(resume=True)
+        self.assertEqual(self.log, ["init", "b", "c", "d"])
+
+
+if __name__ == "__main__":
+    unittest.main()
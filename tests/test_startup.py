@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+import os
+import subprocess
+import sys
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+# seconds allowed for importing pypungi before any stage runs
+STARTUP_BUDGET = 1.0
+
+# modules which only stages are supposed to import
+HEAVY_MODULES = ("yum", "createrepo", "pylorax", "urlgrabber")
+
+STARTUP_SCRIPT = """
+import sys
+import time
+import types
+start = time.time()
+try:
+    import rpmUtils.arch
+except ImportError:
+    # pypungi.arch needs rpmUtils (from yum) only when its functions are called
+    for name in ("rpmUtils", "rpmUtils.arch"):
+        sys.modules[name] = types.ModuleType(name)
+    sys.modules["rpmUtils"].arch = sys.modules["rpmUtils.arch"]
+import pypungi
+import pypungi.config
+print time.time() - start
+print " ".join([ i for i in %r if i in sys.modules ])
+""" % (HEAVY_MODULES, )
+
+
+class TestStartup(unittest.TestCase):
+
+    def run_startup(self):
+        env = os.environ.copy()
+        env["PYTHONPATH"] = SRC_DIR
+        proc = subprocess.Popen([sys.executable, "-c", STARTUP_SCRIPT], stdout=subprocess.PIPE, env=env)
+        output = proc.communicate()[0]
+        self.assertEqual(proc.returncode, 0)
+        duration, modules = output.split("\n", 1)
+        return float(duration), modules.split()
+
+    def test_no_heavy_imports(self):
+        duration, modules = self.run_startup()
+        self.assertEqual(modules, [])
+
+    def test_startup_budget(self):
+        duration, modules = self.run_startup()
+        self.assertTrue(duration < STARTUP_BUDGET, "Importing pypungi took %.3fs" % duration)
+
+
+if __name__ == "__main__":
+    unittest.main()
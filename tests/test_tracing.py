@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+
+import unittest
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pypungi")))
+
+import tracing
+
+
+@tracing.traced()
+def stage():
+    return hot(1)
+
+
+@tracing.counted("hot")
+def hot(value):
+    return value + 1
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        del tracing._EVENTS[:]
+        tracing._COUNTERS.clear()
+
+    def tearDown(self):
+        tracing._ENABLED = False
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+        self.assertEqual(stage(), 2)
+        with tracing.span("noop"):
+            pass
+        self.assertEqual(tracing._EVENTS, [])
+        self.assertEqual(tracing._COUNTERS, {})
+
+    def test_trace(self):
+        tracing.enable()
+        self.assertEqual(stage(), 2)
+        with tracing.span("phase", pass_num=1):
+            hot(2)
+
+        path = os.path.join(self.tmp_dir, "trace.json")
+        tracing.write_chrome_trace(path)
+        events = json.load(open(path))["traceEvents"]
+        spans = dict([ (i["name"], i) for i in events if i["ph"] == "X" ])
+        self.assertEqual(sorted(spans), ["phase", "stage"])
+        self.assertEqual(spans["phase"]["args"]["pass_num"], 1)
+        self.assertTrue("maxrss_kb" in spans["stage"]["args"])
+        counters = [ i for i in events if i["ph"] == "C" ]
+        self.assertEqual(counters[0]["args"], {"calls": 2})
+
+        summary = tracing.summary()
+        self.assertTrue([ i for i in summary if i.startswith("hot ") ])
+
+
+if __name__ == "__main__":
+    unittest.main()